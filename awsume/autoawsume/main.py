@@ -1,18 +1,20 @@
 import json
-import configparser
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import RotatingFileHandler
 from datetime import datetime, timedelta
-import dateutil
 
-from ..awsumepy.lib.aws_files import get_aws_files
+from ..awsumepy.lib.aws_files import delete_section, get_aws_files
 from ..awsumepy.lib.logger import LogFormatter
 from ..awsumepy.lib.logger import logger as awsume_logger
+from ..awsumepy.lib import cache as cache_lib
 from ..awsumepy.lib import constants
 from ..awsumepy.lib import exceptions
-from ..awsumepy.lib.config_management import migrate_to_xdg_base_directories
+from ..awsumepy.lib.config_management import load_config, migrate_to_xdg_base_directories
 from .. import awsumepy
+from ..awsumepy import default_plugins
+from .scheduler import REFRESH_MARGIN, RefreshScheduler, get_next_check, parse_expiration, to_local_time
 
 logger = logging.getLogger('autoawsume') # type: logging.Logger
 
@@ -23,60 +25,101 @@ def main():
     logger.debug('Getting credentials file')
     _, credentials_file = get_aws_files(None, None)
     logger.debug('Credentials file: {}'.format(credentials_file))
+    max_workers = int(load_config().get('max-workers', constants.DEFAULT_MAX_WORKERS))
+    # the awsume calls that refresh profiles only get new role credentials once the cached ones are within the role margin
+    refresh_margin = min(cache_lib.get_refresh_margin('autoawsume'), cache_lib.get_refresh_margin('role'))
+    logger.debug('Refresh margin: {}s'.format(refresh_margin))
 
+    scheduler = RefreshScheduler(credentials_file)
     while True:
-        logger.info('Scanning profiles')
-        credentials = configparser.ConfigParser()
-        credentials.read(credentials_file)
-        auto_profiles = {k: dict(v) for k, v in credentials._sections.items() if v.get('autoawsume')}
-
-        expirations = []
-        for profile_name, auto_profile in auto_profiles.items():
-            logger.info('Looking at profile [{}]: {}'.format(profile_name, redact_profile(auto_profile)))
-            expiration = datetime.strptime(auto_profile['expiration'], '%Y-%m-%d %H:%M:%S')
-            if 'source_expiration' in auto_profile:
-                source_expiration = datetime.strptime(auto_profile['source_expiration'], '%Y-%m-%d %H:%M:%S')
-            else:
-                source_expiration = None
-            if source_expiration is not None and source_expiration < datetime.now():
-                logger.debug('Source is expired')
-                if expiration < datetime.now():
-                    logger.debug('Role credentials are expired')
-                    delete_profile(profile_name, credentials_file)
-                else:
-                    logger.debug('Role credentials are not expired')
-                    expirations.append(expiration)
-            else:
-                logger.debug('Source credentials are not expired')
-                if expiration - timedelta(seconds=60) < datetime.now():
-                    logger.debug('Role credentials are expired or will expire in less than 60s')
-                    session = refresh_profile(auto_profile)
-                    if session:
-                        logger.debug('Received session from awsume call')
-                        expirations.append(session.awsume_credentials.get('Expiration'))
-                    else:
-                        logger.debug('No session returned from awsume call')
-                        delete_profile(profile_name, credentials_file)
-                else:
-                    logger.debug('Role credentials are not expired')
-                    expirations.append(expiration)
-                    if source_expiration is not None:
-                        expirations.append(source_expiration)
-        logger.debug('Collected expirations: {}'.format(json.dumps(expirations, default=str)))
-
-        if not expirations:
+        if scheduler.sync():
+            logger.info('Credentials file changed, {} auto profiles scheduled'.format(len(scheduler)))
+
+        due = [(profile_name, scheduler.profiles[profile_name]) for profile_name in scheduler.pop_due()]
+        prefetch_credentials([auto_profile for _, auto_profile in due if needs_refresh(auto_profile, refresh_margin)], max_workers)
+        for profile_name, auto_profile in due:
+            next_check = check_profile(profile_name, auto_profile, credentials_file, refresh_margin)
+            if next_check is not None and profile_name in scheduler.profiles:
+                logger.debug('Next check of [{}]: {}'.format(profile_name, next_check))
+                scheduler.schedule(profile_name, next_check)
+
+        if not len(scheduler):
             break
 
-        local_expirations = [_.astimezone(dateutil.tz.tzlocal()) for _ in expirations]
-        earliest_expiration = min(local_expirations)
-        logger.debug('Earliest expiration: {}'.format(earliest_expiration))
-        time_to_sleep = max(0, (earliest_expiration - datetime.now().replace(tzinfo=earliest_expiration.tzinfo)).total_seconds() - 60)
-        logger.debug('Time to sleep: {}'.format(time_to_sleep))
-        time.sleep(time_to_sleep)
+        time_to_wait = scheduler.seconds_until_next()
+        logger.debug('Time to wait: {}'.format(time_to_wait))
+        time.sleep(time_to_wait)
 
     logger.info('Finished autoawsume')
 
 
+def needs_refresh(auto_profile: dict, refresh_margin: int = REFRESH_MARGIN, now: datetime = None) -> bool:
+    now = now or datetime.now()
+    if 'source_expiration' in auto_profile and parse_expiration(auto_profile['source_expiration']) < now:
+        return False
+    return parse_expiration(auto_profile['expiration']) - timedelta(seconds=refresh_margin) < now
+
+
+def prefetch_credentials(auto_profiles: list, max_workers: int):
+    """Get the credentials of the profiles concurrently, so refreshing them one at a time afterwards reads them from the cache
+
+    The awsume app that refreshes a profile is not thread safe, only the credential calls (sts and the credential cache) run concurrently.
+    """
+    if len(auto_profiles) < 2:
+        return
+    from ..awsumepy.awsume import get_app # the awsumepy app imports this package, it must be imported after it
+    app = get_app()
+    requests = []
+    for auto_profile in auto_profiles:
+        try:
+            arguments = app.parse_args(auto_profile.get('awsumepy_command').split(' '))
+            requests.append((arguments, app.get_profiles(arguments)))
+        except exceptions.AwsumeException:
+            logger.debug('Unable to prefetch credentials: {}'.format(auto_profile.get('awsumepy_command')), exc_info=True)
+    logger.debug('Prefetching credentials of {} profiles'.format(len(requests)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(default_plugins.get_credentials, config=app.config, arguments=arguments, profiles=profiles) for arguments, profiles in requests]
+    for future in futures:
+        try:
+            future.result()
+        except Exception:
+            logger.debug('Unable to prefetch credentials, the refresh will get them', exc_info=True)
+
+
+def check_profile(profile_name: str, auto_profile: dict, credentials_file: str, refresh_margin: int = REFRESH_MARGIN) -> datetime:
+    """Refresh or delete the profile as needed, returns when it next needs to be checked, or None if it was deleted"""
+    logger.info('Looking at profile [{}]: {}'.format(profile_name, redact_profile(auto_profile)))
+    now = datetime.now()
+    expiration = parse_expiration(auto_profile['expiration'])
+    if 'source_expiration' in auto_profile:
+        source_expiration = parse_expiration(auto_profile['source_expiration'])
+    else:
+        source_expiration = None
+
+    if source_expiration is not None and source_expiration < now:
+        logger.debug('Source is expired')
+        if expiration <= now:
+            logger.debug('Role credentials are expired')
+            delete_profile(profile_name, credentials_file)
+            return None
+        logger.debug('Role credentials are not expired')
+        return expiration
+
+    logger.debug('Source credentials are not expired')
+    if expiration - timedelta(seconds=refresh_margin) < now:
+        logger.debug('Role credentials are expired or will expire in less than {}s'.format(refresh_margin))
+        session = refresh_profile(auto_profile)
+        if not session:
+            logger.debug('No session returned from awsume call')
+            delete_profile(profile_name, credentials_file)
+            return None
+        logger.debug('Received session from awsume call')
+        return to_local_time(session.awsume_credentials.get('Expiration')) - timedelta(seconds=refresh_margin)
+
+    logger.debug('Role credentials are not expired')
+    return get_next_check(auto_profile, refresh_margin)
+
+
 def configure_logger():
     migrate_to_xdg_base_directories()
 
@@ -123,19 +166,5 @@ def refresh_profile(auto_profile):
 
 def delete_profile(profile, credentials):
     logger.info('Deleting profile [{}] from file: {}'.format(profile, credentials))
-    # delete_section(profile, credentials)
-    config = configparser.ConfigParser()
-
-    logger.debug('Reading profiles')
-    with open(str(credentials)) as f:
-        config.read_file(f)
-    logger.debug('Read profiles: {}'.format(list(config.keys())))
-
-    if config.has_section(profile):
-        logger.debug('Profile exists, removing it')
-        config.remove_section(profile)
-
-    logger.debug('Saving profiles: {}'.format(list(config.keys())))
-    with open(str(credentials), 'w') as f:
-        config.write(f)
+    delete_section(profile, credentials)
     logger.debug('Saved changes')
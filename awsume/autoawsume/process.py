@@ -1,9 +1,11 @@
 import argparse
-import psutil
 
-from ..awsumepy.lib.aws_files import delete_section, get_aws_files, read_aws_file
+from ..awsumepy.lib.aws_files import AwsFileTransaction, get_aws_files, read_aws_file
+from ..awsumepy.lib.lazy_import import lazy_import
 from ..awsumepy.lib.logger import logger
 
+psutil = lazy_import('psutil')
+
 
 def kill_autoawsume():
     logger.debug('Killing autoawsume')
@@ -21,12 +23,13 @@ def kill(arguments: argparse.Namespace):
     if arguments.profile_name:
         logger.debug('Stoping auto-refresh of profile {}'.format(arguments.profile_name))
         profiles = read_aws_file(credentials_file)
-        if 'autoawsume-{}'.format(arguments.profile_name) in profiles:
-            delete_section('autoawsume-{}'.format(arguments.profile_name), credentials_file)
-            profiles.pop('autoawsume-{}'.format(arguments.profile_name))
-        if arguments.profile_name in profiles and profiles[arguments.profile_name].get('autoawsume'):
-            delete_section(arguments.profile_name, credentials_file)
-            profiles.pop(arguments.profile_name)
+        with AwsFileTransaction(credentials_file) as transaction:
+            if 'autoawsume-{}'.format(arguments.profile_name) in profiles:
+                transaction.delete_section('autoawsume-{}'.format(arguments.profile_name))
+                profiles.pop('autoawsume-{}'.format(arguments.profile_name))
+            if arguments.profile_name in profiles and profiles[arguments.profile_name].get('autoawsume'):
+                transaction.delete_section(arguments.profile_name)
+                profiles.pop(arguments.profile_name)
         autoawsume_profiles = [{k: v} for k, v in profiles.items() if v.get('autoawsume')]
         if any(autoawsume_profiles):
             print('Stop {}'.format(arguments.profile_name))
@@ -39,7 +42,8 @@ def kill(arguments: argparse.Namespace):
         logger.debug('Stopping all auto refreshing and removing autoawsume profiles')
         kill_autoawsume()
         profiles = read_aws_file(credentials_file)
-        for profile in profiles:
-            if 'autoawsume-' in profile or profiles[profile].get('autoawsume'):
-                delete_section(profile, credentials_file)
+        with AwsFileTransaction(credentials_file) as transaction:
+            for profile in profiles:
+                if 'autoawsume-' in profile or profiles[profile].get('autoawsume'):
+                    transaction.delete_section(profile)
         print('Kill')
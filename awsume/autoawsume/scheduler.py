@@ -0,0 +1,95 @@
+import heapq
+import configparser
+from datetime import datetime, timedelta
+
+from ..awsumepy.lib.aws_files import get_file_signature
+from ..awsumepy.lib.lazy_import import lazy_import
+
+dateutil_tz = lazy_import('dateutil.tz')
+
+REFRESH_MARGIN = 60 # default seconds before expiration that role credentials are refreshed
+FILE_POLL_INTERVAL = 5 # seconds between checks of the credentials file for outside changes
+
+
+def parse_expiration(value: str) -> datetime:
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+
+def to_local_time(date_time: datetime) -> datetime:
+    """Convert an aware datetime to a naive local one, matching the expirations written to the credentials file"""
+    if date_time.tzinfo is None:
+        return date_time
+    return date_time.astimezone(dateutil_tz.tzlocal()).replace(tzinfo=None)
+
+
+def read_auto_profiles(credentials_file: str) -> dict:
+    credentials = configparser.ConfigParser()
+    credentials.read(str(credentials_file))
+    return {k: dict(v) for k, v in credentials._sections.items() if v.get('autoawsume')}
+
+
+def get_next_check(auto_profile: dict, refresh_margin: int = REFRESH_MARGIN) -> datetime:
+    """When the profile next needs attention: shortly before its role credentials expire, or when they expire if the source will be gone by then"""
+    expiration = parse_expiration(auto_profile['expiration'])
+    refresh_time = expiration - timedelta(seconds=refresh_margin)
+    if 'source_expiration' in auto_profile and parse_expiration(auto_profile['source_expiration']) < refresh_time:
+        return expiration
+    return refresh_time
+
+
+class RefreshScheduler:
+    """A priority queue of auto-refreshed profiles keyed on when they next need attention
+
+    The credentials file is only re-read when its signature changes, and only the profiles
+    that were added or changed are rescheduled.
+    """
+    def __init__(self, credentials_file: str):
+        self.credentials_file = credentials_file
+        self.signature = None
+        self.profiles = {}
+        self.check_times = {}
+        self.queue = []
+
+    def __len__(self):
+        return len(self.check_times)
+
+    def schedule(self, profile_name: str, check_time: datetime):
+        self.check_times[profile_name] = check_time
+        heapq.heappush(self.queue, (check_time, profile_name))
+
+    def unschedule(self, profile_name: str):
+        self.check_times.pop(profile_name, None)
+
+    def sync(self, now: datetime = None) -> bool:
+        """Reread the credentials file if it changed, returns whether it did"""
+        signature = get_file_signature(self.credentials_file)
+        if signature == self.signature:
+            return False
+        self.signature = signature
+        now = now or datetime.now()
+        profiles = read_auto_profiles(self.credentials_file)
+        for profile_name in set(self.profiles) - set(profiles):
+            self.unschedule(profile_name)
+        for profile_name, auto_profile in profiles.items():
+            if self.profiles.get(profile_name) != auto_profile:
+                self.schedule(profile_name, now)
+        self.profiles = profiles
+        return True
+
+    def pop_due(self, now: datetime = None) -> list:
+        now = now or datetime.now()
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            check_time, profile_name = heapq.heappop(self.queue)
+            if self.check_times.get(profile_name) == check_time: # skip entries that were rescheduled since
+                del self.check_times[profile_name]
+                due.append(profile_name)
+        return due
+
+    def seconds_until_next(self, now: datetime = None) -> float:
+        now = now or datetime.now()
+        while self.queue and self.check_times.get(self.queue[0][1]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+        if not self.queue:
+            return FILE_POLL_INTERVAL
+        return min(FILE_POLL_INTERVAL, max(0, (self.queue[0][0] - now).total_seconds()))
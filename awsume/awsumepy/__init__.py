@@ -1,3 +1,4 @@
+from . lib import timings
 from . import app
 from . import default_plugins
 from . import hookspec
@@ -5,4 +6,6 @@ from . import main
 from . import lib
 from . hookimpl import hookimpl
 from . lib import safe_print
-from . awsume import awsume
+from . awsume import awsume, awsume_many
+
+timings.record_import()
@@ -1,12 +1,12 @@
 import os
 import sys
+import copy
 import argparse
 import difflib
 import json
 import logging
 import pluggy
 import colorama
-import boto3
 from pathlib import Path
 
 from . lib.autoawsume import create_autoawsume_profile
@@ -17,8 +17,12 @@ from . lib.aws_files import get_aws_files, add_section, get_section
 from . lib.profile import credentials_to_profile, is_mutable_profile
 from . lib import exceptions
 from . lib.logger import logger
-from . lib.safe_print import safe_print
+from . lib.safe_print import safe_print, buffered_output
 from . lib import constants
+from . lib.timings import timed, timings, instrument_plugin_manager, instrument_hook_impls
+from . lib.plugins import LazyPluginManager, get_plugin_manifest
+from . lib import plugin_stats
+from . lib import rate_limit
 from . lib import saml as saml
 from . lib import aws as aws_lib
 from . import hookspec
@@ -26,10 +30,16 @@ from . import default_plugins
 
 
 class Awsume(object):
+    argument_parser = None
+    argument_parser_plugins = None
+
     def __init__(self, is_interactive: bool = True):
         logger.debug('Initalizing app')
-        self.plugin_manager = self.get_plugin_manager()
-        self.config = load_config()
+        with timed('get_plugin_manager', startup=True):
+            self.plugin_manager = self.get_plugin_manager()
+        with timed('load_config', startup=True):
+            self.config = load_config()
+        self.is_timed = False
         self.config['is_interactive'] = is_interactive
         self.is_interactive = is_interactive
         colorama.init(autoreset=True)
@@ -37,15 +47,27 @@ class Awsume(object):
 
     def get_plugin_manager(self) -> pluggy.PluginManager:
         logger.debug('Creating plugin manager')
-        pm = pluggy.PluginManager('awsume')
+        pm = LazyPluginManager('awsume')
         pm.add_hookspecs(hookspec)
         logger.debug('Loading plugins')
         pm.register(default_plugins)
-        pm.load_setuptools_entrypoints('awsume')
+        try:
+            manifest = get_plugin_manifest()
+        except ImportError: # pragma: no cover
+            pm.load_setuptools_entrypoints('awsume')
+        else:
+            pm.load_plugin_manifest(manifest)
         return pm
 
 
-    def parse_args(self, system_arguments: list) -> argparse.Namespace:
+    def get_plugin_names(self) -> tuple:
+        return tuple(sorted(name for name, _ in self.plugin_manager.list_name_plugin()))
+
+
+    def get_argument_parser(self) -> argparse.ArgumentParser:
+        """The parser is built once per app, and again only when plugins have been registered since"""
+        if self.argument_parser is not None and self.argument_parser_plugins == self.get_plugin_names():
+            return self.argument_parser
         logger.debug('Gathering arguments')
         epilog = """Thank you for using AWSume! Check us out at https://trek10.com"""
         description="""Awsume - A cli that makes using AWS IAM credentials easy"""
@@ -62,6 +84,14 @@ class Awsume(object):
             config=self.config,
             parser=argument_parser,
         )
+        self.argument_parser = argument_parser
+        self.argument_parser_plugins = self.get_plugin_names() # lazy plugins implementing add_arguments are loaded by the hook call
+        return argument_parser
+
+
+    def parse_args(self, system_arguments: list) -> argparse.Namespace:
+        self.plugin_manager.load_plugins_for_arguments(system_arguments)
+        argument_parser = self.get_argument_parser()
         logger.debug('Parsing arguments')
         args = argument_parser.parse_args(system_arguments)
         logger.debug('Handling arguments')
@@ -75,9 +105,17 @@ class Awsume(object):
             json.dump({'profile-names': profile_names}, open(autocomplete_file, 'w'))
             raise exceptions.EarlyExit()
         if args.list_plugins:
-            for plugin_name, _ in self.plugin_manager.list_name_plugin():
-                if 'default_plugins' not in plugin_name:
-                    safe_print(plugin_name, color=colorama.Fore.LIGHTCYAN_EX)
+            self.plugin_manager.load_all_plugins()
+            stats = plugin_stats.read_plugin_stats()
+            with buffered_output():
+                for plugin_name, _ in self.plugin_manager.list_name_plugin():
+                    if 'default_plugins' not in plugin_name:
+                        safe_print(plugin_name, color=colorama.Fore.LIGHTCYAN_EX)
+                        for hook_name, samples in sorted(stats.get(plugin_name, {}).items()):
+                            summary = plugin_stats.summarize_samples(samples)
+                            safe_print('  {}: {} calls, mean {:.1f}ms, p95 {:.1f}ms, max {:.1f}ms'.format(
+                                hook_name, summary['calls'], summary['mean_ms'], summary['p95_ms'], summary['max_ms'],
+                            ))
             raise exceptions.EarlyExit()
         self.plugin_manager.hook.post_add_arguments(
             config=self.config,
@@ -150,9 +188,12 @@ class Awsume(object):
                     raise exceptions.SAMLRoleNotFoundError(principal_arn, profile_role_arn)
                 safe_print('Match: {}'.format(choice))
             else:
-                for index, choice in enumerate(roles):
-                    safe_print('{}) {}'.format(index, choice), color=colorama.Fore.LIGHTYELLOW_EX)
-                safe_print('Which role do you want to assume? > ', end='', color=colorama.Fore.LIGHTCYAN_EX)
+                if aws_lib.is_prompt_disabled():
+                    raise exceptions.PromptRequiredError('A SAML role needs to be chosen, but prompts are turned off')
+                with buffered_output():
+                    for index, choice in enumerate(roles):
+                        safe_print('{}) {}'.format(index, choice), color=colorama.Fore.LIGHTYELLOW_EX)
+                    safe_print('Which role do you want to assume? > ', end='', color=colorama.Fore.LIGHTCYAN_EX)
                 response = input()
                 if response.isnumeric():
                     choice = roles[int(response)]
@@ -258,11 +299,100 @@ class Awsume(object):
         return session
 
 
+    def is_accounting_plugins(self) -> bool:
+        return self.config.get('plugin-budget') is not None or bool(self.config.get('plugin-stats'))
+
+
+    def start_timings(self, system_arguments: list):
+        timings.reset()
+        timings.enabled = '--timings' in system_arguments or '--timings-json' in system_arguments or self.is_accounting_plugins()
+        if timings.enabled and not self.is_timed:
+            instrument_plugin_manager(self.plugin_manager)
+            self.is_timed = True
+        elif timings.enabled:
+            instrument_hook_impls(self.plugin_manager)
+
+
+    def report_timings(self, system_arguments: list):
+        if rate_limit.get_counters()['calls']:
+            logger.debug('Since awsume started: {}'.format(rate_limit.format_counters()))
+        if '--timings-json' in system_arguments:
+            print(timings.to_json(), file=sys.stderr)
+        elif '--timings' in system_arguments:
+            safe_print(timings.format_table(), color=colorama.Fore.LIGHTBLUE_EX)
+        if not self.is_accounting_plugins():
+            return
+        for plugin_name, hook_name, milliseconds, budget in plugin_stats.find_slow_plugins(self.config, timings.phases):
+            message = 'Plugin {} took {:.0f}ms in {} (budget {:.0f}ms)'.format(plugin_name, milliseconds, hook_name, budget)
+            if self.is_interactive:
+                safe_print(message, color=colorama.Fore.YELLOW)
+            else:
+                logger.warning(message)
+        if self.config.get('plugin-stats'):
+            plugin_stats.update_plugin_stats(timings.phases)
+
+
+    def run_many(self, profile_names: list, system_arguments: list, max_workers: int = None) -> dict:
+        self.start_timings(system_arguments)
+        try:
+            with timed('run_many'):
+                return self.get_many(profile_names, system_arguments, max_workers)
+        finally:
+            self.report_timings(system_arguments)
+
+
+    def get_many(self, profile_names: list, system_arguments: list, max_workers: int = None) -> dict:
+        logger.debug('Running awsume for {} profiles'.format(len(profile_names)))
+        args = self.parse_args(system_arguments)
+        if args.role_arn or args.json or args.with_saml or args.with_web_identity:
+            raise exceptions.ValidationException('Only profile names can be awsumed in a batch')
+        if args.auto_refresh or args.output_profile:
+            raise exceptions.ValidationException('Cannot use autoawsume or output profiles in a batch')
+        profiles = self.get_profiles(args)
+        self.plugin_manager.hook.pre_get_credentials(
+            config=self.config,
+            arguments=args,
+            profiles=profiles,
+        )
+        sessions = {} # each profile name maps to its session, or to the AwsumeException raised while getting it
+        target_profile_names = {}
+        for profile_name in profile_names:
+            try:
+                target_profile_names[profile_name] = get_profile_name(self.config, profiles, profile_name, log=False)
+            except exceptions.AwsumeException as e:
+                sessions[profile_name] = e
+        results = default_plugins.resolve_role_chains(self.config, args, profiles, list(set(target_profile_names.values())), max_workers)
+
+        for profile_name, target_profile_name in target_profile_names.items():
+            credentials = results.get(target_profile_name) or exceptions.NoCredentialsError()
+            if isinstance(credentials, exceptions.AwsumeException):
+                sessions[profile_name] = credentials
+                continue
+            profile_args = copy.copy(args)
+            profile_args.target_profile_name = target_profile_name
+            try:
+                self.plugin_manager.hook.post_get_credentials(
+                    config=self.config,
+                    arguments=profile_args,
+                    profiles=profiles,
+                    credentials=credentials,
+                )
+                sessions[profile_name] = self.export_data(profile_args, profiles, credentials, 'Awsume', [])
+            except exceptions.AwsumeException as e:
+                logger.debug('Unable to export the credentials of [{}]'.format(profile_name), exc_info=True)
+                sessions[profile_name] = e
+        return sessions
+
+
     def run(self, system_arguments: list):
+        self.start_timings(system_arguments)
         try:
-            args = self.parse_args(system_arguments)
-            profiles = self.get_profiles(args)
-            credentials = self.get_credentials(args, profiles)
+            with timed('parse_args'):
+                args = self.parse_args(system_arguments)
+            with timed('get_profiles'):
+                profiles = self.get_profiles(args)
+            with timed('get_credentials'):
+                credentials = self.get_credentials(args, profiles)
 
             if args.auto_refresh:
                 return self.export_data(args, profiles, credentials, 'Auto', [
@@ -284,6 +414,9 @@ class Awsume(object):
             logger.debug('', exc_info=True)
             logger.debug('EarlyExit exception raised, no more work to do')
             return err.data
+        except exceptions.PromptRequiredError:
+            logger.debug('', exc_info=True)
+            raise # whoever turned prompts off (awsumed) decides what to do instead
         except exceptions.AwsumeException as e:
             logger.debug('', exc_info=True)
             if self.is_interactive:
@@ -291,3 +424,5 @@ class Awsume(object):
                 sys.exit(1)
             else:
                 raise
+        finally:
+            self.report_timings(system_arguments)
@@ -1,13 +1,14 @@
-from typing import Union
-
-import boto3
+from typing import TYPE_CHECKING, Dict, Union
 
 from .app import Awsume
 
+if TYPE_CHECKING: # pragma: no cover
+    import boto3
+
 cached_awsume_app_object = None
 
 
-def awsume(profile_name: str = None, *args: list, **kwargs: dict) -> Union[boto3.Session, dict]:
+def get_cli_arguments(args: list, kwargs: dict) -> list:
     cli_arguments = list(args) if args is not None else []
 
     for key, value in kwargs.items():
@@ -15,11 +16,22 @@ def awsume(profile_name: str = None, *args: list, **kwargs: dict) -> Union[boto3
         cli_arguments.append(str(newkey))
         if not isinstance(value, bool):
             cli_arguments.append(str(value))
+    return cli_arguments
 
+
+def get_app() -> Awsume:
     global cached_awsume_app_object  # this prevents numerous unique objects, such as AWS SDK, from being created
-    if cached_awsume_app_object:
-        app = cached_awsume_app_object
-    else:
-        app = Awsume(is_interactive=False)
-        cached_awsume_app_object = app
-    return app.run([profile_name] + cli_arguments)
+    if not cached_awsume_app_object:
+        cached_awsume_app_object = Awsume(is_interactive=False)
+    return cached_awsume_app_object
+
+
+def awsume(profile_name: str = None, *args: list, **kwargs: dict) -> Union['boto3.Session', dict]:
+    cli_arguments = get_cli_arguments(args, kwargs)
+    return get_app().run([profile_name] + cli_arguments)
+
+
+def awsume_many(profile_names: list, *args: list, max_workers: int = None, **kwargs: dict) -> Dict[str, Union['boto3.Session', Exception]]:
+    """Awsume many profiles at once, returns a boto3 session (or the error raised) for each profile name"""
+    cli_arguments = get_cli_arguments(args, kwargs)
+    return get_app().run_many(list(profile_names), cli_arguments, max_workers=max_workers)
@@ -1,18 +1,22 @@
 import argparse
+import copy
 import json
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 
 import colorama
-import dateutil
 
 from .hookimpl import hookimpl
 from .lib import aws as aws_lib
 from .lib import aws_files as aws_files_lib
+from .lib import cache as cache_lib
 from .lib import config_management as config_lib
+from .lib import constants
 from .lib import exceptions
 from .lib import profile as profile_lib
+from .lib.lazy_import import lazy_import
 from .lib.logger import logger
 from .lib.profile import VALID_CREDENTIAL_SOURCES
 from .lib.profile import get_role_chain, get_profile_name
@@ -20,6 +24,8 @@ from .lib.safe_print import safe_print
 from .. import __data__
 from ..autoawsume.process import kill
 
+dateutil_parser = lazy_import('dateutil.parser')
+
 
 def custom_duration_argument_type(string):
     number = int(string)
@@ -219,6 +225,16 @@ def add_arguments(config: dict, parser: argparse.ArgumentParser):
         dest='debug',
         help='Print any debug logs to stderr',
     )
+    parser.add_argument('--timings',
+        action='store_true',
+        dest='timings',
+        help='Print how long each phase took to stderr',
+    )
+    parser.add_argument('--timings-json',
+        action='store_true',
+        dest='timings_json',
+        help='Print how long each phase took to stderr as json',
+    )
 
 
 @hookimpl(tryfirst=True)
@@ -362,6 +378,7 @@ def assume_role_from_cli(config: dict, arguments: dict, profiles: dict):
             external_id=arguments.external_id,
             role_duration=role_duration,
             tags=arguments.session_tags,
+            ignore_cache=arguments.force_refresh,
         )
     else:
         logger.debug('Using the source_profile from the cli to call assume_role')
@@ -387,7 +404,8 @@ def assume_role_from_cli(config: dict, arguments: dict, profiles: dict):
                     role_duration=role_duration,
                     mfa_serial=mfa_serial,
                     mfa_token=arguments.mfa_token,
-                    tags=arguments.session_tags
+                    tags=arguments.session_tags,
+                    ignore_cache=arguments.force_refresh
                 )
             else:
                 logger.debug('MFA not needed, assuming role from with profile creds')
@@ -400,7 +418,8 @@ def assume_role_from_cli(config: dict, arguments: dict, profiles: dict):
                     region=region,
                     external_id=arguments.external_id,
                     role_duration=role_duration,
-                    tags=arguments.session_tags
+                    tags=arguments.session_tags,
+                    ignore_cache=arguments.force_refresh
                 )
         else:
             logger.debug('Using default role duration')
@@ -426,7 +445,8 @@ def assume_role_from_cli(config: dict, arguments: dict, profiles: dict):
                 region=region,
                 external_id=arguments.external_id,
                 role_duration=role_duration,
-                tags=arguments.session_tags
+                tags=arguments.session_tags,
+                ignore_cache=arguments.force_refresh
             )
     return role_session
 
@@ -447,7 +467,8 @@ def get_assume_role_credentials(config: dict, arguments: argparse.Namespace, pro
         region=region,
         external_id=external_id,
         role_duration=role_duration,
-        tags=arguments.session_tags
+        tags=arguments.session_tags,
+        ignore_cache=arguments.force_refresh
     )
     if 'SourceExpiration' in source_credentials:
         role_session['SourceExpiration'] = source_credentials['SourceExpiration']
@@ -494,7 +515,8 @@ def get_assume_role_credentials_mfa_required(config: dict, arguments: argparse.N
         region=region,
         external_id=external_id,
         role_duration=role_duration,
-        tags=arguments.session_tags
+        tags=arguments.session_tags,
+        ignore_cache=arguments.force_refresh
     )
 
     if 'SourceExpiration' in source_session:
@@ -528,7 +550,8 @@ def get_assume_role_credentials_mfa_required_large_custom_duration(config: dict,
         role_duration=role_duration,
         mfa_serial=mfa_serial,
         mfa_token=arguments.mfa_token,
-        tags=arguments.session_tags
+        tags=arguments.session_tags,
+        ignore_cache=arguments.force_refresh
     )
     return role_session
 
@@ -552,10 +575,36 @@ def get_credentials_from_credential_source(config: dict, arguments: argparse.Nam
 def get_credentials_from_credential_process(config: dict, arguments: argparse.Namespace, profiles: dict, target_profile: dict, target_profile_name: str):
     logger.info('Getting credentials from credential_process, profile: %s'% target_profile_name)
     region = profile_lib.get_region(profiles, arguments, config)
-    return_session = {}
+    credential_process_target_and_arguments = get_credentials_process_target_and_arguments(target_profile)
+    cache_file_name = cache_lib.get_credential_process_cache_file_name(target_profile_name, credential_process_target_and_arguments)
+    refresh_margin = cache_lib.get_refresh_margin('credential-process')
+    if not arguments.force_refresh:
+        cache_session, _ = cache_lib.read_cached_session(cache_file_name, region, refresh_margin)
+        if cache_session:
+            logger.debug('Using cached credential_process credentials')
+            return cache_session
+    with cache_lib.cache_lock(cache_file_name):
+        stale_session = None
+        if not arguments.force_refresh:
+            cache_session, stale_session = cache_lib.read_cached_session(cache_file_name, region, refresh_margin)
+            if cache_session: # another awsume ran the process while we waited for the lock
+                logger.debug('Using cached credential_process credentials')
+                return cache_session
+        try:
+            return_session = run_credential_process(credential_process_target_and_arguments, target_profile_name, region)
+        except (exceptions.NoCredentialsError, exceptions.ValidationException):
+            if not stale_session:
+                raise
+            logger.debug('Unable to refresh credential_process credentials ahead of their expiration, using the cached ones', exc_info=True)
+            return stale_session
+        if return_session.get('Expiration'): # credentials without an expiration are long-lived, and are not written to the cache
+            return_session = cache_lib.write_aws_cache(cache_file_name, return_session)
+    return return_session
+
+
+def run_credential_process(credential_process_target_and_arguments: list, target_profile_name: str, region: str) -> dict:
     credential_process_env = os.environ.copy()
     credential_process_env['AWS_PROFILE'] = target_profile_name
-    credential_process_target_and_arguments = get_credentials_process_target_and_arguments(target_profile)
     result = subprocess.run(credential_process_target_and_arguments, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=credential_process_env)
     logger.info('credential_process returncode: {}'.format(result.returncode))
     logger.debug('credential_process stdout: {}'.format(result.stdout.decode('utf-8')))
@@ -579,7 +628,7 @@ def get_credentials_from_credential_process(config: dict, arguments: argparse.Na
     if 'SessionToken' in creds:
         return_session['SessionToken'] = creds['SessionToken']
     if 'Expiration' in creds:
-        return_session['Expiration'] = dateutil.parser.parse(creds['Expiration'])
+        return_session['Expiration'] = dateutil_parser.parse(creds['Expiration'])
     return_session['Region'] = region
     logger.debug("credential_process session: {}".format(return_session))
     return return_session
@@ -676,3 +725,83 @@ def get_credentials(config: dict, arguments: argparse.Namespace, profiles: dict)
     for profile_name in role_chain:
         credentials = get_credentials_handler(config=config, arguments=arguments, profiles=profiles, profile_name=profile_name, credentials=credentials)
     return credentials
+
+
+def plan_role_chains(config: dict, arguments: argparse.Namespace, profiles: dict, target_profile_names: list, errors: dict = None) -> dict:
+    """Merge the role chains of many targets into a tree, so hops shared by several targets appear once
+
+    Every hop of a chain is called in the region of its target, so hops are only shared by targets in the same
+    region. The tree is keyed on (profile name, region). When an errors dict is given, a target whose chain is
+    invalid is left out of the tree and its AwsumeException is put in errors, instead of being raised.
+    """
+    logger.info('Planning role chains for {} profiles'.format(len(target_profile_names)))
+    tree = {}
+    for target_profile_name in sorted(target_profile_names):
+        target_arguments = copy.copy(arguments)
+        target_arguments.target_profile_name = target_profile_name
+        try:
+            try:
+                role_chain = get_role_chain(config, target_arguments, profiles, target_profile_name)
+                region = profile_lib.get_region(profiles, target_arguments, config)
+            except KeyError as e: # a source_profile that doesn't exist
+                raise exceptions.InvalidProfileError(target_profile_name, 'source profile {} does not exist'.format(e))
+        except exceptions.AwsumeException as e:
+            if errors is None:
+                raise
+            logger.debug('Unable to plan the role chain of [{}]'.format(target_profile_name), exc_info=True)
+            errors[target_profile_name] = e
+            continue
+        logger.debug('Role chain for [{}] in {}: {}'.format(target_profile_name, region, role_chain))
+        children = tree
+        for profile_name in role_chain:
+            key = (profile_name, region)
+            if key not in children:
+                children[key] = {'profile_name': profile_name, 'arguments': target_arguments, 'targets': [], 'children': {}}
+            node = children[key]
+            children = node['children']
+        node['targets'].append(target_profile_name)
+    return tree
+
+
+def resolve_role_chains(config: dict, arguments: argparse.Namespace, profiles: dict, target_profile_names: list, max_workers: int = None) -> dict:
+    """Get credentials for many targets, calling each shared hop once and resolving independent branches concurrently
+
+    Returns a mapping of target profile name to its credentials, or to the AwsumeException raised while getting them.
+    """
+    max_workers = max_workers or int(config.get('max-workers', constants.DEFAULT_MAX_WORKERS))
+    results = {}
+    tree = plan_role_chains(config, arguments, profiles, target_profile_names, results)
+
+    def subtree_targets(node: dict) -> list:
+        return node['targets'] + [_ for child in node['children'].values() for _ in subtree_targets(child)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit(children: dict, credentials: dict) -> dict:
+            return {
+                executor.submit(
+                    get_credentials_handler,
+                    config=config,
+                    arguments=node['arguments'],
+                    profiles=profiles,
+                    profile_name=node['profile_name'],
+                    credentials=credentials,
+                ): node for node in children.values()
+            }
+
+        pending = submit(tree, None)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = pending.pop(future)
+                try:
+                    credentials = future.result()
+                except exceptions.AwsumeException as e:
+                    logger.debug('Unable to resolve role chain hop', exc_info=True)
+                    for target_profile_name in subtree_targets(node):
+                        results[target_profile_name] = e
+                    continue
+                for target_profile_name in node['targets']:
+                    results[target_profile_name] = credentials
+                pending.update(submit(node['children'], credentials))
+    return results
+
@@ -1,3 +1,4 @@
+from . import timings # first, so it can time the rest of the imports
 from . import aws_files
 from . import aws
 from . import cache
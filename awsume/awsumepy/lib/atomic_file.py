@@ -0,0 +1,145 @@
+import os
+import time
+import errno
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Callable, IO
+
+import colorama
+
+try:
+    import fcntl
+except ImportError: # pragma: no cover
+    fcntl = None
+    import msvcrt
+
+from . import constants
+from . logger import logger
+from . safe_print import safe_print
+
+LOCK_DIR_NAME = 'locks'
+LOCK_NOTICE_SECONDS = 1 # a wait for a lock this long is logged, and shown to the user if the caller gave a message
+LOCK_POLL_MIN = 0.001 # seconds between attempts to take a lock held elsewhere, doubling up to the max
+LOCK_POLL_MAX = 0.05
+THREAD_LOCKS = {} # flock locks are per process, these serialize the threads within it for each lock file
+THREAD_LOCKS_LOCK = threading.Lock()
+
+
+class ThreadLock:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.file_descriptor = None
+
+
+def get_lock_path(file_name: str) -> str:
+    """The lock file of a file, in awsume's cache directory so locking doesn't leave files beside the ones it protects"""
+    lock_dir = os.path.join(str(constants.AWSUME_CACHE_DIR), LOCK_DIR_NAME)
+    if not os.path.isdir(lock_dir):
+        os.makedirs(str(constants.AWSUME_CACHE_DIR), mode=0o700, exist_ok=True)
+        os.makedirs(lock_dir, mode=0o700, exist_ok=True)
+    file_hash = hashlib.sha256(os.path.realpath(str(file_name)).encode('utf-8')).hexdigest()
+    return os.path.join(lock_dir, file_hash + '.lock')
+
+
+def get_thread_lock(lock_path: str) -> ThreadLock:
+    with THREAD_LOCKS_LOCK:
+        return THREAD_LOCKS.setdefault(lock_path, ThreadLock())
+
+
+def try_lock_file(file_descriptor: int) -> bool:
+    try:
+        if fcntl:
+            fcntl.flock(file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else: # pragma: no cover
+            msvcrt.locking(file_descriptor, msvcrt.LK_NBLCK, 1)
+    except OSError as e:
+        if e.errno in [errno.EAGAIN, errno.EACCES, errno.EDEADLK]:
+            return False
+        raise
+    return True
+
+
+def wait_for_lock(try_lock: Callable[[], bool], file_name: str, deadline: float = None, waiting_message: str = None):
+    """Call try_lock until it takes the lock, raises TimeoutError once the deadline (from time.monotonic) passes"""
+    start = time.monotonic()
+    delay = LOCK_POLL_MIN
+    is_notified = False
+    while not try_lock():
+        now = time.monotonic()
+        if deadline is not None and now >= deadline:
+            raise TimeoutError('Timed out waiting for the lock of {}'.format(file_name))
+        if not is_notified and now - start >= LOCK_NOTICE_SECONDS:
+            logger.debug('Waiting for the lock of {}'.format(file_name))
+            if waiting_message:
+                safe_print(waiting_message, colorama.Fore.YELLOW)
+            is_notified = True
+        time.sleep(delay if deadline is None else max(0, min(delay, deadline - now)))
+        delay = min(delay * 2, LOCK_POLL_MAX)
+
+
+@contextmanager
+def file_lock(file_name: str, timeout: float = None, waiting_message: str = None):
+    """Hold an exclusive lock, shared with other awsume processes, on the lock file of the given file
+
+    The lock is reentrant within a thread, and only files locked by the same path block each other. With a
+    timeout, TimeoutError is raised if the lock isn't free within that many seconds, and a waiting_message is
+    shown to the user when the lock keeps them waiting.
+    """
+    lock_path = get_lock_path(file_name)
+    thread_lock = get_thread_lock(lock_path)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    wait_for_lock(lambda: thread_lock.lock.acquire(blocking=False), file_name, deadline, waiting_message)
+    try:
+        if thread_lock.depth == 0:
+            file_descriptor = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                wait_for_lock(lambda: try_lock_file(file_descriptor), file_name, deadline, waiting_message)
+            except BaseException:
+                os.close(file_descriptor)
+                raise
+            thread_lock.file_descriptor = file_descriptor
+        thread_lock.depth += 1
+        try:
+            yield
+        finally:
+            thread_lock.depth -= 1
+            if thread_lock.depth == 0:
+                try:
+                    if fcntl:
+                        fcntl.flock(thread_lock.file_descriptor, fcntl.LOCK_UN)
+                    else: # pragma: no cover
+                        os.lseek(thread_lock.file_descriptor, 0, os.SEEK_SET)
+                        msvcrt.locking(thread_lock.file_descriptor, msvcrt.LK_UNLCK, 1)
+                finally:
+                    os.close(thread_lock.file_descriptor)
+                    thread_lock.file_descriptor = None
+    finally:
+        thread_lock.lock.release()
+
+
+def atomic_write(file_name: str, write: Callable[[IO], None], mode: int = 0o600):
+    """Write a file by writing a temp file beside it and renaming it into place
+
+    Readers see either the old or the new content, never a partial write. An existing
+    file keeps its permissions, and a symlinked file is replaced at its target.
+    """
+    path = os.path.realpath(str(file_name))
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except OSError:
+        pass
+    file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(file_descriptor, 'w') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
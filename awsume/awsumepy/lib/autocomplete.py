@@ -1,8 +1,10 @@
 import os
-import configparser
 import json
 from pathlib import Path
-import boto3
+
+import awsume_autocomplete.awsume_autocomplete as awsume_autocomplete
+
+from . import aws_files as aws_files_lib
 
 REGIONS = [
     'us-east-2',
@@ -38,32 +40,23 @@ def get_aws_files() -> tuple:
 
 
 def get_profile_names(credentials_file: str, config_file: str) -> list:
-    credentials = configparser.ConfigParser()
-    credentials.read(credentials_file)
-    profiles = list(credentials._sections.keys())
-
-    config = configparser.ConfigParser()
-    config.read(config_file)
-    config_profiles = [_.replace('profile ', '') for _ in list(config._sections.keys())]
+    profiles = list(aws_files_lib.read_aws_file(credentials_file).keys())
+    config_profiles = [_.replace('profile ', '') for _ in aws_files_lib.read_aws_file(config_file).keys()]
 
     return uniquely_concat_lists(profiles, config_profiles)
 
 
 def uniquely_concat_lists(list1, list2):
+    seen = set(list1)
     for element in list2:
-        if element not in list1:
+        if element not in seen:
+            seen.add(element)
             list1.append(element)
     return list1
 
 
 def profile_name_completer(prefix, parsed_args, **kwargs):
-    config, credentials = get_aws_files()
-    profile_names = get_profile_names(credentials, config)
-    autocomplete_file = str(Path('~/.awsume/autocomplete.json').expanduser())
-    if os.path.isfile(autocomplete_file):
-        autocomplete = json.load(open(autocomplete_file))
-        profile_names = uniquely_concat_lists(profile_names, autocomplete['profile-names'])
-    return [profile_name for profile_name in profile_names if profile_name.startswith(prefix)]
+    return awsume_autocomplete.get_completions(prefix)
 
 
 def region_completer(prefix, parsed_args, **kwargs):
@@ -1,33 +1,125 @@
 import os
+import sys
+import threading
+from collections import OrderedDict
 from typing import List, Union
 
-import boto3
-import botocore
 import colorama
-import dateutil
 
 from . import cache as cache_lib
 from . import profile as profile_lib
-from .exceptions import RoleAuthenticationError, UserAuthenticationError
+from . import rate_limit
+from . import sts_endpoints
+from .exceptions import PromptRequiredError, RoleAuthenticationError, UserAuthenticationError
+from .lazy_import import lazy_import
 from .logger import logger
 from .safe_print import safe_print
+from .timings import timed
+
+boto3 = lazy_import('boto3')
+botocore_config_lib = lazy_import('botocore.config')
+botocore_exceptions = lazy_import('botocore.exceptions')
+botocore_session_lib = lazy_import('botocore.session')
+dateutil_tz = lazy_import('dateutil.tz')
 
 DEFAULT_REGION = 'us-east-1'
+STS_CLIENT_POOL_SIZE = 32
+STS_CLIENT_ENVIRONMENT = ['AWS_STS_REGIONAL_ENDPOINTS', 'AWS_USE_FIPS_ENDPOINT', 'AWS_USE_DUALSTACK_ENDPOINT', 'AWS_CONFIG_FILE', 'AWS_PROFILE']
+STS_CLIENT_RETRIES = {'mode': 'standard', 'total_max_attempts': 1} # rate_limit.call retries throttled and transient errors, botocore's retries would multiply its attempts
+
+shared_data_loader = None
+sts_client_pool = OrderedDict()
+sts_client_pool_lock = threading.Lock()
+
+
+def get_botocore_session():
+    """Get a new botocore session that shares the process-wide data loader, so service models and endpoints are read once
+
+    The session resolves sts endpoints itself, by region, with the sts regional endpoints setting awsume uses.
+    """
+    global shared_data_loader
+    botocore_session = botocore_session_lib.get_session()
+    with sts_client_pool_lock:
+        if shared_data_loader is None:
+            shared_data_loader = botocore_session.get_component('data_loader')
+        else:
+            botocore_session.register_component('data_loader', shared_data_loader)
+    botocore_session.set_config_variable('sts_regional_endpoints', sts_endpoints.get_sts_regional_endpoints(botocore_session))
+    return botocore_session
 
 
 def get_session(*args, **kwargs):
     """Get a session, ignoring missing profiles from environment variables"""
     try:
-        boto_session = boto3.session.Session(*args, **kwargs)
-    except botocore.exceptions.ProfileNotFound as err: # catch expired autoawsume profiles
+        boto_session = boto3.session.Session(*args, botocore_session=get_botocore_session(), **kwargs)
+    except botocore_exceptions.ProfileNotFound as err: # catch expired autoawsume profiles
         if 'AWS_PROFILE' in os.environ:
             os.environ.pop('AWS_PROFILE')
         if 'AWS_DEFAULT_PROFILE' in os.environ:
             os.environ.pop('AWS_DEFAULT_PROFILE')
-        boto_session = boto3.session.Session(*args, **kwargs)
+        boto_session = boto3.session.Session(*args, botocore_session=get_botocore_session(), **kwargs)
     return boto_session
 
 
+def get_sts_client(credentials: dict, region: str = None):
+    """Get an sts client, clients for explicit access keys are pooled by region and credentials for the life of the process
+
+    Clients without a region resolve it from the environment, which can change (e.g. between awsumed requests), so they
+    aren't pooled, and the environment variables that change which endpoint a client uses are part of the pool key.
+    """
+    pool_key = None
+    endpoint_url = sts_endpoints.get_endpoint_url()
+    if credentials.get('AccessKeyId') and region: # ambient credentials can change too, never pool them
+        pool_key = (
+            region, credentials.get('AccessKeyId'), credentials.get('SecretAccessKey'), credentials.get('SessionToken'), endpoint_url,
+            tuple(os.environ.get(_) for _ in STS_CLIENT_ENVIRONMENT),
+        )
+        with sts_client_pool_lock:
+            if pool_key in sts_client_pool:
+                sts_client_pool.move_to_end(pool_key)
+                return sts_client_pool[pool_key]
+    sts_client = get_session(
+        aws_access_key_id=credentials.get('AccessKeyId'),
+        aws_secret_access_key=credentials.get('SecretAccessKey'),
+        aws_session_token=credentials.get('SessionToken'),
+        region_name=region,
+    ).client('sts', endpoint_url=endpoint_url, config=botocore_config_lib.Config(retries=STS_CLIENT_RETRIES)) # type: botostubs.STS
+    if pool_key:
+        with sts_client_pool_lock:
+            sts_client_pool[pool_key] = sts_client
+            while len(sts_client_pool) > STS_CLIENT_POOL_SIZE:
+                sts_client_pool.popitem(last=False)
+    return sts_client
+
+
+def clear_sts_client_pool():
+    with sts_client_pool_lock:
+        sts_client_pool.clear()
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """Whether the error is the endpoint's fault (it couldn't be reached or had an internal error), so another endpoint may work"""
+    return rate_limit.is_transient(error)
+
+
+def call_sts(credentials: dict, region: str, operation_name: str, **kwargs) -> tuple:
+    """Call an sts operation, returns the response and the client that made the call
+
+    The call waits for the sts rate limit, is retried with backoff when it is throttled, and fails over to the
+    next regional endpoint when one fails. Transient errors are retried on the last endpoint to try.
+    """
+    sts_regions = sts_endpoints.get_sts_regions(region)
+    for index, sts_region in enumerate(sts_regions):
+        sts_client = get_sts_client(credentials, sts_region)
+        try:
+            return rate_limit.call(lambda: getattr(sts_client, operation_name)(**kwargs), retry_transient=index == len(sts_regions) - 1), sts_client
+        except Exception as e:
+            if index == len(sts_regions) - 1 or not is_endpoint_failure(e):
+                raise
+            logger.debug('The sts endpoint of {} failed, trying {}'.format(sts_region, sts_regions[index + 1]), exc_info=True)
+            sts_endpoints.report_failure(sts_region)
+
+
 def assume_role(
     source_credentials: dict,
     role_arn: str,
@@ -40,20 +132,86 @@ def assume_role(
     mfa_serial: str = None,
     mfa_token: str = None,
     tags: Union[list, None] = None,
+    ignore_cache: bool = False,
 ) -> dict:
     if len(session_name) < 2:
         session_name = session_name.center(2, '_')
 
     logger.debug('Assuming role: {}'.format(role_arn))
     logger.debug('Session name: {}'.format(session_name))
-    try:
-        boto_session = get_session(
-            aws_access_key_id=source_credentials.get('AccessKeyId'),
-            aws_secret_access_key=source_credentials.get('SecretAccessKey'),
-            aws_session_token=source_credentials.get('SessionToken'),
-            region_name=region,
+    cache_file_name = None
+    if source_credentials.get('AccessKeyId'): # credentials from the environment cannot be keyed without resolving them
+        cache_file_name = cache_lib.get_role_cache_file_name(
+            source_credentials,
+            role_arn,
+            session_name,
+            session_policy=session_policy,
+            session_policy_arns=session_policy_arns,
+            external_id=external_id,
+            role_duration=role_duration,
+            mfa_serial=mfa_serial,
+            tags=tags,
         )
-        role_sts_client = boto_session.client('sts') # type: botostubs.STS
+        if not ignore_cache:
+            cache_session, _ = cache_lib.read_cached_session(cache_file_name, region, cache_lib.get_refresh_margin('role'))
+            if cache_session:
+                logger.debug('Using cached role credentials')
+                return cache_session
+    if mfa_serial and not mfa_token:
+        try:
+            cache_session, mfa_token = prompt_for_mfa_token(None if ignore_cache else cache_file_name, region, cache_lib.get_refresh_margin('role'))
+        except PromptRequiredError:
+            raise
+        except Exception as e:
+            raise RoleAuthenticationError(str(e))
+        if cache_session:
+            logger.debug('Using cached role credentials')
+            return cache_session
+    with cache_lib.cache_lock(cache_file_name):
+        stale_session = None
+        if cache_file_name and not ignore_cache:
+            cache_session, stale_session = cache_lib.read_cached_session(cache_file_name, region, cache_lib.get_refresh_margin('role'))
+            if cache_session: # another awsume got them while we waited for the lock
+                logger.debug('Using cached role credentials')
+                return cache_session
+        try:
+            role_session = request_role_session(
+                source_credentials,
+                role_arn,
+                session_name,
+                session_policy=session_policy,
+                session_policy_arns=session_policy_arns,
+                external_id=external_id,
+                region=region,
+                role_duration=role_duration,
+                mfa_serial=mfa_serial,
+                mfa_token=mfa_token,
+                tags=tags,
+            )
+        except RoleAuthenticationError:
+            if not stale_session:
+                raise
+            logger.debug('Unable to refresh role credentials ahead of their expiration, using the cached ones', exc_info=True)
+            return stale_session
+        if cache_file_name:
+            cache_lib.write_aws_cache(cache_file_name, role_session)
+    return role_session
+
+
+def request_role_session(
+    source_credentials: dict,
+    role_arn: str,
+    session_name: str,
+    session_policy: str = None,
+    session_policy_arns: List[str] = [],
+    external_id: str = None,
+    region: str = None,
+    role_duration: int = None,
+    mfa_serial: str = None,
+    mfa_token: str = None,
+    tags: Union[list, None] = None,
+) -> dict:
+    try:
         kwargs = { 'RoleSessionName': session_name, 'RoleArn': role_arn }
         if session_policy:
             kwargs['Policy'] = session_policy
@@ -69,10 +227,14 @@ def assume_role(
         if tags:
             kwargs["Tags"] = tags
         logger.debug('Assuming role now')
-        role_session = role_sts_client.assume_role(**kwargs).get('Credentials')
+        with timed('sts:AssumeRole', detail=role_arn):
+            response, role_sts_client = call_sts(source_credentials, region, 'assume_role', **kwargs)
+        role_session = response.get('Credentials')
         logger.debug('Received role credentials')
-        role_session['Expiration'] = role_session['Expiration'].astimezone(dateutil.tz.tzlocal())
-        role_session['Region'] = region or boto_session.region_name
+        role_session['Expiration'] = role_session['Expiration'].astimezone(dateutil_tz.tzlocal())
+        role_session['Region'] = region or role_sts_client.meta.region_name
+    except PromptRequiredError:
+        raise
     except Exception as e:
         raise RoleAuthenticationError(str(e))
     logger.debug('Role credentials received')
@@ -88,22 +250,29 @@ def get_session_token(
     duration_seconds: int = None,
 ) -> dict:
     cache_file_name = 'aws-credentials-' + source_credentials.get('AccessKeyId')
-    cache_session = cache_lib.read_aws_cache(cache_file_name)
-
-    if cache_lib.valid_cache_session(cache_session) and not ignore_cache:
-        logger.debug('Using cache session')
-        if region:
-            cache_session['Region'] = region
-        user_session = cache_session
-    else:
+    if not ignore_cache:
+        user_session, _ = cache_lib.read_cached_session(cache_file_name, region, cache_lib.get_refresh_margin('session'))
+        if user_session:
+            logger.debug('Using cache session')
+            return user_session
+    if mfa_serial and not mfa_token:
+        try:
+            user_session, mfa_token = prompt_for_mfa_token(None if ignore_cache else cache_file_name, region, cache_lib.get_refresh_margin('session'))
+        except PromptRequiredError:
+            raise
+        except Exception as e:
+            raise UserAuthenticationError(str(e))
+        if user_session:
+            logger.debug('Using cache session')
+            return user_session
+    with cache_lib.cache_lock(cache_file_name):
+        stale_session = None
+        if not ignore_cache:
+            user_session, stale_session = cache_lib.read_cached_session(cache_file_name, region, cache_lib.get_refresh_margin('session'))
+            if user_session: # another awsume got it while we waited for the lock
+                logger.debug('Using cache session')
+                return user_session
         logger.debug('Getting session token')
-        boto_session = get_session(
-            aws_access_key_id=source_credentials.get('AccessKeyId'),
-            aws_secret_access_key=source_credentials.get('SecretAccessKey'),
-            aws_session_token=source_credentials.get('SessionToken'),
-            region_name=region,
-        )
-        user_sts_client = boto_session.client('sts') # type: botostubs.STS
         try:
             kwargs = {
                 'SerialNumber': mfa_serial if mfa_serial else None,
@@ -111,25 +280,69 @@ def get_session_token(
             }
             if duration_seconds:
                 kwargs['DurationSeconds'] = duration_seconds
-            user_session = user_sts_client.get_session_token(**kwargs).get('Credentials')
-            user_session['Expiration'] = user_session['Expiration'].astimezone(dateutil.tz.tzlocal())
-            user_session['Region'] = region or boto_session.region_name
+            with timed('sts:GetSessionToken'):
+                response, user_sts_client = call_sts(source_credentials, region, 'get_session_token', **kwargs)
+            user_session = response.get('Credentials')
+            user_session['Expiration'] = user_session['Expiration'].astimezone(dateutil_tz.tzlocal())
+            user_session['Region'] = region or user_sts_client.meta.region_name
+        except PromptRequiredError:
+            raise
         except Exception as e:
+            if stale_session:
+                logger.debug('Unable to refresh the session token ahead of its expiration, using the cached one', exc_info=True)
+                return stale_session
             raise UserAuthenticationError(str(e))
         logger.debug('Session token received')
         cache_lib.write_aws_cache(cache_file_name, user_session)
     return user_session
 
 
+def prompt_for_mfa_token(cache_file_name: str, region: str, refresh_margin: int) -> tuple:
+    """Prompt for the MFA token of credentials that aren't cached, returns (cached session, None) or (None, mfa token)
+
+    Another awsume process getting the same credentials is waited for first, and the credentials it cached are used
+    instead of prompting. The prompt itself isn't under the cache lock, so other awsume processes don't wait on the user.
+    Cached credentials that are due for a refresh are used when the prompt isn't possible or fails.
+    """
+    stale_session = None
+    if cache_file_name:
+        with cache_lib.cache_lock(cache_file_name):
+            cache_session, stale_session = cache_lib.read_cached_session(cache_file_name, region, refresh_margin)
+        if cache_session:
+            return cache_session, None
+        if stale_session and not can_prompt():
+            logger.debug('Cached credentials are due for a refresh, but need an MFA token')
+            return stale_session, None
+    try:
+        return None, profile_lib.get_mfa_token()
+    except PromptRequiredError:
+        raise
+    except Exception:
+        if not stale_session:
+            raise
+        logger.debug('Unable to get an MFA token to refresh credentials ahead of their expiration, using the cached ones', exc_info=True)
+        return stale_session, None
+
+
+def is_prompt_disabled() -> bool:
+    """Whether prompts are turned off with AWSUME_NO_PROMPT, as awsumed does for the requests it runs"""
+    return os.environ.get('AWSUME_NO_PROMPT', '').lower() == 'true'
+
+
+def can_prompt() -> bool:
+    """Whether an MFA token can be prompted for, rather than failing on a closed or detached stdin"""
+    if is_prompt_disabled():
+        return False
+    try:
+        return sys.stdin is not None and sys.stdin.isatty()
+    except ValueError:
+        return False
+
+
 def get_account_id(credentials: dict):
     try:
-        sts_client = get_session(
-            aws_access_key_id=credentials.get('AccessKeyId'),
-            aws_secret_access_key=credentials.get('SecretAccessKey'),
-            aws_session_token=credentials.get('SessionToken'),
-            region_name=credentials.get('Region', 'us-east-1'),
-        ).client('sts') # type: botostubs.STS
-        response = sts_client.get_caller_identity()
+        with timed('sts:GetCallerIdentity'):
+            response, _ = call_sts(credentials, credentials.get('Region', 'us-east-1'), 'get_caller_identity')
         return response.get('Account', 'Unavailable')
     except:
         return 'Unavailable'
@@ -143,14 +356,14 @@ def assume_role_with_saml(
     role_duration: int = None,
 ) -> dict:
     logger.debug('Assuming role with saml: {}'.format(role_arn))
-    role_sts_client = get_session().client('sts') # type: botostubs.STS
-
     try:
         kwargs = { 'RoleArn': role_arn, 'PrincipalArn': principal_arn, 'SAMLAssertion': saml_assertion }
         if role_duration:
             kwargs['DurationSeconds'] = int(role_duration)
-        role_session = role_sts_client.assume_role_with_saml(**kwargs).get('Credentials')
-        role_session['Expiration'] = role_session['Expiration'].astimezone(dateutil.tz.tzlocal())
+        with timed('sts:AssumeRoleWithSAML', detail=role_arn):
+            response, _ = call_sts({}, region, 'assume_role_with_saml', **kwargs)
+        role_session = response.get('Credentials')
+        role_session['Expiration'] = role_session['Expiration'].astimezone(dateutil_tz.tzlocal())
         role_session['Region'] = region
     except Exception as e:
         raise RoleAuthenticationError(str(e))
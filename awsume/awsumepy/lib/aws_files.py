@@ -1,12 +1,24 @@
 import os
+import json
+import time
+import hashlib
 import argparse
 import configparser
 import colorama
 from datetime import datetime
 from pathlib import Path
+from typing import Callable
 
+from . import cache as cache_lib
+from . atomic_file import atomic_write, file_lock
 from . import constants
+from . logger import logger
 from . safe_print import safe_print
+from . timings import timed
+
+PROFILE_INDEX_VERSION = 1
+PROFILE_INDEX_RACY_SECONDS = 2 # files modified this recently may change again without a visible mtime change
+SECRET_KEYS = ['aws_secret_access_key', 'aws_session_token', 'aws_security_token']
 
 
 def get_aws_files(args: argparse.Namespace, config: dict) -> tuple:
@@ -31,19 +43,66 @@ def get_aws_files(args: argparse.Namespace, config: dict) -> tuple:
     return str(Path(config_file)), str(Path(credentials_file))
 
 
-def add_section(name: str, section: dict, file_name: str, overwrite: bool = False):
-    config = configparser.ConfigParser()
-    config.read(file_name)
+class AwsFileTransaction:
+    """Collects changes to an aws file and applies them all with one locked, atomic rewrite
+
+    The file is read under the lock when the transaction commits, so changes made by other
+    awsume processes in the meantime are kept.
+
+        with AwsFileTransaction(credentials_file) as transaction:
+            transaction.add_section('my-profile', profile, overwrite=True)
+            transaction.delete_section('my-old-profile')
+    """
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.changes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def add_section(self, name: str, section: dict, overwrite: bool = False):
+        self.changes.append(lambda config: upsert_section(config, name, section, overwrite, self.file_name))
+
+    def delete_section(self, name: str):
+        self.changes.append(lambda config: config.has_section(name) and config.remove_section(name))
+
+    def update(self, change: Callable[[configparser.ConfigParser], bool]):
+        """Add a change that edits the parsed file in place and returns whether it changed anything"""
+        self.changes.append(change)
+
+    def commit(self):
+        changes, self.changes = self.changes, []
+        if not changes:
+            return
+        with file_lock(self.file_name):
+            config = configparser.ConfigParser()
+            config.read(self.file_name)
+            changed = [change(config) for change in changes]
+            if any(changed):
+                logger.debug('Writing {} changes to {}'.format(changed.count(True), self.file_name))
+                atomic_write(self.file_name, config.write)
+
+
+def upsert_section(config: configparser.ConfigParser, name: str, section: dict, overwrite: bool, file_name: str) -> bool:
     if config.has_section(name):
         if not overwrite:
             safe_print('Cannot overwrite data in {}'.format(file_name), colorama.Fore.RED)
-            return
+            return False
         config.remove_section(name)
     config.add_section(name)
     config.set(name, 'manager', 'awsume')
     for key in section:
         config.set(name, key, str(section[key]))
-    config.write(open(str(file_name), 'w'))
+    return True
+
+
+def add_section(name: str, section: dict, file_name: str, overwrite: bool = False):
+    with AwsFileTransaction(file_name) as transaction:
+        transaction.add_section(name, section, overwrite)
 
 
 def get_section(name: str, file_name: str):
@@ -53,23 +112,85 @@ def get_section(name: str, file_name: str):
 
 
 def delete_section(name: str, file_name: str):
-    config = configparser.ConfigParser()
-    config.read(file_name)
-    if config.has_section(name):
-        config.remove_section(name)
-    config.write(open(str(file_name), 'w'))
+    with AwsFileTransaction(file_name) as transaction:
+        transaction.delete_section(name)
+
+
+def get_file_signature(file_name: str) -> list:
+    try:
+        stat = os.stat(str(file_name))
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+
+def get_profile_index_path(file_name: str) -> str:
+    file_hash = hashlib.sha1(os.path.abspath(str(file_name)).encode('utf-8')).hexdigest()
+    return str(constants.AWSUME_CACHE_DIR) + '/profile-index-' + file_hash + '.json'
+
+
+def read_profile_index(file_name: str, signature: list) -> dict:
+    index_path = get_profile_index_path(file_name)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != PROFILE_INDEX_VERSION or index.get('signature') != signature:
+        logger.debug('Profile index is stale: {}'.format(index_path))
+        return None
+    logger.debug('Using profile index: {}'.format(index_path))
+    return index.get('profiles')
+
+
+def write_profile_index(file_name: str, signature: list, profiles: dict):
+    if time.time() - signature[0] / 1e9 < PROFILE_INDEX_RACY_SECONDS:
+        logger.debug('File was modified too recently to index: {}'.format(file_name))
+        return
+    try:
+        cache_lib.ensure_cache_dir()
+        atomic_write(get_profile_index_path(file_name), lambda f: json.dump({
+            'version': PROFILE_INDEX_VERSION,
+            'file': os.path.abspath(str(file_name)),
+            'signature': signature,
+            'profiles': profiles,
+        }, f))
+    except OSError:
+        logger.debug('There was an error writing the profile index', exc_info=True)
+
+
+def remove_profile_index(file_name: str):
+    try:
+        os.remove(get_profile_index_path(file_name))
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logger.debug('There was an error removing the profile index', exc_info=True)
+
+
+def has_secrets(profiles: dict) -> bool:
+    return any(key in profile for profile in profiles.values() for key in SECRET_KEYS)
 
 
 def read_aws_file(file_name: str) -> dict:
-    config = configparser.ConfigParser()
-    config.read(file_name)
-    profiles = {k: dict(v) for k, v in config._sections.items()}
-    return profiles
+    with timed('read_aws_file', detail=str(file_name)):
+        signature = get_file_signature(file_name)
+        if signature:
+            profiles = read_profile_index(file_name, signature)
+            if profiles is not None:
+                return profiles
+        config = configparser.ConfigParser()
+        config.read(file_name)
+        profiles = {k: dict(v) for k, v in config._sections.items()}
+        if signature and has_secrets(profiles):
+            remove_profile_index(file_name) # secrets are only ever read from the file itself, so they can't outlive it elsewhere
+        elif signature:
+            write_profile_index(file_name, signature, profiles)
+        return profiles
 
 
-def remove_expired_output_profiles(file_name: str) -> dict:
-    config = configparser.ConfigParser()
-    config.read(file_name)
+def remove_expired_sections(config: configparser.ConfigParser) -> bool:
+    removed = False
     for section in config.sections():
         if config.has_option(section, 'manager') and config.get(section, 'manager') != 'awsume':
             continue
@@ -78,5 +199,10 @@ def remove_expired_output_profiles(file_name: str) -> dict:
         if config.has_option(section, 'expiration'):
             expiration = datetime.strptime(config.get(section, 'expiration'), '%Y-%m-%d %H:%M:%S')
             if expiration < datetime.now():
-                config.remove_section(section)
-    config.write(open(str(file_name), 'w'))
+                removed = config.remove_section(section) or removed
+    return removed
+
+
+def remove_expired_output_profiles(file_name: str):
+    with AwsFileTransaction(file_name) as transaction:
+        transaction.update(remove_expired_sections)
@@ -1,11 +1,28 @@
 import os
 import json
-import dateutil
-from datetime import datetime
+import hashlib
+from datetime import datetime, timedelta
+from contextlib import contextmanager, ExitStack
 
 from . import constants
+from . import cache_db
+from . atomic_file import atomic_write, file_lock
+from . lazy_import import lazy_import
 from . logger import logger
 
+dateutil_tz = lazy_import('dateutil.tz')
+
+ROLE_CACHE_REFRESH_MARGIN = 300
+DEFAULT_REFRESH_MARGINS = {
+    'session': 0, # seconds before a cached session token expires that a new one is gotten, which prompts for MFA
+    'role': ROLE_CACHE_REFRESH_MARGIN,
+    'autoawsume': 60,
+    'credential-process': ROLE_CACHE_REFRESH_MARGIN,
+}
+ACCOUNT_ID_CACHE_FILE_NAME = 'account-ids.json'
+CACHE_LOCK_TIMEOUT = 60 # seconds to wait for another awsume process getting the same credentials
+CACHE_LOCK_WAITING_MESSAGE = 'Waiting for another awsume process getting the same credentials...'
+
 
 def ensure_cache_dir():
     cache_dir = str(constants.AWSUME_CACHE_DIR)
@@ -14,15 +31,101 @@ def ensure_cache_dir():
     os.chmod(cache_dir, 0o700) #ensure directory is secure.
 
 
+def get_config() -> dict:
+    from . config_management import get_config_snapshot # config_management and exceptions import each other, it must be imported after them
+    return get_config_snapshot()
+
+
+def get_refresh_margin(kind: str) -> int:
+    """The refresh-margin config value for session tokens, role credentials, credential_process output or autoawsume, in seconds
+
+    It is either one number for all of them or a mapping with any of the keys session, role, credential-process and autoawsume.
+    """
+    margin = get_config().get('refresh-margin')
+    if isinstance(margin, dict):
+        margin = margin.get(kind)
+    if margin is None:
+        return DEFAULT_REFRESH_MARGINS[kind]
+    try:
+        return max(0, int(margin))
+    except (TypeError, ValueError):
+        logger.debug('Invalid refresh-margin: {}'.format(margin))
+        return DEFAULT_REFRESH_MARGINS[kind]
+
+
+def get_cache_database() -> cache_db.CacheDatabase:
+    """The sqlite cache store if the cache-store config is sqlite, else None for the cache files"""
+    if get_config().get('cache-store') != 'sqlite':
+        return None
+    if not cache_db.sqlite3:
+        logger.debug('sqlite3 is not available, using cache files')
+        return None
+    return cache_db.get_cache_database()
+
+
+def get_cache_path(cache_file_name: str) -> str:
+    return str(constants.AWSUME_CACHE_DIR) + '/' + cache_file_name
+
+
+@contextmanager
+def cache_lock(cache_file_name: str):
+    """Hold the lock of a cache file, so that concurrent awsume processes needing the same credentials
+    wait for the one getting them and then read them from the cache, rather than each calling STS
+
+    Credentials that aren't cached (no cache file name) aren't locked. The wait is bounded by CACHE_LOCK_TIMEOUT,
+    after which the credentials are gotten without the lock.
+    """
+    with ExitStack() as stack:
+        if cache_file_name:
+            cache_database = get_cache_database()
+            if cache_database:
+                lock = cache_database.lock(cache_file_name, CACHE_LOCK_TIMEOUT, CACHE_LOCK_WAITING_MESSAGE)
+            else:
+                ensure_cache_dir()
+                lock = file_lock(get_cache_path(cache_file_name), CACHE_LOCK_TIMEOUT, CACHE_LOCK_WAITING_MESSAGE)
+            try:
+                stack.enter_context(lock)
+            except TimeoutError:
+                logger.warning('Timed out waiting for the lock of {}, going ahead without it'.format(cache_file_name))
+        yield
+
+
+def read_cached_session(cache_file_name: str, region: str = None, refresh_margin: int = 0) -> tuple:
+    """The cached session if it doesn't need to be refreshed yet, and the cached session if it hasn't expired
+
+    A session within the refresh margin of its expiration is returned second only, to fall back
+    on if it can't be refreshed.
+    """
+    cache_session = read_aws_cache(cache_file_name)
+    if not valid_cache_session(cache_session):
+        return None, None
+    if region:
+        cache_session['Region'] = region
+    if refresh_margin and not valid_cache_session(cache_session, refresh_margin=refresh_margin):
+        return None, cache_session
+    return cache_session, cache_session
+
+
 def read_aws_cache(cache_file_name: str) -> dict:
+    cache_database = get_cache_database()
+    if cache_database:
+        try:
+            session = cache_database.read(cache_db.CREDENTIALS, cache_file_name) or {}
+            if session.get('Expiration') and type(session.get('Expiration')) == str:
+                session['Expiration'] = datetime.strptime(session['Expiration'], '%Y-%m-%d %H:%M:%S')
+            return session
+        except Exception:
+            logger.debug('There was an error reading from the cache database', exc_info=True)
+            return {}
     ensure_cache_dir()
-    cache_path = str(constants.AWSUME_CACHE_DIR) + '/' + cache_file_name
+    cache_path = get_cache_path(cache_file_name)
     logger.debug('Cache file path: ' + cache_path)
     session = {}
     if os.path.isfile(cache_path):
         logger.debug('Cache file found')
         try:
-            session = json.load(open(cache_path))
+            with open(cache_path) as f:
+                session = json.load(f)
             if session.get('Expiration') and type(session.get('Expiration')) == str:
                 session['Expiration'] = datetime.strptime(session['Expiration'], '%Y-%m-%d %H:%M:%S')
         except:
@@ -31,33 +134,108 @@ def read_aws_cache(cache_file_name: str) -> dict:
 
 
 def write_aws_cache(cache_file_name: str, session: dict) -> dict:
+    expiration = session['Expiration'].astimezone(dateutil_tz.tzlocal())
+    expiration = expiration.strftime('%Y-%m-%d %H:%M:%S')
+    cache_database = get_cache_database()
+    if cache_database:
+        try:
+            cache_database.write(cache_db.CREDENTIALS, {
+                cache_file_name: {**session, 'Expiration': expiration},
+            }, expiration=cache_db.parse_expiration(expiration))
+        except Exception:
+            logger.debug('There was an error writing to the cache database', exc_info=True)
+        session['Expiration'] = datetime.strptime(expiration, '%Y-%m-%d %H:%M:%S')
+        return session
     ensure_cache_dir()
-    cache_path = str(constants.AWSUME_CACHE_DIR) + '/' + cache_file_name
-    if os.path.exists(cache_path):
-        os.chmod(cache_path, 0o600)
-    else:
-        open(cache_path, 'a').close()
-        os.chmod(cache_path, 0o600)
+    cache_path = get_cache_path(cache_file_name)
     logger.debug('Cache file path: ' + cache_path)
-    expiration = session['Expiration'].astimezone(dateutil.tz.tzlocal())
-    expiration = expiration.strftime('%Y-%m-%d %H:%M:%S')
     try:
-        json.dump({
-            **session,
-            'Expiration': expiration,
-        }, open(cache_path, 'w'), indent=2, default=str)
+        with file_lock(cache_path):
+            if os.path.exists(cache_path):
+                os.chmod(cache_path, 0o600) # the new file keeps the permissions of the one it replaces
+            atomic_write(cache_path, lambda f: json.dump({
+                **session,
+                'Expiration': expiration,
+            }, f, indent=2, default=str), mode=0o600)
     except:
         logger.debug('There was an error writing to the cache file', exc_info=True)
     session['Expiration'] = datetime.strptime(expiration, '%Y-%m-%d %H:%M:%S')
     return session
 
 
-def valid_cache_session(cache_session: dict) -> bool:
+def read_account_id_cache() -> dict:
+    cache_database = get_cache_database()
+    if cache_database:
+        try:
+            return cache_database.read_all(cache_db.ACCOUNT_ID)
+        except Exception:
+            logger.debug('There was an error reading from the cache database', exc_info=True)
+            return {}
+    account_ids = read_aws_cache(ACCOUNT_ID_CACHE_FILE_NAME)
+    return account_ids if isinstance(account_ids, dict) else {}
+
+
+def write_account_id_cache(account_ids: dict):
+    """Add account IDs to the cache, keeping the ones other awsume processes added since it was read"""
+    cache_database = get_cache_database()
+    if cache_database:
+        try:
+            cache_database.write(cache_db.ACCOUNT_ID, account_ids)
+        except Exception:
+            logger.debug('There was an error writing to the cache database', exc_info=True)
+        return
+    ensure_cache_dir()
+    cache_path = get_cache_path(ACCOUNT_ID_CACHE_FILE_NAME)
+    logger.debug('Account ID cache file path: ' + cache_path)
+    try:
+        with file_lock(cache_path):
+            merged_account_ids = {**read_account_id_cache(), **account_ids}
+            if os.path.exists(cache_path):
+                os.chmod(cache_path, 0o600)
+            atomic_write(cache_path, lambda f: json.dump(merged_account_ids, f, indent=2, sort_keys=True), mode=0o600)
+    except:
+        logger.debug('There was an error writing to the account ID cache file', exc_info=True)
+
+
+def get_role_cache_file_name(
+    source_credentials: dict,
+    role_arn: str,
+    session_name: str,
+    session_policy: str = None,
+    session_policy_arns: list = None,
+    external_id: str = None,
+    role_duration: int = None,
+    mfa_serial: str = None,
+    tags: list = None,
+) -> str:
+    cache_key = json.dumps({
+        'SourceAccessKeyId': source_credentials.get('AccessKeyId'),
+        'RoleArn': role_arn,
+        'RoleSessionName': session_name,
+        'Policy': session_policy,
+        'PolicyArns': sorted(session_policy_arns or []),
+        'ExternalId': external_id,
+        'DurationSeconds': int(role_duration) if role_duration else None,
+        'SerialNumber': mfa_serial,
+        'Tags': tags,
+    }, sort_keys=True, default=str)
+    return 'aws-role-credentials-' + hashlib.sha256(cache_key.encode('utf-8')).hexdigest()
+
+
+def get_credential_process_cache_file_name(profile_name: str, credential_process_target_and_arguments: list) -> str:
+    cache_key = json.dumps({
+        'Profile': profile_name,
+        'CredentialProcess': credential_process_target_and_arguments,
+    }, sort_keys=True)
+    return 'aws-credential-process-' + hashlib.sha256(cache_key.encode('utf-8')).hexdigest()
+
+
+def valid_cache_session(cache_session: dict, refresh_margin: int = 0) -> bool:
     if cache_session.get('Expiration'):
         session_expiration = cache_session['Expiration']
         if type(cache_session['Expiration']) == str:
             session_expiration = datetime.strptime(session_expiration, '%Y-%m-%d %H:%M:%S')
-        if session_expiration <= datetime.now():
+        if session_expiration - timedelta(seconds=refresh_margin) <= datetime.now():
             logger.debug('Cache session has expired')
             return False
     if 'AccessKeyId' not in cache_session:
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from . import constants
+from . atomic_file import file_lock, get_lock_path
+from . lazy_import import lazy_import
+from . logger import logger
+
+sqlite3 = lazy_import('sqlite3', optional=True)
+
+CACHE_DATABASE_FILE_NAME = 'cache.sqlite3'
+CACHE_DATABASE_VERSION = 1
+CREDENTIALS = 'credentials'
+ACCOUNT_ID = 'account-id'
+MIGRATED_FILE_PREFIXES = ['aws-credentials-', 'aws-role-credentials-', 'aws-credential-process-']
+MIGRATED_ACCOUNT_ID_FILE_NAME = 'account-ids.json'
+
+cache_database = None
+cache_database_lock = threading.Lock()
+
+
+def parse_expiration(expiration: str) -> float:
+    return datetime.strptime(expiration, '%Y-%m-%d %H:%M:%S').timestamp()
+
+
+class CacheDatabase:
+    """The credential and account ID caches in one sqlite database, instead of a file per key
+
+    The database is in WAL mode, so readers don't wait for writers. Expired credentials are
+    deleted whenever credentials are written, and the cache files of the file store are
+    moved into the database when it is created.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+
+    def connect(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            cache_dir = os.path.dirname(self.path)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            os.chmod(cache_dir, 0o700)
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)) # sqlite creates the journal files with the same permissions
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            if connection.execute('PRAGMA user_version').fetchone()[0] < CACHE_DATABASE_VERSION:
+                self.create(connection)
+            self.local.connection = connection
+        return connection
+
+    def create(self, connection):
+        migrated_files = []
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if connection.execute('PRAGMA user_version').fetchone()[0] < CACHE_DATABASE_VERSION:
+                logger.debug('Creating cache database: {}'.format(self.path))
+                connection.execute('''
+                    CREATE TABLE IF NOT EXISTS cache (
+                        kind TEXT NOT NULL,
+                        key TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        expiration REAL,
+                        PRIMARY KEY (kind, key)
+                    )
+                ''')
+                connection.execute('CREATE INDEX IF NOT EXISTS cache_expiration ON cache (expiration)')
+                migrated_files = self.migrate_files(connection)
+                connection.execute('PRAGMA user_version = {}'.format(CACHE_DATABASE_VERSION))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        for file_name in migrated_files:
+            for path in [file_name, get_lock_path(file_name)]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def migrate_files(self, connection) -> list:
+        """Copy the unexpired cache files of the file store into the database, returns the files to remove"""
+        cache_dir = os.path.dirname(self.path)
+        migrated_files = []
+        now = time.time()
+        for file_name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, file_name)
+            is_credentials = any(file_name.startswith(_) for _ in MIGRATED_FILE_PREFIXES)
+            if not (is_credentials or file_name == MIGRATED_ACCOUNT_ID_FILE_NAME): # lock files left beside them by older versions are removed too
+                continue
+            try:
+                with open(path) as f:
+                    value = json.load(f)
+                if is_credentials:
+                    expiration = parse_expiration(value['Expiration']) if value.get('Expiration') else None
+                    if expiration is None or expiration > now:
+                        connection.execute(
+                            'INSERT OR REPLACE INTO cache (kind, key, value, expiration) VALUES (?, ?, ?, ?)',
+                            (CREDENTIALS, file_name, json.dumps(value, default=str), expiration),
+                        )
+                else:
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO cache (kind, key, value) VALUES (?, ?, ?)',
+                        [(ACCOUNT_ID, key, json.dumps(account_id)) for key, account_id in value.items()],
+                    )
+            except (OSError, ValueError, TypeError, KeyError, AttributeError):
+                logger.debug('Unable to migrate cache file: {}'.format(path), exc_info=True)
+            migrated_files.append(path)
+        logger.debug('Migrated {} cache files'.format(len(migrated_files)))
+        return migrated_files
+
+    def read(self, kind: str, key: str):
+        row = self.connect().execute('SELECT value FROM cache WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def read_all(self, kind: str) -> dict:
+        rows = self.connect().execute('SELECT key, value FROM cache WHERE kind = ?', (kind,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def write(self, kind: str, values: dict, expiration: float = None):
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache (kind, key, value, expiration) VALUES (?, ?, ?, ?)',
+                [(kind, key, json.dumps(value, default=str), expiration) for key, value in values.items()],
+            )
+            evicted = connection.execute('DELETE FROM cache WHERE expiration < ?', (time.time(),)).rowcount
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if evicted:
+            logger.debug('Evicted {} expired cache entries'.format(evicted))
+
+    @contextmanager
+    def lock(self, key: str, timeout: float = None, waiting_message: str = None):
+        # the lock of the cache file the key would have, so different credentials never wait on each other
+        with file_lock(os.path.join(os.path.dirname(self.path), key), timeout, waiting_message):
+            yield
+
+
+def get_cache_database() -> CacheDatabase:
+    global cache_database
+    with cache_database_lock:
+        path = str(constants.AWSUME_CACHE_DIR) + '/' + CACHE_DATABASE_FILE_NAME
+        if cache_database is None or cache_database.path != path:
+            cache_database = CacheDatabase(path)
+        return cache_database
@@ -60,6 +60,21 @@ def migrate_to_xdg_base_directories() -> None:
         # cleanup legacy ~/.awsume dir
         os.rmdir(constants.AWSUME_DIR_LEGACY_PATH)
 
+config_snapshot = None
+
+
+def get_config_snapshot() -> dict:
+    """The config as last loaded in this process, only read from disk if nothing has loaded it yet"""
+    global config_snapshot
+    if config_snapshot is None:
+        try:
+            with open(str(constants.AWSUME_CONFIG), 'r') as f:
+                config_snapshot = yaml.safe_load(f) or {}
+        except Exception:
+            return {}
+    return config_snapshot
+
+
 def load_config() -> dict:
     migrate_to_xdg_base_directories()
 
@@ -71,10 +86,14 @@ def load_config() -> dict:
     if options is None:
         options = defaults
         write_config(options)
+    global config_snapshot
+    config_snapshot = options
     return options
 
 
 def write_config(config: dict):
+    global config_snapshot
+    config_snapshot = None
     if not os.path.exists(str(constants.AWSUME_DIR)):
         os.makedirs(str(constants.AWSUME_DIR))
     if not os.path.isfile(str(constants.AWSUME_CONFIG)):
@@ -35,5 +35,7 @@ if IS_USING_XDG_STATE_HOME:
 else:
     AWSUME_LOG_DIR = AWSUME_LOG_DIR_LEGACY_PATH
 
+DEFAULT_MAX_WORKERS = 8
+
 DEFAULT_CREDENTIALS_FILE = Path('~/.aws/credentials').expanduser()
 DEFAULT_CONFIG_FILE = Path('~/.aws/config').expanduser()
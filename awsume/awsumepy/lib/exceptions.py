@@ -120,6 +120,22 @@ class NoCredentialsError(AwsumeException):
         return self.message if self.message else 'No credentials'
 
 
+class PromptRequiredError(AwsumeException):
+    """"""
+    def __init__(self, message=''):
+        self.message = message
+    def __str__(self):
+        return self.message if self.message else 'Input is needed, but prompts are turned off'
+
+
+class RateLimitError(AwsumeException):
+    """"""
+    def __init__(self, message=''):
+        self.message = message
+    def __str__(self):
+        return self.message if self.message else 'Waited too long for the STS rate limit'
+
+
 class EarlyExit(AwsumeException):
     """"""
     def __init__(self, data: dict = None):
@@ -0,0 +1,30 @@
+import importlib
+import importlib.util
+
+
+class LazyModule(object):
+    """Stand-in for a module that is only imported the first time one of its attributes is used"""
+    def __init__(self, name: str):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute: str, value):
+        setattr(self._load(), attribute, value)
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self._name)
+
+
+def lazy_import(name: str, optional: bool = False) -> LazyModule:
+    """Optional modules that are not installed are returned as False, like a failed try/except import"""
+    if optional and importlib.util.find_spec(name) is None:
+        return False
+    return LazyModule(name)
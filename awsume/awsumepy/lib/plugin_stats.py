@@ -0,0 +1,89 @@
+import os
+import json
+from collections import OrderedDict
+
+from . import constants
+from . atomic_file import atomic_write, file_lock
+from . logger import logger
+
+PLUGIN_STATS_SAMPLES = 50 # rolling window of calls kept per plugin and hook
+DEFAULT_PLUGINS_NAME = 'awsume.awsumepy.default_plugins'
+
+
+def get_plugin_stats_file() -> str:
+    return str(constants.AWSUME_DIR / 'plugin-stats.json')
+
+
+def get_plugin_timings(entries: list) -> OrderedDict:
+    """Group the per-plugin entries of a run by plugin and hook, in milliseconds"""
+    plugin_timings = OrderedDict()
+    for entry in entries:
+        if not entry.get('plugin'):
+            continue
+        hook_name = entry['phase'].split(':', 1)[-1]
+        plugin_timings.setdefault(entry['plugin'], OrderedDict()).setdefault(hook_name, []).append(entry['seconds'] * 1000)
+    return plugin_timings
+
+
+def get_plugin_budget(config: dict, plugin_name: str) -> float:
+    """The plugin-budget config value in milliseconds, either one number for all plugins or per plugin name with an optional default"""
+    budget = config.get('plugin-budget')
+    if isinstance(budget, dict):
+        budget = budget.get(plugin_name, budget.get('default'))
+    try:
+        return float(budget) if budget is not None else None
+    except (TypeError, ValueError):
+        logger.debug('Invalid plugin-budget: {}'.format(budget))
+        return None
+
+
+def find_slow_plugins(config: dict, entries: list) -> list:
+    """Plugins whose implementation of a hook took longer than their budget in this run, awsume's own plugin is exempt"""
+    slow_plugins = []
+    for plugin_name, hooks in get_plugin_timings(entries).items():
+        budget = get_plugin_budget(config, plugin_name)
+        if budget is None or plugin_name == DEFAULT_PLUGINS_NAME:
+            continue
+        for hook_name, milliseconds in hooks.items():
+            if max(milliseconds) > budget:
+                slow_plugins.append((plugin_name, hook_name, max(milliseconds), budget))
+    return slow_plugins
+
+
+def read_plugin_stats() -> dict:
+    try:
+        with open(get_plugin_stats_file()) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return stats if isinstance(stats, dict) else {}
+
+
+def update_plugin_stats(entries: list):
+    """Add this run's per-plugin timings to the rolling stats in the awsume data dir"""
+    plugin_timings = get_plugin_timings(entries)
+    if not plugin_timings:
+        return
+    stats_file = get_plugin_stats_file()
+    try:
+        os.makedirs(os.path.dirname(stats_file), exist_ok=True)
+        with file_lock(stats_file):
+            stats = read_plugin_stats()
+            for plugin_name, hooks in plugin_timings.items():
+                plugin_stats = stats.setdefault(plugin_name, {})
+                for hook_name, milliseconds in hooks.items():
+                    samples = plugin_stats.get(hook_name, []) + [round(_, 3) for _ in milliseconds]
+                    plugin_stats[hook_name] = samples[-PLUGIN_STATS_SAMPLES:]
+            atomic_write(stats_file, lambda f: json.dump(stats, f, indent=2, sort_keys=True))
+    except OSError:
+        logger.debug('There was an error writing plugin stats', exc_info=True)
+
+
+def summarize_samples(samples: list) -> dict:
+    ordered = sorted(samples)
+    return {
+        'calls': len(ordered),
+        'mean_ms': sum(ordered) / len(ordered),
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max_ms': ordered[-1],
+    }
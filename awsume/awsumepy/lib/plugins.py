@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import argparse
+import importlib
+
+import pluggy
+
+from . import cache as cache_lib
+from . import constants
+from . atomic_file import atomic_write
+from . logger import logger
+from . timings import timings, instrument_hook_impls
+
+PLUGIN_GROUP = 'awsume'
+LAZY_PLUGIN_GROUP = 'awsume.lazy' # entries named after a hook or a flag, pointing at the plugin's module
+PLUGIN_MANIFEST_VERSION = 1
+HELP_FLAGS = ['-h', '--help']
+ARGUMENT_HOOKS = ['pre_add_arguments', 'add_arguments']
+
+
+def get_plugin_manifest_path() -> str:
+    return str(constants.AWSUME_CACHE_DIR) + '/plugin-manifest.json'
+
+
+def get_path_signature() -> list:
+    """Installing or removing a distribution changes the mtime of the sys.path directory it goes in"""
+    signature = [sys.version]
+    for path in sys.path:
+        try:
+            signature.append([path, os.stat(path or '.').st_mtime_ns])
+        except OSError:
+            pass
+    return signature
+
+
+def get_entry_points(group: str) -> list:
+    from importlib import metadata
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        return list(entry_points.select(group=group))
+    return list(entry_points.get(group, [])) # pragma: no cover
+
+
+def scan_plugins() -> list:
+    """Read the installed plugins, and the hooks and flags that lazy plugins declare, from entry point metadata"""
+    declarations = {}
+    for entry_point in get_entry_points(LAZY_PLUGIN_GROUP):
+        declarations.setdefault(entry_point.value.strip(), []).append(entry_point.name.strip())
+    plugins = []
+    for entry_point in get_entry_points(PLUGIN_GROUP):
+        declared = declarations.get(entry_point.value.strip(), [])
+        plugins.append({
+            'name': entry_point.name,
+            'value': entry_point.value.strip(),
+            'hooks': [_ for _ in declared if not _.startswith('-')],
+            'flags': [_ for _ in declared if _.startswith('-')],
+        })
+    return plugins
+
+
+def get_plugin_manifest() -> list:
+    signature = get_path_signature()
+    manifest_path = get_plugin_manifest_path()
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get('version') == PLUGIN_MANIFEST_VERSION and manifest.get('signature') == signature:
+            return manifest['plugins']
+    except (OSError, ValueError, AttributeError, KeyError):
+        pass
+    logger.debug('Scanning plugin entry points')
+    plugins = scan_plugins()
+    try:
+        cache_lib.ensure_cache_dir()
+        atomic_write(manifest_path, lambda f: json.dump({
+            'version': PLUGIN_MANIFEST_VERSION,
+            'signature': signature,
+            'plugins': plugins,
+        }, f))
+    except OSError:
+        logger.debug('There was an error writing the plugin manifest', exc_info=True)
+    return plugins
+
+
+def load_entry_point(value: str):
+    module_name, _, attributes = value.split('[')[0].partition(':')
+    plugin = importlib.import_module(module_name.strip())
+    for attribute in filter(None, attributes.strip().split('.')):
+        plugin = getattr(plugin, attribute)
+    return plugin
+
+
+def has_flag(system_arguments: list, flag: str) -> bool:
+    return any(argument == flag or argument.startswith(flag + '=') for argument in system_arguments)
+
+
+class LazyPluginManager(pluggy.PluginManager):
+    """A plugin manager that only imports plugins when they are needed
+
+    Plugins that declare the hooks and flags they use (in the awsume.lazy entry point group)
+    are imported when one of those hooks is called or one of those flags is passed. Plugins
+    that declare nothing are imported up front, like before.
+    """
+    def __init__(self, project_name: str):
+        super().__init__(project_name)
+        self.lazy_plugins = {}
+
+    def load_plugin_manifest(self, manifest: list):
+        for plugin in manifest:
+            if self.get_plugin(plugin['name']) or self.is_blocked(plugin['name']):
+                continue
+            if plugin['hooks'] or plugin['flags']:
+                self.lazy_plugins[plugin['name']] = plugin
+            else:
+                self.register(load_entry_point(plugin['value']), name=plugin['name'])
+
+    def load_lazy_plugins(self, names: list) -> list:
+        loaded = []
+        for name in names:
+            plugin = self.lazy_plugins.pop(name, None)
+            if plugin is None:
+                continue
+            logger.debug('Loading plugin {}'.format(name))
+            loaded.append(self.register(load_entry_point(plugin['value']), name=name))
+        if loaded and timings.enabled:
+            instrument_hook_impls(self)
+        return loaded
+
+    def load_all_plugins(self):
+        self.load_lazy_plugins(list(self.lazy_plugins))
+
+    def load_plugins_for_arguments(self, system_arguments: list):
+        if any(flag in system_arguments for flag in HELP_FLAGS):
+            self.load_all_plugins()
+            return
+        self.load_lazy_plugins([
+            name for name, plugin in self.lazy_plugins.items()
+            if any(has_flag(system_arguments, flag) for flag in plugin['flags'])
+        ])
+
+    def load_plugins_for_hook(self, hook_name: str, kwargs: dict) -> bool:
+        names = [name for name, plugin in self.lazy_plugins.items() if hook_name in plugin['hooks']]
+        if not names:
+            return False
+        loaded = self.load_lazy_plugins(names)
+        if hook_name not in ARGUMENT_HOOKS and isinstance(kwargs.get('arguments'), argparse.Namespace):
+            self.set_argument_defaults(loaded, kwargs.get('config', {}), kwargs['arguments'])
+        return True
+
+    def set_argument_defaults(self, plugin_names: list, config: dict, arguments: argparse.Namespace):
+        """Give arguments added by plugins loaded after parsing their default values"""
+        for hook_impl in self.hook.add_arguments.get_hookimpls():
+            if hook_impl.plugin_name not in plugin_names:
+                continue
+            parser = argparse.ArgumentParser(add_help=False)
+            hook_impl.function(*[{'config': config, 'parser': parser}[_] for _ in hook_impl.argnames])
+            try:
+                defaults = vars(parser.parse_args([]))
+            except SystemExit: # the plugin has required arguments, which can't be missing if it was loaded late
+                logger.debug('Unable to get argument defaults for plugin {}'.format(hook_impl.plugin_name))
+                continue
+            for key, value in defaults.items():
+                if not hasattr(arguments, key):
+                    setattr(arguments, key, value)
+
+    def _hookexec(self, hook_name, methods, *args):
+        name = getattr(hook_name, 'name', hook_name)
+        if self.lazy_plugins and self.load_plugins_for_hook(name, args[0] if args else {}):
+            methods = getattr(self.hook, name).get_hookimpls()
+        return super()._hookexec(hook_name, methods, *args)
@@ -2,26 +2,30 @@ import argparse
 import json
 import re
 import operator
+import threading
 from datetime import datetime
-import dateutil
 import colorama
 import difflib
+from concurrent.futures import ThreadPoolExecutor
+from . import cache as cache_lib
+from . import constants
 from . import exceptions
+from . lazy_import import lazy_import
 from . logger import logger
 from . safe_print import safe_print
+from . profile_matcher import get_profile_matcher
 from . import aws as aws_lib
 from collections import OrderedDict
-from difflib import SequenceMatcher
+
+dateutil_tz = lazy_import('dateutil.tz')
+
+MFA_PROMPT_LOCK = threading.Lock()
 
 VALID_CREDENTIAL_SOURCES = [ None, 'Environment', 'Ec2InstanceMetadata', 'EcsContainer' ]
-try:
-    import Levenshtein
-except:
-    Levenshtein = False
 
 
 def parse_time(date_time: datetime):
-    date_time.replace(tzinfo=dateutil.tz.tzlocal())
+    date_time.replace(tzinfo=dateutil_tz.tzlocal())
     return date_time.strftime('%Y-%m-%d %H:%M:%S')
 
 
@@ -192,14 +196,17 @@ def get_mfa_serial(profiles: dict, target_profile_name: str) -> dict:
 
 
 def get_mfa_token() -> str:
+    if aws_lib.is_prompt_disabled():
+        raise exceptions.PromptRequiredError('An MFA token is needed, but prompts are turned off')
     token_pattern = re.compile('^[0-9]{6}$')
-    safe_print('Enter MFA token: ', colorama.Fore.CYAN, end='')
-    while True:
-        mfa_token = input()
-        if token_pattern.match(mfa_token):
-            return mfa_token
-        else:
-            safe_print('Please enter a valid MFA token: ', colorama.Fore.CYAN, end='')
+    with MFA_PROMPT_LOCK: # role chains can be resolved concurrently, only one prompt at a time
+        safe_print('Enter MFA token: ', colorama.Fore.CYAN, end='')
+        while True:
+            mfa_token = input()
+            if token_pattern.match(mfa_token):
+                return mfa_token
+            else:
+                safe_print('Please enter a valid MFA token: ', colorama.Fore.CYAN, end='')
 
 
 def aggregate_profiles(result: list) -> dict:
@@ -213,8 +220,12 @@ def aggregate_profiles(result: list) -> dict:
     return return_profiles
 
 
-def format_aws_profiles(profiles: dict, get_extra_data: bool) -> list: # pragma: no cover
+def format_aws_profiles(profiles: dict, get_extra_data: bool, config: dict = None) -> list: # pragma: no cover
     sorted_profiles = OrderedDict(sorted(profiles.items()))
+    resolved_account_ids = {}
+    if get_extra_data:
+        max_workers = int((config or {}).get('max-workers', constants.DEFAULT_MAX_WORKERS))
+        resolved_account_ids = resolve_account_ids(sorted_profiles, max_workers)
     # List headers
     list_headers = ['PROFILE', 'TYPE', 'SOURCE', 'MFA?', 'REGION', 'PARTITION', 'ACCOUNT']
     profile_list = []
@@ -239,7 +250,7 @@ def format_aws_profiles(profiles: dict, get_extra_data: bool) -> list: # pragma:
                 source_profile = 'None'
             mfa_needed = 'Yes' if 'mfa_serial' in profile else 'No'
             profile_region = str(profile.get('region')) or str(profile.get('sso_region'))
-            profile_account_id = get_account_id(profile, get_extra_data)
+            profile_account_id = resolved_account_ids.get(name) or get_account_id(profile)
             if profile.get('role_arn'):
                 partition = parse_arn(profile['role_arn'])['partition']
             elif profile.get('mfa_serial'):
@@ -251,6 +262,42 @@ def format_aws_profiles(profiles: dict, get_extra_data: bool) -> list: # pragma:
     return profile_list
 
 
+def resolve_account_ids(profiles: dict, max_workers: int = constants.DEFAULT_MAX_WORKERS) -> dict:
+    """Get the account ID of every profile that needs an sts call, concurrently and cached by access key ID"""
+    cached_account_ids = cache_lib.read_account_id_cache()
+    account_ids = {}
+    pending = OrderedDict()
+    for name, profile in profiles.items():
+        if 'auto-refresh-' in name or get_account_id(profile) != 'Unavailable':
+            continue
+        if not profile.get('aws_access_key_id') or not profile.get('aws_secret_access_key'):
+            continue
+        access_key_id = profile['aws_access_key_id']
+        if access_key_id in cached_account_ids:
+            account_ids[name] = cached_account_ids[access_key_id]
+        else:
+            pending.setdefault(access_key_id, []).append(name)
+    if not pending:
+        return account_ids
+
+    logger.debug('Getting account IDs for %d access keys', len(pending))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            access_key_id: executor.submit(get_account_id, profiles[names[0]], True)
+            for access_key_id, names in pending.items()
+        }
+    resolved_account_ids = {}
+    for access_key_id, future in futures.items():
+        account_id = future.result()
+        for name in pending[access_key_id]:
+            account_ids[name] = account_id
+        if account_id != 'Unavailable':
+            resolved_account_ids[access_key_id] = account_id
+    if resolved_account_ids:
+        cache_lib.write_account_id_cache({**cached_account_ids, **resolved_account_ids})
+    return account_ids
+
+
 def print_formatted_data(profile_data: list): # pragma: no cover
     print('Listing...\n')
     widths = [max(map(len, col)) for col in zip(*profile_data)]
@@ -262,7 +309,7 @@ def print_formatted_data(profile_data: list): # pragma: no cover
 def list_profile_data(profiles: dict, get_extra_data: bool, config: dict): # pragma: no cover
     profiles = {k: v for k, v in profiles.items() if not v.get('autoawsume')}
     if config.get('is_interactive'):
-        formatted_profiles = format_aws_profiles(profiles, get_extra_data)
+        formatted_profiles = format_aws_profiles(profiles, get_extra_data, config)
         print_formatted_data(formatted_profiles)
     return profiles
 
@@ -325,33 +372,12 @@ def get_profile_name(config: dict, profiles: dict, target_profile_name: str, log
 
 
 def match_prefix(profile_names: list, profile_name: str) -> str:
-    prefix_words = [_ for _ in profile_names if _.startswith(profile_name)]
-    if len(prefix_words) == 1:
-        return prefix_words[0]
-    return None
+    return get_profile_matcher(profile_names).match_prefix(profile_name)
 
 
 def match_contains(profile_names: list, profile_name: str) -> str:
-    def longest_contains(str1, str2):
-        sequence_match = SequenceMatcher(None,str1,str2)
-        match = sequence_match.find_longest_match(0, len(str1), 0, len(str2))
-        return match.size
-
-    matches = {profile: longest_contains(profile_name, profile) for profile in profile_names}
-    biggest_match = max(matches.values())
-    result = [k for k in matches.keys() if matches[k] == biggest_match]
-    if len(result) == 1:
-        return result[0]
-    return None
+    return get_profile_matcher(profile_names).match_contains(profile_name)
 
 
 def match_levenshtein(profile_names: list, profile_name: str) -> str:
-    if not Levenshtein:
-        logger.debug('Levenshtein not installed, try installing awsume[fuzzy]')
-        return None
-    matches = {profile: Levenshtein.distance(profile_name, profile) for profile in profile_names}
-    closest_match = min(matches.values())
-    result = [k for k in matches.keys() if matches[k] == closest_match]
-    if len(result) == 1:
-        return result[0]
-    return None
+    return get_profile_matcher(profile_names).match_levenshtein(profile_name)
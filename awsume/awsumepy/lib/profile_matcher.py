@@ -0,0 +1,175 @@
+import json
+import bisect
+import hashlib
+import threading
+from difflib import SequenceMatcher
+
+from . import cache as cache_lib
+from . import constants
+from . atomic_file import atomic_write
+from . lazy_import import lazy_import
+from . logger import logger
+
+Levenshtein = lazy_import('Levenshtein', optional=True)
+
+PROFILE_MATCHER_VERSION = 1
+NGRAM_SIZE = 3
+AUTOJUNK_LENGTH = 200 # SequenceMatcher ignores popular characters in names this long, those are matched the slow way
+
+profile_matcher = None
+profile_matcher_lock = threading.Lock()
+
+
+def get_profile_matcher_file() -> str:
+    return str(constants.AWSUME_CACHE_DIR) + '/profile-matcher.json'
+
+
+def get_names_digest(names: list) -> str:
+    return hashlib.sha256('\n'.join(names).encode('utf-8')).hexdigest()
+
+
+def build_ngrams(names: list) -> dict:
+    """Map each n-gram to the sorted positions of the names that contain it"""
+    ngrams = {}
+    for position, name in enumerate(names):
+        if len(name) >= AUTOJUNK_LENGTH:
+            continue
+        for start in range(len(name) - NGRAM_SIZE + 1):
+            postings = ngrams.setdefault(name[start:start + NGRAM_SIZE], [])
+            if not postings or postings[-1] != position:
+                postings.append(position)
+    return ngrams
+
+
+def read_ngrams(digest: str) -> dict:
+    try:
+        with open(get_profile_matcher_file()) as f:
+            index = json.load(f)
+        if index.get('version') == PROFILE_MATCHER_VERSION and index.get('digest') == digest:
+            return index['ngrams']
+    except (OSError, ValueError, AttributeError, KeyError):
+        pass
+    return None
+
+
+def write_ngrams(digest: str, ngrams: dict):
+    try:
+        cache_lib.ensure_cache_dir()
+        atomic_write(get_profile_matcher_file(), lambda f: json.dump({
+            'version': PROFILE_MATCHER_VERSION,
+            'digest': digest,
+            'ngrams': ngrams,
+        }, f))
+    except OSError:
+        logger.debug('There was an error writing the profile matcher index', exc_info=True)
+
+
+def longest_contains(profile_name: str, name: str) -> int:
+    sequence_match = SequenceMatcher(None, profile_name, name)
+    return sequence_match.find_longest_match(0, len(profile_name), 0, len(name)).size
+
+
+class ProfileMatcher:
+    """Fuzzy profile name matching without comparing the name against every profile
+
+    Prefixes are found by binary search on the sorted names, the longest common substring
+    through an n-gram index that is kept in the cache directory, and the Levenshtein distance
+    is only computed for names whose length could beat the closest match so far. Each match
+    returns the same profile the plain scans over every profile would.
+    """
+    def __init__(self, profile_names: list):
+        self.names = sorted(profile_names)
+        self.name_set = frozenset(self.names)
+        self.lock = threading.Lock()
+        self.ngrams = None
+        self.names_by_length = {}
+        for name in self.names:
+            self.names_by_length.setdefault(len(name), []).append(name)
+
+    def get_ngrams(self) -> dict:
+        with self.lock:
+            if self.ngrams is None:
+                digest = get_names_digest(self.names)
+                self.ngrams = read_ngrams(digest)
+                if self.ngrams is None:
+                    logger.debug('Building the profile matcher index')
+                    self.ngrams = build_ngrams(self.names)
+                    write_ngrams(digest, self.ngrams)
+            return self.ngrams
+
+    def match_prefix(self, profile_name: str) -> str:
+        start = bisect.bisect_left(self.names, profile_name)
+        prefix_words = [_ for _ in self.names[start:start + 2] if _.startswith(profile_name)]
+        if len(prefix_words) == 1:
+            return prefix_words[0]
+        return None
+
+    def find_containing(self, substrings: set) -> set:
+        """Positions of the indexed names that contain any of the substrings"""
+        if len(next(iter(substrings))) < NGRAM_SIZE:
+            return {
+                position for position, name in enumerate(self.names)
+                if len(name) < AUTOJUNK_LENGTH and any(_ in name for _ in substrings)
+            }
+        ngrams = self.get_ngrams()
+        containing = set()
+        for substring in substrings:
+            postings = sorted(
+                (ngrams.get(substring[start:start + NGRAM_SIZE], []) for start in range(len(substring) - NGRAM_SIZE + 1)),
+                key=len,
+            )
+            candidates = set(postings[0])
+            for other in postings[1:]:
+                if not candidates:
+                    break
+                candidates.intersection_update(other)
+            containing.update(_ for _ in candidates if substring in self.names[_])
+        return containing
+
+    def match_contains(self, profile_name: str) -> str:
+        # a name containing a common substring of some size contains one of every smaller size,
+        # so the first size that any name contains is the longest match
+        biggest_match, result = 0, [_ for _ in self.names if len(_) < AUTOJUNK_LENGTH]
+        for size in range(len(profile_name), 0, -1):
+            containing = self.find_containing({profile_name[_:_ + size] for _ in range(len(profile_name) - size + 1)})
+            if containing:
+                biggest_match, result = size, [self.names[_] for _ in containing]
+                break
+        for name in self.names:
+            if len(name) < AUTOJUNK_LENGTH:
+                continue
+            size = longest_contains(profile_name, name)
+            if size > biggest_match:
+                biggest_match, result = size, [name]
+            elif size == biggest_match:
+                result.append(name)
+        if len(result) == 1:
+            return result[0]
+        return None
+
+    def match_levenshtein(self, profile_name: str) -> str:
+        if not Levenshtein:
+            logger.debug('Levenshtein not installed, try installing awsume[fuzzy]')
+            return None
+        closest_match, result = None, []
+        for length in sorted(self.names_by_length, key=lambda _: abs(_ - len(profile_name))):
+            if closest_match is not None and abs(length - len(profile_name)) > closest_match:
+                break # the distance is at least the difference in length
+            for name in self.names_by_length[length]:
+                distance = Levenshtein.distance(profile_name, name)
+                if closest_match is None or distance < closest_match:
+                    closest_match, result = distance, [name]
+                elif distance == closest_match:
+                    result.append(name)
+        if len(result) == 1:
+            return result[0]
+        return None
+
+
+def get_profile_matcher(profile_names: list) -> ProfileMatcher:
+    """The matcher of the given profile names, reused while the profile names stay the same"""
+    global profile_matcher
+    with profile_matcher_lock:
+        if profile_matcher is None or profile_matcher.name_set != frozenset(profile_names):
+            profile_matcher = ProfileMatcher(profile_names)
+        return profile_matcher
@@ -0,0 +1,223 @@
+import json
+import time
+import random
+import threading
+
+from . import cache as cache_lib
+from . exceptions import RateLimitError
+from . atomic_file import atomic_write, file_lock
+from . lazy_import import lazy_import
+from . logger import logger
+
+botocore_exceptions = lazy_import('botocore.exceptions')
+
+RATE_LIMIT_FILE_NAME = 'sts-rate-limit.json'
+THROTTLING_ERROR_CODES = ['Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled', 'RequestThrottledException', 'RequestLimitExceeded', 'TooManyRequestsException', 'SlowDown']
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5 # seconds, the first retry waits up to twice this
+BACKOFF_CAP = 20 # seconds, the most a single retry waits
+MAX_WAIT = 60 # seconds a call may wait for the rate limit and backoff, it fails rather than wait longer
+
+counters = {'calls': 0, 'throttles': 0, 'retries': 0, 'waited': 0.0}
+counters_lock = threading.Lock()
+
+
+def count(counter: str, amount=1):
+    with counters_lock:
+        counters[counter] += amount
+
+
+def get_counters() -> dict:
+    with counters_lock:
+        return dict(counters)
+
+
+def format_counters() -> str:
+    current = get_counters()
+    return '{} sts calls, {} throttled, {} retried, {:.2f}s waiting on the rate limit and backoff'.format(
+        current['calls'], current['throttles'], current['retries'], current['waited'],
+    )
+
+
+def get_number(key: str, default, cast=float):
+    value = cache_lib.get_config().get(key)
+    if value is None:
+        return default
+    try:
+        return max(0, cast(value))
+    except (TypeError, ValueError):
+        logger.debug('Invalid {}: {}'.format(key, value))
+        return default
+
+
+def get_rate_limit() -> tuple:
+    """The sts-rate-limit (calls per second) and sts-rate-burst configs, a rate of 0 when there is no limit"""
+    rate = get_number('sts-rate-limit', 0)
+    burst = get_number('sts-rate-burst', max(1, rate))
+    return rate, max(1, burst)
+
+
+def get_max_attempts() -> int:
+    return max(1, get_number('sts-max-attempts', DEFAULT_MAX_ATTEMPTS, int))
+
+
+def get_state_path() -> str:
+    return cache_lib.get_cache_path(RATE_LIMIT_FILE_NAME)
+
+
+def read_state() -> dict:
+    try:
+        with open(get_state_path()) as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(state: dict):
+    atomic_write(get_state_path(), lambda f: json.dump(state, f))
+
+
+def refill(state: dict, rate: float, burst: float, now: float) -> tuple:
+    """The tokens in the bucket and the time they are counted from, which is in the future while the bucket is backed off"""
+    tokens = state.get('tokens', burst)
+    updated = state.get('updated', now)
+    if now > updated:
+        tokens = min(burst, tokens + (now - updated) * rate)
+        updated = now
+    return tokens, updated
+
+
+def take_token(rate: float, burst: float, deadline: float) -> float:
+    """Reserve a token from the bucket all awsume processes share, returns the seconds until the caller may use it
+
+    The bucket goes negative, so each waiting caller gets its own slot, 1/rate after the one before it,
+    instead of all of them competing for the next token. Raises RateLimitError, without reserving a slot,
+    when the slot is after the deadline.
+    """
+    cache_lib.ensure_cache_dir()
+    with file_lock(get_state_path()):
+        state = read_state()
+        now = time.time()
+        tokens, updated = refill(state, rate, burst, now)
+        tokens -= 1
+        wait = updated - now + max(0, -tokens) / rate
+        if now + wait > deadline:
+            raise RateLimitError('The STS rate limit has no slot within {}s'.format(MAX_WAIT))
+        write_state({**state, 'tokens': tokens, 'updated': updated})
+        return wait
+
+
+def get_backoff_wait() -> float:
+    return max(0, read_state().get('backoff_until', 0) - time.time())
+
+
+def acquire():
+    """Wait until the rate limit allows an sts call, and until any backoff after throttling (by any awsume process) is over
+
+    Raises RateLimitError when that would take longer than MAX_WAIT.
+    """
+    rate, burst = get_rate_limit()
+    deadline = time.time() + MAX_WAIT
+    waited = 0
+    try:
+        while True:
+            try:
+                wait = take_token(rate, burst, deadline) if rate else get_backoff_wait()
+            except OSError:
+                logger.debug('Unable to use the sts rate limit file', exc_info=True)
+                return
+            if wait <= 0:
+                return
+            if not rate: # without slots, keep the processes waiting for the backoff from all waking up at once
+                wait += random.uniform(0, min(wait, BACKOFF_BASE))
+            if time.time() + wait > deadline:
+                raise RateLimitError('The STS backoff lasts longer than {}s'.format(MAX_WAIT))
+            logger.debug('Waiting {:.2f}s for the sts rate limit'.format(wait))
+            time.sleep(wait)
+            waited += wait
+            try:
+                if not get_backoff_wait(): # otherwise a call was throttled while we waited, wait for a slot after the backoff
+                    return
+            except OSError:
+                return
+    finally:
+        if waited:
+            count('waited', waited)
+
+
+def backoff(attempt: int) -> float:
+    """Back all awsume processes off after a throttled call, for an exponentially growing random delay, returns the delay
+
+    With a rate limit, the bucket is emptied and its slots start after the backoff.
+    """
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    rate, burst = get_rate_limit()
+    try:
+        cache_lib.ensure_cache_dir()
+        with file_lock(get_state_path()):
+            state = read_state()
+            now = time.time()
+            backoff_until = max(state.get('backoff_until', 0), now + delay)
+            state['backoff_until'] = backoff_until
+            if rate:
+                tokens, updated = refill(state, rate, burst, now)
+                state.update({'tokens': min(0, tokens), 'updated': max(updated, backoff_until)})
+            write_state(state)
+    except OSError:
+        logger.debug('Unable to write the sts rate limit file', exc_info=True)
+        time.sleep(delay)
+        count('waited', delay)
+    return delay
+
+
+def is_throttling(error: Exception) -> bool:
+    if not isinstance(error, botocore_exceptions.ClientError):
+        return False
+    return error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES or \
+        error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 429
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether the error is the endpoint's fault (it couldn't be reached, timed out or had an internal error), so a retry may work"""
+    if isinstance(error, (botocore_exceptions.ConnectionError, botocore_exceptions.HTTPClientError)):
+        return True
+    if isinstance(error, botocore_exceptions.ClientError):
+        return error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500
+    return False
+
+
+def call(function, retry_transient: bool = True):
+    """Call function (an sts call) within the rate limit, retrying it with backoff when it is throttled or has a
+    transient error, up to the sts-max-attempts config
+
+    Botocore doesn't retry awsume's sts calls, these are all the attempts. Only throttling backs off every awsume
+    process, a transient error only delays this call.
+    """
+    max_attempts = get_max_attempts()
+    attempt = 1
+    while True:
+        acquire()
+        count('calls')
+        try:
+            return function()
+        except Exception as e:
+            if is_throttling(e):
+                count('throttles')
+                reason = 'throttled'
+            elif retry_transient and is_transient(e):
+                reason = 'failed'
+            else:
+                raise
+            if attempt >= max_attempts:
+                logger.debug('sts call {}, giving up after {} attempts: {}'.format(reason, attempt, format_counters()))
+                raise
+            if reason == 'throttled':
+                delay = backoff(attempt)
+            else:
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                time.sleep(delay)
+                count('waited', delay)
+            count('retries')
+            attempt += 1
+            logger.debug('sts call {}, attempt {} of {} in {:.2f}s: {}'.format(reason, attempt, max_attempts, delay, format_counters()), exc_info=True)
@@ -1,18 +1,40 @@
 import os
 import sys
+import threading
+from contextlib import contextmanager
 
 import colorama
-import yaml
 from colorama import init
 
-from . constants import AWSUME_CONFIG
+output_state = threading.local() # each thread buffers its own output, awsume can run in worker threads
 
 
 def safe_print(message: str, color: str = '', end: str = None):
     """Safely print so no data is interfering with the shell wrapper"""
-    config = yaml.safe_load(open(str(AWSUME_CONFIG), 'r')) or {}
+    from . config_management import get_config_snapshot # config_management prints through this module
+    config = get_config_snapshot()
     if not config:
         config = {'colors': True}
     if os.name == 'nt' or config.get('colors') != True:
         color = ''
+    output_buffer = getattr(output_state, 'buffer', None)
+    if output_buffer is not None:
+        output_buffer.append(str(color) + str(message) + colorama.Style.RESET_ALL + ('\n' if end is None else end))
+        return
     print(str(color) + str(message) + colorama.Style.RESET_ALL, end=end, file=sys.stderr)
+
+
+@contextmanager
+def buffered_output():
+    """Collect this thread's safe_print output and write it to stderr in one flush when the block exits"""
+    is_outermost = getattr(output_state, 'buffer', None) is None
+    if is_outermost:
+        output_state.buffer = []
+    try:
+        yield
+    finally:
+        if is_outermost:
+            lines, output_state.buffer = output_state.buffer, None
+            if lines:
+                sys.stderr.write(''.join(lines))
+                sys.stderr.flush()
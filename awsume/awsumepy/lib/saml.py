@@ -1,14 +1,12 @@
 import base64
 import json
 
-try:
-    import xmltodict
-except:
-    xmltodict = False
-
 import colorama
 from . safe_print import safe_print
 from . exceptions import SAMLAssertionParseError, ValidationException
+from . lazy_import import lazy_import
+
+xmltodict = lazy_import('xmltodict', optional=True)
 
 
 def parse_assertion(assertion: str) -> list:
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+from . import cache as cache_lib
+from . atomic_file import atomic_write, file_lock
+from . lazy_import import lazy_import
+from . logger import logger
+
+botocore_exceptions = lazy_import('botocore.exceptions')
+botocore_session_lib = lazy_import('botocore.session')
+
+STS_ENDPOINTS_FILE_NAME = 'sts-endpoints.json'
+STS_ENDPOINTS_VERSION = 1
+MEASUREMENT_TTL = 24 * 60 * 60 # seconds before the latencies of the regional endpoints are measured again
+FAILURE_PENALTY = 5 * 60 # seconds an endpoint that failed is tried after the others
+PROBE_TIMEOUT = 2 # seconds to wait for a connection to an endpoint when measuring it
+STS_PORT = 443
+
+
+def get_sts_regional_endpoints(botocore_session=None) -> str:
+    """Whether sts calls go to the endpoint of their region (regional) or the one in us-east-1 (legacy)
+
+    The sts-regional-endpoints config comes first, then the AWS_STS_REGIONAL_ENDPOINTS environment variable and
+    the sts_regional_endpoints of the profile in the AWS config file, the way botocore reads them.
+    """
+    value = cache_lib.get_config().get('sts-regional-endpoints') or os.environ.get('AWS_STS_REGIONAL_ENDPOINTS')
+    if not value:
+        try:
+            value = (botocore_session or botocore_session_lib.get_session()).get_scoped_config().get('sts_regional_endpoints')
+        except botocore_exceptions.ProfileNotFound:
+            value = None
+    return value or 'regional'
+
+
+def get_endpoint_url() -> str:
+    """The sts-endpoint-url config, None leaves the endpoint of each region to botocore"""
+    return cache_lib.get_config().get('sts-endpoint-url') or None
+
+
+def get_probe_host(region: str) -> str:
+    """The host of the region's regional sts endpoint, only for measuring its latency"""
+    if not region or region.startswith('us-iso'):
+        return None
+    return 'sts.{}.{}'.format(region, 'amazonaws.com.cn' if region.startswith('cn-') else 'amazonaws.com')
+
+
+def get_candidate_regions(region: str) -> list:
+    regions = cache_lib.get_config().get('sts-regions') or []
+    if isinstance(regions, str):
+        regions = regions.replace(',', ' ').split()
+    return list(dict.fromkeys(([region] if region else []) + list(regions)))
+
+
+def is_selecting_fastest() -> bool:
+    config = cache_lib.get_config()
+    return config.get('sts-endpoint-selection') == 'fastest' and not config.get('sts-endpoint-url') and get_sts_regional_endpoints() == 'regional'
+
+
+def measure_latency(region: str) -> float:
+    """Milliseconds to open a connection to the region's sts endpoint, None if it can't be reached"""
+    host = get_probe_host(region)
+    if not host:
+        return None
+    start = time.perf_counter()
+    try:
+        socket.create_connection((host, STS_PORT), timeout=PROBE_TIMEOUT).close()
+    except OSError:
+        logger.debug('Unable to reach the sts endpoint of {}'.format(region), exc_info=True)
+        return None
+    return (time.perf_counter() - start) * 1000
+
+
+def get_sts_endpoints_path() -> str:
+    return cache_lib.get_cache_path(STS_ENDPOINTS_FILE_NAME)
+
+
+def read_sts_endpoints() -> dict:
+    try:
+        with open(get_sts_endpoints_path()) as f:
+            endpoints = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if endpoints.get('version') != STS_ENDPOINTS_VERSION:
+        return {}
+    return endpoints.get('regions', {})
+
+
+def update_sts_endpoints(change):
+    """Apply change to the remembered endpoints, under the file's lock so concurrent awsume processes don't lose updates"""
+    try:
+        cache_lib.ensure_cache_dir()
+        with file_lock(get_sts_endpoints_path()):
+            endpoints = read_sts_endpoints()
+            change(endpoints)
+            atomic_write(get_sts_endpoints_path(), lambda f: json.dump({
+                'version': STS_ENDPOINTS_VERSION,
+                'regions': endpoints,
+            }, f, indent=2, sort_keys=True))
+    except OSError:
+        logger.debug('There was an error writing the sts endpoints file', exc_info=True)
+
+
+def measure_endpoints(regions: list) -> dict:
+    logger.debug('Measuring sts endpoints: {}'.format(', '.join(regions)))
+    with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+        latencies = dict(zip(regions, executor.map(measure_latency, regions)))
+    now = time.time()
+
+    def change(endpoints: dict):
+        for region, latency in latencies.items():
+            endpoints[region] = {**endpoints.get(region, {}), 'latency': latency, 'measured': now}
+    update_sts_endpoints(change)
+    return latencies
+
+
+def get_sts_regions(region: str) -> list:
+    """The regions to call sts in, in the order to try them
+
+    Unless the sts-endpoint-selection config is fastest, that is only the given region. Otherwise it is
+    the region and the sts-regions config, fastest reachable endpoint first and recently failed ones last.
+    """
+    if not is_selecting_fastest():
+        return [region]
+    regions = get_candidate_regions(region)
+    if not regions:
+        return [region]
+    endpoints = read_sts_endpoints()
+    now = time.time()
+    stale_regions = [_ for _ in regions if now - endpoints.get(_, {}).get('measured', 0) > MEASUREMENT_TTL]
+    if stale_regions:
+        for stale_region, latency in measure_endpoints(stale_regions).items():
+            endpoints[stale_region] = {**endpoints.get(stale_region, {}), 'latency': latency, 'measured': now}
+
+    def rank(candidate: str) -> tuple:
+        endpoint = endpoints.get(candidate, {})
+        failed = now - endpoint.get('failed', 0) < FAILURE_PENALTY
+        latency = endpoint.get('latency')
+        return (failed, latency is None, latency or 0, regions.index(candidate))
+    ranked = sorted(regions, key=rank)
+    logger.debug('sts regions by latency: {}'.format(', '.join(ranked)))
+    return ranked
+
+
+def report_failure(region: str):
+    """Remember that the region's endpoint failed, so it is tried last for a while"""
+    if not is_selecting_fastest():
+        return
+    now = time.time()
+
+    def change(endpoints: dict):
+        endpoints[region] = {**endpoints.get(region, {}), 'failed': now}
+    update_sts_endpoints(change)
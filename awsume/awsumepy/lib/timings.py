@@ -0,0 +1,107 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+IMPORT_STARTED = time.perf_counter()
+
+
+class Timings:
+    """Wall time of each phase of awsume, for --timings
+
+    Startup phases (imports, the plugin manager, loading the config) happen once per process
+    and are kept across runs, the phases of a run are cleared when the next run starts.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.startup = []
+        self.phases = []
+
+    def record(self, phase: str, seconds: float, startup: bool = False, **details):
+        entry = {'phase': phase, 'seconds': seconds, **details}
+        with self.lock:
+            (self.startup if startup else self.phases).append(entry)
+
+    @contextmanager
+    def timed(self, phase: str, startup: bool = False, **details):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - started, startup=startup, **details)
+
+    def reset(self):
+        with self.lock:
+            self.phases = []
+
+    def entries(self) -> list:
+        with self.lock:
+            return self.startup + self.phases
+
+    def to_json(self) -> str:
+        entries = self.entries()
+        return json.dumps({
+            'phases': [{**entry, 'seconds': round(entry['seconds'], 6)} for entry in entries],
+        })
+
+    def format_table(self) -> str:
+        rows = [['PHASE', 'PLUGIN', 'MS']]
+        for entry in self.entries():
+            rows.append([
+                entry['phase'] + (' ({})'.format(entry['detail']) if entry.get('detail') else ''),
+                entry.get('plugin', ''),
+                '{:.1f}'.format(entry['seconds'] * 1000),
+            ])
+        widths = [max(map(len, column)) for column in zip(*rows)]
+        lines = ['  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows]
+        return '\n'.join(['Timings'.center(sum(widths) + 4, '=')] + lines)
+
+
+timings = Timings()
+
+
+def timed(phase: str, **details):
+    return timings.timed(phase, **details)
+
+
+def record_import():
+    if not any(entry['phase'] == 'import' for entry in timings.startup):
+        timings.record('import', time.perf_counter() - IMPORT_STARTED, startup=True)
+
+
+def instrument_plugin_manager(plugin_manager):
+    """Time every hook call, and each plugin's implementation of it"""
+    def before(hook_name, hook_impls, kwargs):
+        kwargs_started[threading.get_ident(), hook_name] = time.perf_counter()
+
+    def after(outcome, hook_name, hook_impls, kwargs):
+        started = kwargs_started.pop((threading.get_ident(), hook_name), None)
+        if started is not None:
+            timings.record('hook:' + hook_name, time.perf_counter() - started)
+
+    kwargs_started = {}
+    plugin_manager.add_hookcall_monitoring(before, after)
+    instrument_hook_impls(plugin_manager)
+
+
+def instrument_hook_impls(plugin_manager):
+    """Time each plugin's implementation of each hook, plugins registered later can be instrumented by calling this again"""
+    for hook_caller in list(plugin_manager.hook.__dict__.values()):
+        if not hasattr(hook_caller, 'get_hookimpls'):
+            continue
+        for hook_impl in hook_caller.get_hookimpls():
+            if hook_impl.hookwrapper or getattr(hook_impl, 'wrapper', False):
+                continue
+            if getattr(hook_impl.function, 'is_timed', False):
+                continue
+            hook_impl.function = time_hook_impl(hook_caller.name, hook_impl.plugin_name, hook_impl.function)
+
+
+def time_hook_impl(hook_name: str, plugin_name: str, function):
+    def timed_function(*args, **kwargs):
+        with timings.timed('plugin:' + hook_name, plugin=plugin_name):
+            return function(*args, **kwargs)
+    timed_function.__wrapped__ = function
+    timed_function.is_timed = True
+    return timed_function
@@ -6,7 +6,7 @@ _awsume() {
     COMPREPLY=()
     cur="${COMP_WORDS[COMP_CWORD]}"
     prev="${COMP_WORDS[COMP_CWORD-1]}"
-    opts=$(awsume-autocomplete)
+    opts=$(awsume-autocomplete "${cur}")
     COMPREPLY=( $(compgen -W "${opts}" -- ${cur}) )
     return 0
 }
@@ -23,13 +23,13 @@ _arguments "*: :($(awsume-autocomplete))"
 """
 
 FISH_AUTOCOMPLETE_SCRIPT = """
-complete -f --command awsume --arguments '(awsume-autocomplete)'
+complete -f --command awsume --arguments '(awsume-autocomplete (commandline -ct))'
 """
 
 POWERSHELL_AUTOCOMPLETE_SCRIPT = """
 Register-ArgumentCompleter -Native -CommandName awsume -ScriptBlock {
     param($wordToComplete, $commandAst, $cursorPosition)
-    $(awsume-autocomplete) |
+    $(awsume-autocomplete "$wordToComplete") |
     Where-Object { $_ -like "$wordToComplete*" } |
     Sort-Object |
     ForEach-Object {
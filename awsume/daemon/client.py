@@ -0,0 +1,49 @@
+import os
+import sys
+import json
+import socket
+
+from .constants import AWSUME_DAEMON_SOCKET
+
+# This module is the thin client the shell wrappers call instead of awsumepy, it must
+# stay free of awsumepy imports (importing awsumepy.lib.constants loads the whole app)
+
+
+def send_request(socket_path: str, arguments: list) -> dict:
+    request = {
+        'arguments': arguments,
+        'environment': dict(os.environ),
+        'cwd': os.getcwd(),
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with client.makefile('rb') as response_file:
+            response = response_file.readline()
+    if not response:
+        return {'fallback': True}
+    return json.loads(response.decode('utf-8'))
+
+
+def fallback(arguments: list):
+    os.execvp('awsumepy', ['awsumepy', *arguments])
+
+
+def main():
+    arguments = sys.argv[1:]
+    if not hasattr(socket, 'AF_UNIX'):
+        fallback(arguments)
+    try:
+        response = send_request(str(AWSUME_DAEMON_SOCKET), arguments)
+    except (OSError, ValueError):
+        response = {'fallback': True}
+    if response.get('fallback'):
+        fallback(arguments)
+    sys.stderr.write(response.get('stderr', ''))
+    sys.stdout.write(response.get('stdout', ''))
+    sys.stdout.flush()
+    sys.exit(response.get('status', 0))
+
+
+if __name__ == '__main__':
+    main()
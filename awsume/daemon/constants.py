@@ -0,0 +1,11 @@
+from pathlib import Path
+import os
+
+# awsumed-client imports this instead of awsumepy.lib.constants, importing awsumepy loads the whole app
+
+if os.getenv('AWSUME_DAEMON_SOCKET'):
+    AWSUME_DAEMON_SOCKET = Path(os.getenv('AWSUME_DAEMON_SOCKET')).expanduser()
+elif os.getenv('XDG_DATA_HOME'):
+    AWSUME_DAEMON_SOCKET = Path(os.getenv('XDG_DATA_HOME')).expanduser() / 'awsume/awsumed.sock'
+else:
+    AWSUME_DAEMON_SOCKET = Path('~/.awsume/awsumed.sock').expanduser()
@@ -0,0 +1,224 @@
+import io
+import os
+import sys
+import json
+import time
+import signal
+import socketserver
+import logging
+import threading
+from contextlib import redirect_stdout, redirect_stderr
+from logging.handlers import RotatingFileHandler
+
+from ..awsumepy.app import Awsume
+from ..awsumepy.lib import cache as cache_lib
+from ..awsumepy.lib import constants
+from ..awsumepy.lib.exceptions import PromptRequiredError
+from ..awsumepy.lib.config_management import load_config, migrate_to_xdg_base_directories
+from ..awsumepy.lib.logger import LOG_HANDLER, LogFormatter
+from ..awsumepy.lib.logger import logger as awsume_logger
+from .constants import AWSUME_DAEMON_SOCKET
+
+logger = logging.getLogger('awsumed') # type: logging.Logger
+
+RENEWAL_INTERVAL = 30 # seconds between checks for credentials to renew in the background
+RENEWAL_TTL = 12 * 60 * 60 # seconds after its last request that a profile stops being renewed
+RENEWAL_SKIPPED_ARGUMENTS = ['-a', '--auto-refresh', '-o', '--output-profile', '--mfa-token', '--json', '--with-saml', '--with-web-identity']
+REFRESH_ARGUMENTS = ['-r', '--refresh']
+
+
+def redact_arguments(arguments: list) -> list:
+    """The arguments of a request as they can be logged: the profile name and the flags, without any values given to them
+
+    Values can be secrets, such as MFA tokens or json credentials, and the logger only redacts what looks like an access key.
+    """
+    redacted = []
+    for index, argument in enumerate(arguments):
+        if argument.startswith('-'):
+            redacted.append(argument.split('=', 1)[0] + ('=***' if '=' in argument else ''))
+        elif index == 0:
+            redacted.append(argument)
+        else:
+            redacted.append('***')
+    return redacted
+
+
+def set_log_stream(stream):
+    """Point awsume's log handler at a stream, StreamHandler.setStream only exists since python 3.7"""
+    LOG_HANDLER.acquire()
+    try:
+        LOG_HANDLER.flush()
+        LOG_HANDLER.stream = stream
+    finally:
+        LOG_HANDLER.release()
+
+
+class AwsumeRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            response = self.server.run_request(request)
+        except Exception:
+            logger.debug('Unable to handle request', exc_info=True)
+            response = {'fallback': True}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class AwsumeDaemon(socketserver.UnixStreamServer):
+    """Keep an Awsume app warm and run awsumepy requests from the thin client one at a time"""
+    def __init__(self, socket_path: str):
+        self.app = Awsume(is_interactive=True)
+        self.request_lock = threading.Lock()
+        self.renewals = {}
+        self.stop_renewing = threading.Event()
+        original_umask = os.umask(0o077) # the socket is only ever accessible by this user, it is created that way by bind
+        try:
+            super().__init__(socket_path, AwsumeRequestHandler)
+        finally:
+            os.umask(original_umask)
+
+
+    def run_request(self, request: dict) -> dict:
+        # a request swaps the process environment, working directory and standard streams, so only one can run at a time
+        with self.request_lock:
+            return self.run_locked_request(request)
+
+
+    def remember(self, request: dict, session, is_renewal: bool = False):
+        """Remember a request that got expiring credentials, so they can be renewed before they are due for a refresh"""
+        arguments = request.get('arguments', [])
+        credentials = getattr(session, 'awsume_credentials', None)
+        if any(_.split('=', 1)[0] in RENEWAL_SKIPPED_ARGUMENTS for _ in arguments):
+            return
+        key = json.dumps([[_ for _ in arguments if _ not in REFRESH_ARGUMENTS], request.get('environment', {}), request.get('cwd')], sort_keys=True)
+        if not isinstance(credentials, dict) or not hasattr(credentials.get('Expiration'), 'timestamp'):
+            self.renewals.pop(key, None)
+            return
+        renewal = self.renewals.setdefault(key, {'request': {**request, 'arguments': json.loads(key)[0]}, 'used': time.time()})
+        renewal['expiration'] = credentials['Expiration'].timestamp()
+        if not is_renewal:
+            renewal['used'] = time.time()
+
+
+    def renew_due(self, now: float = None):
+        """Run the remembered requests whose credentials are within the role refresh margin again, so they are renewed
+        in the background and the next request finds new credentials in the cache
+
+        Requests that weren't made for RENEWAL_TTL, and those whose renewal fails or doesn't get new credentials, are forgotten.
+        """
+        now = now or time.time()
+        refresh_margin = cache_lib.get_refresh_margin('role')
+        for key in list(self.renewals):
+            with self.request_lock: # requests update the renewals too
+                renewal = self.renewals.get(key)
+                if not renewal:
+                    continue
+                if now - renewal['used'] > RENEWAL_TTL:
+                    logger.debug('No longer renewing: {}'.format(' '.join(redact_arguments(renewal['request']['arguments']))))
+                    self.renewals.pop(key)
+                    continue
+                if renewal['expiration'] - refresh_margin > now:
+                    continue
+                logger.info('Renewing credentials: {}'.format(' '.join(redact_arguments(renewal['request']['arguments']))))
+                response = self.run_locked_request(renewal['request'], is_renewal=True)
+                if response.get('status') or response.get('fallback') or self.renewals.get(key) is not renewal or renewal['expiration'] - refresh_margin <= now:
+                    logger.info('Unable to renew credentials in the background, no longer renewing them')
+                    self.renewals.pop(key, None)
+
+
+    def renew_forever(self):
+        while not self.stop_renewing.wait(RENEWAL_INTERVAL):
+            try:
+                self.renew_due()
+            except Exception:
+                logger.exception('Unable to renew credentials')
+
+
+    def run_locked_request(self, request: dict, is_renewal: bool = False) -> dict:
+        arguments = request.get('arguments', [])
+        logger.info('Running awsume: {}'.format(' '.join(redact_arguments(arguments))))
+        original_environment = dict(os.environ)
+        original_cwd = os.getcwd()
+        original_stdin = sys.stdin
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        status = 0
+        try:
+            os.environ.clear()
+            os.environ.update(request.get('environment', {}))
+            os.environ['AWSUME_NO_PROMPT'] = 'true' # prompts (e.g. MFA) cannot be answered here, they raise PromptRequiredError
+            os.chdir(request.get('cwd', original_cwd))
+            sys.stdin = io.StringIO() # never block on the daemon's own terminal
+            set_log_stream(stderr)
+            if '--debug' in arguments:
+                awsume_logger.setLevel(logging.DEBUG)
+            elif '--info' in arguments:
+                awsume_logger.setLevel(logging.INFO)
+            self.app.config = load_config()
+            self.app.config['is_interactive'] = True
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    session = self.app.run(arguments)
+                    self.remember(request, session, is_renewal)
+                except SystemExit as e:
+                    status = e.code if isinstance(e.code, int) else int(bool(e.code))
+        except PromptRequiredError:
+            logger.debug('Request needs to run in awsumepy', exc_info=True)
+            return {'fallback': True}
+        except Exception as e:
+            logger.exception('Unable to run awsume')
+            stderr.write('Awsume error: {}\n'.format(e))
+            status = 1
+        finally:
+            awsume_logger.setLevel(logging.NOTSET)
+            set_log_stream(sys.__stderr__)
+            sys.stdin = original_stdin
+            os.chdir(original_cwd)
+            os.environ.clear()
+            os.environ.update(original_environment)
+        return {
+            'stdout': stdout.getvalue(),
+            'stderr': stderr.getvalue(),
+            'status': status,
+        }
+
+
+def main():
+    configure_logger()
+    socket_path = str(AWSUME_DAEMON_SOCKET)
+    if os.path.exists(socket_path):
+        logger.debug('Removing stale socket: {}'.format(socket_path))
+        os.remove(socket_path)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server = AwsumeDaemon(socket_path)
+    logger.info('Listening on {}'.format(socket_path))
+    threading.Thread(target=server.renew_forever, daemon=True).start()
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.stop_renewing.set()
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+    logger.info('Stopped awsumed')
+
+
+def configure_logger():
+    migrate_to_xdg_base_directories()
+
+    log_file = str(constants.AWSUME_LOG_DIR / 'awsumed.log')
+
+    log_handler = RotatingFileHandler(
+        filename=log_file,
+        maxBytes=(
+            5 * # five
+            (2 ** 20) # megabytes
+        ),
+        backupCount=2,
+    )
+    log_handler.setFormatter(LogFormatter('%(asctime)s | %(name)s | %(filename)s:%(funcName)s | [%(levelname)s] | %(message)s'))
+    logger.addHandler(log_handler)
+    logger.setLevel(logging.DEBUG)
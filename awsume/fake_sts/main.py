@@ -0,0 +1,207 @@
+import re
+import sys
+import json
+import signal
+import time
+import uuid
+import random
+import fnmatch
+import argparse
+import logging
+import threading
+import socketserver
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger('awsume-fake-sts') # type: logging.Logger
+
+STS_NAMESPACE = 'https://sts.amazonaws.com/doc/2011-06-15/'
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_DURATION_SECONDS = 3600
+ACCOUNT_ID = '123456789012'
+ACCESS_KEY_ID_PATTERN = re.compile(r'Credential=([^/]+)/')
+
+
+def to_xml(value) -> str:
+    if isinstance(value, dict):
+        return ''.join('<{0}>{1}</{0}>'.format(key, to_xml(item)) for key, item in value.items())
+    return escape(str(value))
+
+
+def get_role_name(role_arn: str) -> str:
+    return role_arn.split('/')[-1] if '/' in role_arn else role_arn
+
+
+class TokenBucket(object):
+    """Allow rate requests per second on average, and bursts of up to burst requests"""
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class FakeStsRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+        params = {key: values[0] for key, values in parse_qs(body).items()}
+        match = ACCESS_KEY_ID_PATTERN.search(self.headers.get('Authorization') or '')
+        status, response = self.server.respond(params, match.group(1) if match else None)
+        self.send(status, 'text/xml', response)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send(404, 'text/plain', 'Not found')
+            return
+        self.send(200, 'application/json', json.dumps(self.server.get_stats()))
+
+    def send(self, status: int, content_type: str, body: str):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class FakeStsServer(socketserver.ThreadingMixIn, HTTPServer):
+    """An in-memory STS that answers the calls awsume makes, with optional latency, throttling and failures
+
+    Credentials it hands out are remembered, so GetCallerIdentity with them returns the role they are for.
+    """
+    daemon_threads = True
+
+    def __init__(self, address: tuple, options: argparse.Namespace):
+        super().__init__(address, FakeStsRequestHandler)
+        self.options = options
+        self.bucket = TokenBucket(options.rate_limit, options.burst or max(1, int(options.rate_limit))) if options.rate_limit else None
+        self.random = random.Random(options.seed)
+        self.lock = threading.Lock()
+        self.identities = {}
+        self.stats = {'requests': {}, 'throttled': 0, 'failed': 0, 'denied': 0}
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+    def count(self, stat: str, action: str = None):
+        with self.lock:
+            if action:
+                self.stats[stat][action] = self.stats[stat].get(action, 0) + 1
+            else:
+                self.stats[stat] += 1
+
+    def respond(self, params: dict, access_key_id: str = None) -> tuple:
+        """The HTTP status and XML body of the response to an STS query request"""
+        action = params.get('Action', '')
+        self.count('requests', action)
+        request_id = str(uuid.uuid4())
+        if self.options.latency or self.options.latency_jitter:
+            time.sleep((self.options.latency + self.random.uniform(0, self.options.latency_jitter)) / 1000)
+
+        if (self.bucket and not self.bucket.take()) or self.random.random() < self.options.throttle_rate:
+            self.count('throttled')
+            return self.error(400, 'Sender', 'Throttling', 'Rate exceeded', request_id)
+        if self.random.random() < self.options.failure_rate:
+            self.count('failed')
+            return self.error(500, 'Receiver', 'InternalFailure', 'An internal error occurred', request_id)
+
+        role_arn = params.get('RoleArn', '')
+        if role_arn and any(fnmatch.fnmatch(role_arn, _) for _ in self.options.deny_role):
+            self.count('denied')
+            return self.error(403, 'Sender', 'AccessDenied', 'Not authorized to perform sts:{} on {}'.format(action, role_arn), request_id)
+
+        if action in ['AssumeRole', 'AssumeRoleWithSAML', 'AssumeRoleWithWebIdentity']:
+            session_name = params.get('RoleSessionName', 'awsume-session')
+            arn = 'arn:aws:sts::{}:assumed-role/{}/{}'.format(ACCOUNT_ID, get_role_name(role_arn), session_name)
+            result = {
+                'Credentials': self.issue_credentials(params, arn),
+                'AssumedRoleUser': {'AssumedRoleId': 'AROAFAKESTS:' + session_name, 'Arn': arn},
+            }
+            if action == 'AssumeRoleWithWebIdentity':
+                result['SubjectFromWebIdentityToken'] = 'fake-sts'
+        elif action == 'GetSessionToken':
+            result = {'Credentials': self.issue_credentials(params, self.get_identity(access_key_id))}
+        elif action == 'GetCallerIdentity':
+            result = {'UserId': 'AIDAFAKESTS', 'Account': ACCOUNT_ID, 'Arn': self.get_identity(access_key_id)}
+        else:
+            return self.error(400, 'Sender', 'InvalidAction', 'Could not find operation {}'.format(action), request_id)
+
+        return 200, '<{0}Response xmlns="{1}"><{0}Result>{2}</{0}Result><ResponseMetadata><RequestId>{3}</RequestId></ResponseMetadata></{0}Response>'.format(
+            action, STS_NAMESPACE, to_xml(result), request_id,
+        )
+
+    def issue_credentials(self, params: dict, arn: str) -> dict:
+        access_key_id = 'ASIA' + uuid.uuid4().hex[:16].upper()
+        duration = int(params.get('DurationSeconds') or self.options.duration)
+        with self.lock:
+            self.identities[access_key_id] = arn
+        return {
+            'AccessKeyId': access_key_id,
+            'SecretAccessKey': uuid.uuid4().hex,
+            'SessionToken': uuid.uuid4().hex,
+            'Expiration': (datetime.now(timezone.utc) + timedelta(seconds=duration)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }
+
+    def get_identity(self, access_key_id: str) -> str:
+        with self.lock:
+            return self.identities.get(access_key_id, 'arn:aws:iam::{}:user/fake-sts'.format(ACCOUNT_ID))
+
+    def error(self, status: int, error_type: str, code: str, message: str, request_id: str) -> tuple:
+        return status, '<ErrorResponse xmlns="{}"><Error>{}</Error><RequestId>{}</RequestId></ErrorResponse>'.format(
+            STS_NAMESPACE, to_xml({'Type': error_type, 'Code': code, 'Message': message}), request_id,
+        )
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m awsume.fake_sts.main', description='A local fake STS endpoint for testing awsume without AWS')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='Address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on, 0 for any free port')
+    parser.add_argument('--latency', type=float, default=0, help='Milliseconds to wait before every response')
+    parser.add_argument('--latency-jitter', type=float, default=0, help='Up to this many more milliseconds to wait, at random')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Requests per second to allow before throttling, 0 for no limit')
+    parser.add_argument('--burst', type=int, default=0, help='Requests allowed at once under the rate limit, defaults to the rate limit')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='Fraction of requests to throttle at random')
+    parser.add_argument('--failure-rate', type=float, default=0, help='Fraction of requests to fail with an internal error at random')
+    parser.add_argument('--deny-role', action='append', default=[], help='Role ARN pattern to deny with AccessDenied, can be repeated')
+    parser.add_argument('--duration', type=int, default=DEFAULT_DURATION_SECONDS, help='Seconds the credentials are valid for when the request doesn\'t say')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed, for repeatable jitter, throttling and failures')
+    parser.add_argument('--debug', action='store_true', help='Log every request')
+    return parser
+
+
+def main(argv: list = None):
+    options = get_parser().parse_args(argv)
+    logging.basicConfig(format='%(asctime)s | %(name)s | %(message)s')
+    logger.setLevel(logging.DEBUG if options.debug else logging.INFO)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server = FakeStsServer((options.host, options.port), options)
+    logger.info('Listening on http://{}:{}'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+    logger.info('Stopped, stats: {}'.format(json.dumps(server.get_stats(), sort_keys=True)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
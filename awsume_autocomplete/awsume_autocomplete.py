@@ -1,9 +1,17 @@
 import os
 import sys
 import json
+import time
+import bisect
+import hashlib
+import tempfile
 import configparser
 from pathlib import Path
 
+PROFILE_INDEX_VERSION = 1
+COMPLETION_INDEX_VERSION = 1
+COMPLETION_INDEX_RACY_SECONDS = 2
+
 
 def get_aws_files() -> tuple:
     config_file = os.environ.get('AWS_CONFIG_FILE') if os.environ.get('AWS_CONFIG_FILE') else '~/.aws/config'
@@ -11,33 +19,114 @@ def get_aws_files() -> tuple:
     return str(Path(config_file).expanduser()), str(Path(credentials_file).expanduser())
 
 
-def get_profile_names(credentials_file: str, config_file: str) -> list:
-    credentials = configparser.ConfigParser()
-    credentials.read(credentials_file)
-    profiles = list(credentials._sections.keys())
+def get_cache_dir() -> Path:
+    if os.environ.get('XDG_CACHE_HOME'):
+        return Path(os.environ.get('XDG_CACHE_HOME')).expanduser() / 'awsume'
+    return Path('~/.awsume/cache').expanduser()
+
+
+def read_profile_index(file_name: str) -> dict:
+    """Read the profile index awsumepy keeps for file_name, None if it is missing or stale"""
+    file_hash = hashlib.sha1(os.path.abspath(file_name).encode('utf-8')).hexdigest()
+    index_path = get_cache_dir() / ('profile-index-' + file_hash + '.json')
+    try:
+        stat = os.stat(file_name)
+        with open(str(index_path)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != PROFILE_INDEX_VERSION or index.get('signature') != [stat.st_mtime_ns, stat.st_size, stat.st_ino]:
+        return None
+    return index.get('profiles')
+
+
+def read_profile_names(file_name: str) -> list:
+    profiles = read_profile_index(file_name)
+    if profiles is None:
+        parser = configparser.ConfigParser()
+        parser.read(file_name)
+        profiles = parser._sections
+    return list(profiles.keys())
 
-    config = configparser.ConfigParser()
-    config.read(config_file)
-    config_profiles = [_.replace('profile ', '') for _ in list(config._sections.keys())]
+
+def get_profile_names(credentials_file: str, config_file: str) -> list:
+    profiles = read_profile_names(credentials_file)
+    config_profiles = [_.replace('profile ', '') for _ in read_profile_names(config_file)]
 
     return uniquely_concat_lists(profiles, config_profiles)
 
 
 def uniquely_concat_lists(list1, list2):
+    seen = set(list1)
     for element in list2:
-        if element not in list1:
+        if element not in seen:
+            seen.add(element)
             list1.append(element)
     return list1
 
 
-def main():
-    config, credentials = get_aws_files()
-    profile_names = get_profile_names(credentials, config)
-    autocomplete_file = str(Path('~/.awsume/autocomplete.json').expanduser())
+def get_file_signature(file_name: str) -> list:
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+
+def build_profile_names(credentials_file: str, config_file: str, autocomplete_file: str) -> list:
+    profile_names = get_profile_names(credentials_file, config_file)
     if os.path.isfile(autocomplete_file):
         autocomplete = json.load(open(autocomplete_file))
         profile_names = uniquely_concat_lists(profile_names, autocomplete['profile-names'])
-    print('\n'.join(profile_names))
+    return sorted(profile_names)
+
+
+def write_completion_index(index_path: Path, sources: dict, profile_names: list):
+    signatures = [_ for _ in sources.values() if _]
+    if any(time.time() - signature[0] / 1e9 < COMPLETION_INDEX_RACY_SECONDS for signature in signatures):
+        return
+    try:
+        if not index_path.parent.exists():
+            os.makedirs(str(index_path.parent), mode=0o700)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=str(index_path.parent), prefix='.autocomplete-index-')
+        with os.fdopen(file_descriptor, 'w') as f:
+            json.dump({'version': COMPLETION_INDEX_VERSION, 'sources': sources, 'profile-names': profile_names}, f)
+        os.replace(temp_path, str(index_path))
+    except OSError:
+        pass
+
+
+def get_sorted_profile_names() -> list:
+    """Sorted, unique profile names, served from the completion index while none of its source files changed"""
+    config_file, credentials_file = get_aws_files()
+    autocomplete_file = str(Path('~/.awsume/autocomplete.json').expanduser())
+    sources = {_: get_file_signature(_) for _ in [credentials_file, config_file, autocomplete_file]}
+    index_path = get_cache_dir() / 'autocomplete-index.json'
+    try:
+        with open(str(index_path)) as f:
+            index = json.load(f)
+        if index.get('version') == COMPLETION_INDEX_VERSION and index.get('sources') == sources:
+            return index['profile-names']
+    except (OSError, ValueError, KeyError):
+        pass
+    profile_names = build_profile_names(credentials_file, config_file, autocomplete_file)
+    write_completion_index(index_path, sources, profile_names)
+    return profile_names
+
+
+def get_completions(prefix: str = '') -> list:
+    profile_names = get_sorted_profile_names()
+    completions = []
+    for profile_name in profile_names[bisect.bisect_left(profile_names, prefix):]:
+        if not profile_name.startswith(prefix):
+            break
+        completions.append(profile_name)
+    return completions
+
+
+def main():
+    prefix = sys.argv[1] if len(sys.argv) > 1 else ''
+    print('\n'.join(get_completions(prefix)))
 
 
 if __name__ == "__main__":
@@ -48,6 +48,8 @@ module.exports = {
         children: [
           '/advanced/non-interactive-awsume',
           '/advanced/autoawsume',
+          '/advanced/daemon',
+          '/advanced/fake-sts',
           '/advanced/region',
           '/advanced/role-duration',
           '/advanced/external-id',
@@ -37,6 +37,8 @@ setup(
         'console_scripts': [
             'awsumepy=awsume.awsumepy.main:main',
             'autoawsume=awsume.autoawsume.main:main',
+            'awsumed=awsume.daemon.main:main',
+            'awsumed-client=awsume.daemon.client:main',
             'awsume-configure=awsume.configure.main:main',
             'awsume-autocomplete=awsume_autocomplete:main',
         ],
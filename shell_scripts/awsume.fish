@@ -2,7 +2,13 @@
 
 #AWSUME_FLAG - what awsumepy told the shell to do
 #AWSUME_n - the data from awsumepy
-set AWSUME_OUTPUT (awsumepy $argv)
+#AWSUME_DAEMON - when set, talk to a running awsumed instead of starting awsumepy
+if set -q AWSUME_DAEMON
+  set AWSUME_PY awsumed-client
+else
+  set AWSUME_PY awsumepy
+end
+set AWSUME_OUTPUT ($AWSUME_PY $argv)
 set AWSUME_STATUS $status
 echo $AWSUME_OUTPUT | read AWSUME_FLAG AWSUME_1 AWSUME_2 AWSUME_3 AWSUME_4 AWSUME_5 AWSUME_6 AWSUME_7
 
@@ -10,15 +16,15 @@ echo $AWSUME_OUTPUT | read AWSUME_FLAG AWSUME_1 AWSUME_2 AWSUME_3 AWSUME_4 AWSUM
 set -gx AWSUME_FLAG (echo $AWSUME_FLAG | tr -d '\r')
 
 if test "$AWSUME_FLAG" = "usage:"
-  awsumepy $argv
+  $AWSUME_PY $argv
 
 
 else if test "$AWSUME_FLAG" = "Version"
-  awsumepy $argv
+  $AWSUME_PY $argv
 
 
 else if test "$AWSUME_FLAG" = "Listing..."
-  awsumepy $argv
+  $AWSUME_PY $argv
 
 
 else if test "$AWSUME_FLAG" = "Auto"
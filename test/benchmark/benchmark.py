@@ -0,0 +1,210 @@
+"""Times awsume's hot paths against synthetic AWS files, with sts stubbed in process
+
+    python test/benchmark/benchmark.py --save-baseline   # record a baseline on this machine
+    python test/benchmark/benchmark.py                   # compare against it
+
+Timings are only comparable on the machine they were measured on, so the baseline is a local file (ignored by git)
+rather than one shipped with the repo. It exits with 1 when a benchmark's median is slower than its baseline by
+more than the threshold.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+BASELINE_FILE = BENCHMARK_DIR / 'baseline.json'
+DEFAULT_SIZES = [10, 1000, 10000, 50000]
+DEFAULT_CHAIN_DEPTH = 10
+DEFAULT_THRESHOLD = 0.5 # fail when a median is this fraction slower than its baseline
+DEFAULT_MIN_DELTA_MS = 1.0 # ignore regressions smaller than this, they are timer noise
+MIN_RUNS = 3
+MAX_RUNS = 50
+MIN_TIME = 0.5 # seconds spent on each benchmark, within the run limits
+
+# awsume reads its directories and the aws file locations when it is imported, point them all at a scratch directory first
+HOME_DIR = tempfile.mkdtemp(prefix='awsume-benchmark-')
+os.environ['HOME'] = HOME_DIR
+for variable in ['XDG_CONFIG_HOME', 'XDG_DATA_HOME', 'XDG_CACHE_HOME', 'XDG_STATE_HOME', 'AWS_PROFILE', 'AWS_DEFAULT_PROFILE', 'AWS_CONFIG_FILE', 'AWS_SHARED_CREDENTIALS_FILE', 'AWS_CREDENTIALS_FILE']:
+    os.environ.pop(variable, None)
+sys.path.insert(0, str(BENCHMARK_DIR.parent.parent))
+
+from awsume_autocomplete import awsume_autocomplete
+from awsume.awsumepy import default_plugins
+from awsume.awsumepy.app import Awsume
+from awsume.awsumepy.lib import aws as aws_lib
+from awsume.awsumepy.lib import aws_files as aws_files_lib
+from awsume.awsumepy.lib import cache as cache_lib
+from awsume.awsumepy.lib import profile as profile_lib
+from awsume.autoawsume.scheduler import RefreshScheduler
+
+from synthetic import StsStub, generate_aws_files
+
+
+def measure(function, setup=None) -> dict:
+    """Time function after one warm-up call, running setup (untimed) before each call"""
+    if setup:
+        setup()
+    function()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < MIN_RUNS or (len(samples) < MAX_RUNS and time.perf_counter() - started < MIN_TIME):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'runs': len(samples),
+        'median_ms': statistics.median(samples),
+        'min_ms': min(samples),
+    }
+
+
+def remove_file(file_name: str):
+    try:
+        os.remove(file_name)
+    except OSError:
+        pass
+
+
+def use_aws_files(credentials_file: str, config_file: str):
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = credentials_file
+    os.environ['AWS_CREDENTIALS_FILE'] = credentials_file # what awsume-autocomplete reads
+    os.environ['AWS_CONFIG_FILE'] = config_file
+
+
+def use_cache_store(cache_store: str):
+    config = {'cache-store': cache_store}
+    return patch.object(cache_lib, 'get_config', return_value=config)
+
+
+def get_benchmarks(size: int, chain_depth: int) -> list:
+    """The (name, function, setup) of each benchmark for AWS files with size profiles"""
+    credentials_file, config_file = generate_aws_files(os.path.join(HOME_DIR, 'aws-{}'.format(size)), size, chain_depth)
+    use_aws_files(credentials_file, config_file)
+    arguments = argparse.Namespace(config_file=None, credentials_file=None)
+    app = Awsume(is_interactive=False)
+    profiles = default_plugins.collect_aws_profiles({}, arguments, credentials_file, config_file)
+    target = 'role-{}'.format(size // 2)
+    session = {
+        'AccessKeyId': 'ASIABENCHMARK',
+        'SecretAccessKey': 'SECRET',
+        'SessionToken': 'TOKEN',
+        'Expiration': StsStub().credentials()['Expiration'],
+    }
+
+    def clear_profile_indexes():
+        remove_file(aws_files_lib.get_profile_index_path(credentials_file))
+        remove_file(aws_files_lib.get_profile_index_path(config_file))
+
+    def clear_completion_index():
+        remove_file(str(awsume_autocomplete.get_cache_dir() / 'autocomplete-index.json'))
+
+    def cache_write(cache_store: str):
+        def write():
+            with use_cache_store(cache_store):
+                cache_lib.write_aws_cache('aws-credentials-benchmark-' + cache_store, dict(session))
+        return write
+
+    def cache_read(cache_store: str):
+        def read():
+            with use_cache_store(cache_store):
+                assert cache_lib.read_cached_session('aws-credentials-benchmark-' + cache_store)[0]
+        return read
+
+    return [
+        ('collect_aws_profiles', lambda: default_plugins.collect_aws_profiles({}, arguments, credentials_file, config_file), None),
+        ('collect_aws_profiles_unindexed', lambda: default_plugins.collect_aws_profiles({}, arguments, credentials_file, config_file), clear_profile_indexes),
+        ('get_profile_name_exact', lambda: profile_lib.get_profile_name({'fuzzy-match': True}, profiles, target, log=False), None),
+        ('get_profile_name_fuzzy', lambda: profile_lib.get_profile_name({'fuzzy-match': True}, profiles, 'rloe-{}'.format(size // 2), log=False), None),
+        ('autocomplete', lambda: awsume_autocomplete.get_completions('role-1'), None),
+        ('autocomplete_unindexed', lambda: awsume_autocomplete.get_completions('role-1'), clear_completion_index),
+        ('cache_write_files', cache_write('files'), None),
+        ('cache_read_files', cache_read('files'), cache_write('files')),
+        ('cache_write_sqlite', cache_write('sqlite'), None),
+        ('cache_read_sqlite', cache_read('sqlite'), cache_write('sqlite')),
+        ('autoawsume_scan', lambda: RefreshScheduler(credentials_file).sync(), None),
+        ('run_cached', lambda: app.run([target]), None),
+        ('run_refresh', lambda: app.run([target, '--refresh']), None),
+        ('run_role_chain', lambda: app.run(['chain-{}'.format(chain_depth), '--refresh']), None),
+    ]
+
+
+def run_benchmarks(sizes: list, chain_depth: int, selected: list) -> dict:
+    sts_stub = StsStub()
+    results = {}
+    with patch.object(aws_lib, 'get_botocore_session', lambda get_session=aws_lib.get_botocore_session: sts_stub.register(get_session())):
+        for size in sizes:
+            for name, function, setup in get_benchmarks(size, chain_depth):
+                if selected and name not in selected:
+                    continue
+                key = '{}[{}]'.format(name, size)
+                results[key] = measure(function, setup)
+                print('{:<45} {:>10.2f}ms median {:>10.2f}ms min {:>4} runs'.format(
+                    key, results[key]['median_ms'], results[key]['min_ms'], results[key]['runs'],
+                ), flush=True)
+    print('sts calls: {}'.format(json.dumps(sts_stub.calls, sort_keys=True)))
+    return results
+
+
+def find_regressions(results: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list:
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        baseline_ms = baseline[key]['median_ms']
+        if result['median_ms'] > baseline_ms * (1 + threshold) and result['median_ms'] - baseline_ms > min_delta_ms:
+            regressions.append((key, baseline_ms, result['median_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark awsume against synthetic AWS files')
+    parser.add_argument('--sizes', type=lambda _: [int(size) for size in _.split(',')], default=DEFAULT_SIZES, help='Comma separated profile counts')
+    parser.add_argument('--chain-depth', type=int, default=DEFAULT_CHAIN_DEPTH, help='Number of roles in the role chain benchmark')
+    parser.add_argument('--only', nargs='*', default=[], help='Only run these benchmarks')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Allowed slowdown from the baseline, as a fraction')
+    parser.add_argument('--min-delta-ms', type=float, default=DEFAULT_MIN_DELTA_MS, help='Ignore slowdowns smaller than this')
+    parser.add_argument('--baseline', default=str(BASELINE_FILE), help='Baseline file, recorded on this machine, to compare against or save to')
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as the baseline instead of comparing')
+    arguments = parser.parse_args()
+
+    try:
+        results = run_benchmarks(arguments.sizes, arguments.chain_depth, arguments.only)
+    finally:
+        shutil.rmtree(HOME_DIR, ignore_errors=True)
+
+    if arguments.save_baseline:
+        baseline = {}
+        if os.path.exists(arguments.baseline):
+            with open(arguments.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(arguments.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Saved baseline: {}'.format(arguments.baseline))
+        return
+
+    if not os.path.exists(arguments.baseline):
+        print('No baseline to compare against: {}, record one on this machine with --save-baseline'.format(arguments.baseline))
+        return
+    with open(arguments.baseline) as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, arguments.threshold, arguments.min_delta_ms)
+    for key, baseline_ms, median_ms in regressions:
+        print('REGRESSION {}: {:.2f}ms, baseline {:.2f}ms'.format(key, median_ms, baseline_ms))
+    if regressions:
+        sys.exit(1)
+    print('No regressions beyond {:.0%} of the baseline'.format(arguments.threshold))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from botocore.awsrequest import AWSResponse
+
+FILE_AGE_SECONDS = 60 # older than the window in which awsume won't index a file that may still be changing
+USER_PROFILE_RATIO = 100 # one user profile with access keys for every this many role profiles
+AUTOAWSUME_PROFILE_RATIO = 50 # one autoawsume profile in the credentials file for every this many role profiles
+
+
+def age_file(file_name: str):
+    then = time.time() - FILE_AGE_SECONDS
+    os.utime(file_name, (then, then))
+
+
+def generate_aws_files(directory: str, profile_count: int, chain_depth: int) -> tuple:
+    """Write a credentials and config file with about profile_count profiles, returns their paths
+
+    The role-N profiles assume a role from one of the user-N profiles, chain-N assumes a role
+    from chain-(N-1) down to chain-1, which uses user-0, and there are some autoawsume profiles.
+    """
+    os.makedirs(directory, exist_ok=True)
+    credentials_file = os.path.join(directory, 'credentials')
+    config_file = os.path.join(directory, 'config')
+    user_count = max(1, profile_count // USER_PROFILE_RATIO)
+    expiration = (datetime.now() + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+
+    with open(credentials_file, 'w') as f:
+        for index in range(user_count):
+            f.write('[user-{}]\naws_access_key_id = AKIA{:016d}\naws_secret_access_key = SECRET{}\n\n'.format(index, index, index))
+        for index in range(max(1, profile_count // AUTOAWSUME_PROFILE_RATIO)):
+            f.write('[autoawsume-role-{}]\n'.format(index))
+            f.write('aws_access_key_id = ASIA{:016d}\naws_secret_access_key = SECRET\naws_session_token = TOKEN\n'.format(index))
+            f.write('autoawsume = true\nexpiration = {}\nawsumepy_command = role-{} --auto-refresh\n\n'.format(expiration, index))
+
+    with open(config_file, 'w') as f:
+        for index in range(profile_count):
+            f.write('[profile role-{}]\n'.format(index))
+            f.write('role_arn = arn:aws:iam::{:012d}:role/benchmark-{}\n'.format(index, index))
+            f.write('source_profile = user-{}\nregion = us-east-1\n\n'.format(index % user_count))
+        for index in range(1, chain_depth + 1):
+            f.write('[profile chain-{}]\n'.format(index))
+            f.write('role_arn = arn:aws:iam::{:012d}:role/chain-{}\n'.format(index, index))
+            f.write('source_profile = {}\nregion = us-east-1\n\n'.format('chain-{}'.format(index - 1) if index > 1 else 'user-0'))
+
+    age_file(credentials_file)
+    age_file(config_file)
+    return credentials_file, config_file
+
+
+class StsStub(object):
+    """Answers sts calls in process, without a network request, counting the calls by operation
+
+    Register it on a botocore session and the session's sts clients get their responses from it.
+    """
+    def __init__(self):
+        self.calls = {}
+
+    def register(self, botocore_session):
+        botocore_session.register('before-call.sts', self)
+        return botocore_session
+
+    def credentials(self) -> dict:
+        return {
+            'AccessKeyId': 'ASIABENCHMARK',
+            'SecretAccessKey': 'SECRET',
+            'SessionToken': 'TOKEN',
+            'Expiration': datetime.now(timezone.utc) + timedelta(hours=1),
+        }
+
+    def __call__(self, model, params, **kwargs):
+        self.calls[model.name] = self.calls.get(model.name, 0) + 1
+        if model.name == 'GetCallerIdentity':
+            response = {'UserId': 'BENCHMARK', 'Account': '123456789012', 'Arn': 'arn:aws:iam::123456789012:user/benchmark'}
+        elif model.name in ['AssumeRole', 'AssumeRoleWithSAML', 'AssumeRoleWithWebIdentity']:
+            response = {
+                'Credentials': self.credentials(),
+                'AssumedRoleUser': {'AssumedRoleId': 'BENCHMARK:awsume', 'Arn': params.get('RoleArn', '')},
+            }
+        elif model.name == 'GetSessionToken':
+            response = {'Credentials': self.credentials()}
+        else:
+            raise NotImplementedError('The sts stub does not answer {}'.format(model.name))
+        response['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RequestId': 'benchmark'}
+        return AWSResponse(None, 200, {}, None), response
@@ -0,0 +1,76 @@
+import threading
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from awsume.autoawsume import main as autoawsume_main
+
+
+def auto_profile(command: str, expiration: datetime) -> dict:
+    return {'autoawsume': 'true', 'expiration': expiration.strftime('%Y-%m-%d %H:%M:%S'), 'awsumepy_command': command}
+
+
+def test_needs_refresh():
+    now = datetime(2020, 1, 1, 12, 0, 0)
+    assert autoawsume_main.needs_refresh(auto_profile('a', now + timedelta(seconds=30)), 60, now) is True
+    assert autoawsume_main.needs_refresh(auto_profile('a', now + timedelta(hours=1)), 60, now) is False
+    expired_source = {**auto_profile('a', now + timedelta(seconds=30)), 'source_expiration': '2019-12-31 00:00:00'}
+    assert autoawsume_main.needs_refresh(expired_source, 60, now) is False
+
+
+@patch.object(autoawsume_main, 'check_profile')
+@patch.object(autoawsume_main, 'prefetch_credentials')
+@patch('awsume.autoawsume.scheduler.read_auto_profiles')
+@patch('awsume.autoawsume.scheduler.get_file_signature')
+@patch.object(autoawsume_main, 'load_config')
+@patch.object(autoawsume_main, 'get_aws_files')
+@patch.object(autoawsume_main, 'configure_logger')
+def test_main_refreshes_profiles_due_together_one_at_a_time(configure_logger: MagicMock, get_aws_files: MagicMock, load_config: MagicMock, get_file_signature: MagicMock, read_auto_profiles: MagicMock, prefetch_credentials: MagicMock, check_profile: MagicMock):
+    soon = datetime.now() + timedelta(seconds=10)
+    get_aws_files.return_value = 'config', 'credentials'
+    load_config.return_value = {'max-workers': 4}
+    get_file_signature.return_value = [1, 1, 1]
+    read_auto_profiles.return_value = {
+        'autoawsume-a': auto_profile('a --auto-refresh', soon),
+        'autoawsume-b': auto_profile('b --auto-refresh', soon),
+    }
+    running = []
+    threads = set()
+    def check(profile_name, auto_profile, credentials_file, refresh_margin):
+        assert not running, 'profiles are refreshed one at a time'
+        running.append(profile_name)
+        threads.add(threading.current_thread())
+        running.remove(profile_name)
+        return None
+    check_profile.side_effect = check
+
+    with patch.object(autoawsume_main.cache_lib, 'get_config', return_value={}):
+        autoawsume_main.main()
+
+    prefetch_credentials.assert_called_once()
+    assert sorted(_['awsumepy_command'] for _ in prefetch_credentials.call_args[0][0]) == ['a --auto-refresh', 'b --auto-refresh']
+    assert prefetch_credentials.call_args[0][1] == 4
+    assert sorted(_[0][0] for _ in check_profile.call_args_list) == ['autoawsume-a', 'autoawsume-b']
+    assert threads == {threading.main_thread()}
+
+
+@patch.object(autoawsume_main.default_plugins, 'get_credentials')
+@patch('awsume.awsumepy.awsume.get_app')
+def test_prefetch_credentials(get_app: MagicMock, get_credentials: MagicMock):
+    app = MagicMock()
+    app.config = {}
+    app.parse_args.side_effect = lambda arguments: arguments[0]
+    app.get_profiles.side_effect = lambda arguments: {arguments: {}}
+    get_app.return_value = app
+    soon = datetime.now() + timedelta(seconds=10)
+    get_credentials.side_effect = lambda config, arguments, profiles: None if arguments == 'a' else RuntimeError('failed')
+
+    autoawsume_main.prefetch_credentials([auto_profile('a --auto-refresh', soon), auto_profile('b --auto-refresh', soon)], 2)
+
+    assert sorted(_[1]['arguments'] for _ in get_credentials.call_args_list) == ['a', 'b']
+    app.run.assert_not_called()
+
+
+@patch('awsume.awsumepy.awsume.get_app')
+def test_prefetch_credentials_single_profile(get_app: MagicMock):
+    autoawsume_main.prefetch_credentials([auto_profile('a', datetime.now())], 2)
+    get_app.assert_not_called()
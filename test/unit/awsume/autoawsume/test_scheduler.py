@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from awsume.autoawsume import scheduler
+from awsume.autoawsume.scheduler import RefreshScheduler
+
+
+def auto_profile(expiration: datetime, source_expiration: datetime = None) -> dict:
+    profile = {'autoawsume': 'true', 'expiration': expiration.strftime('%Y-%m-%d %H:%M:%S')}
+    if source_expiration:
+        profile['source_expiration'] = source_expiration.strftime('%Y-%m-%d %H:%M:%S')
+    return profile
+
+
+def test_get_next_check():
+    expiration = datetime(2020, 1, 1, 12, 0, 0)
+    assert scheduler.get_next_check(auto_profile(expiration)) == expiration - timedelta(seconds=60)
+    assert scheduler.get_next_check(auto_profile(expiration, expiration + timedelta(hours=1))) == expiration - timedelta(seconds=60)
+    assert scheduler.get_next_check(auto_profile(expiration, expiration - timedelta(hours=1))) == expiration
+    assert scheduler.get_next_check(auto_profile(expiration), refresh_margin=600) == expiration - timedelta(seconds=600)
+
+
+def test_to_local_time():
+    naive = datetime(2020, 1, 1, 12, 0, 0)
+    assert scheduler.to_local_time(naive) is naive
+    assert scheduler.to_local_time(datetime.now().astimezone()).tzinfo is None
+
+
+@patch.object(scheduler, 'read_auto_profiles')
+@patch.object(scheduler, 'get_file_signature')
+def test_sync_only_reschedules_changed_profiles(get_file_signature: MagicMock, read_auto_profiles: MagicMock):
+    now = datetime(2020, 1, 1, 12, 0, 0)
+    later = now + timedelta(hours=1)
+    get_file_signature.return_value = [1, 1, 1]
+    read_auto_profiles.return_value = {'a': auto_profile(later), 'b': auto_profile(later)}
+    refresh_scheduler = RefreshScheduler('credentials')
+
+    assert refresh_scheduler.sync(now) is True
+    assert sorted(refresh_scheduler.pop_due(now)) == ['a', 'b']
+    refresh_scheduler.schedule('a', later)
+    refresh_scheduler.schedule('b', later)
+
+    assert refresh_scheduler.sync(now) is False
+    read_auto_profiles.assert_called_once()
+
+    get_file_signature.return_value = [2, 1, 1]
+    read_auto_profiles.return_value = {'a': auto_profile(later), 'c': auto_profile(later)}
+    assert refresh_scheduler.sync(now) is True
+    assert refresh_scheduler.pop_due(now) == ['c']
+    assert len(refresh_scheduler) == 1
+    assert refresh_scheduler.pop_due(later) == ['a']
+
+
+def test_pop_due_skips_rescheduled_entries():
+    now = datetime(2020, 1, 1, 12, 0, 0)
+    refresh_scheduler = RefreshScheduler('credentials')
+    refresh_scheduler.schedule('a', now)
+    refresh_scheduler.schedule('b', now + timedelta(seconds=10))
+    refresh_scheduler.schedule('a', now + timedelta(seconds=20))
+
+    assert refresh_scheduler.pop_due(now) == []
+    assert refresh_scheduler.seconds_until_next(now) == scheduler.FILE_POLL_INTERVAL
+    assert refresh_scheduler.seconds_until_next(now + timedelta(seconds=8)) == 2
+    assert refresh_scheduler.pop_due(now + timedelta(seconds=30)) == ['b', 'a']
+    assert refresh_scheduler.seconds_until_next(now) == scheduler.FILE_POLL_INTERVAL
+
+
+def test_read_auto_profiles(tmpdir):
+    credentials_file = tmpdir.join('credentials')
+    credentials_file.write('[default]\naws_access_key_id = AKIA\n\n[autoawsume-role]\nautoawsume = true\nexpiration = 2020-01-01 12:00:00\n')
+
+    assert scheduler.read_auto_profiles(str(credentials_file)) == {
+        'autoawsume-role': {'autoawsume': 'true', 'expiration': '2020-01-01 12:00:00'},
+    }
@@ -0,0 +1,153 @@
+import os
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from awsume.awsumepy.lib import atomic_file
+from awsume.awsumepy.lib import constants
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory):
+    cache_dir = tmp_path_factory.mktemp('cache')
+    with patch.object(constants, 'AWSUME_CACHE_DIR', cache_dir):
+        yield cache_dir
+
+
+def test_atomic_write(tmp_path):
+    target = tmp_path / 'file'
+
+    atomic_file.atomic_write(str(target), lambda f: f.write('content'))
+
+    assert target.read_text() == 'content'
+    assert os.stat(str(target)).st_mode & 0o777 == 0o600
+    assert os.listdir(str(tmp_path)) == ['file']
+
+
+def test_atomic_write_keeps_permissions_and_symlinks(tmp_path):
+    target = tmp_path / 'file'
+    target.write_text('old')
+    os.chmod(str(target), 0o644)
+    link = tmp_path / 'link'
+    link.symlink_to(target)
+
+    atomic_file.atomic_write(str(link), lambda f: f.write('new'))
+
+    assert link.is_symlink()
+    assert target.read_text() == 'new'
+    assert os.stat(str(target)).st_mode & 0o777 == 0o644
+
+
+def test_atomic_write_error_keeps_old_file(tmp_path):
+    target = tmp_path / 'file'
+    target.write_text('old')
+    write = MagicMock(side_effect=ValueError())
+
+    with pytest.raises(ValueError):
+        atomic_file.atomic_write(str(target), write)
+
+    assert target.read_text() == 'old'
+    assert os.listdir(str(tmp_path)) == ['file']
+
+
+def test_file_lock_serializes_writers(tmp_path):
+    target = tmp_path / 'file'
+    target.write_text('0')
+
+    def increment():
+        for _ in range(20):
+            with atomic_file.file_lock(str(target)):
+                value = int(target.read_text())
+                atomic_file.atomic_write(str(target), lambda f: f.write(str(value + 1)))
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert target.read_text() == '80'
+
+
+def test_file_lock_reentrant(tmp_path):
+    target = tmp_path / 'file'
+
+    with atomic_file.file_lock(str(target)):
+        with atomic_file.file_lock(str(target)):
+            atomic_file.atomic_write(str(target), lambda f: f.write('content'))
+
+    assert target.read_text() == 'content'
+
+
+def test_file_lock_other_files_not_blocked(tmp_path):
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold_lock():
+        with atomic_file.file_lock(str(tmp_path / 'first')):
+            locked.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    locked.wait(5)
+    try:
+        with atomic_file.file_lock(str(tmp_path / 'second')):
+            assert not release.is_set()
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_file_lock_in_cache_dir(tmp_path, cache_dir):
+    target = tmp_path / 'file'
+    link = tmp_path / 'link'
+    link.symlink_to(target)
+
+    with atomic_file.file_lock(str(target)):
+        pass
+
+    assert os.listdir(str(tmp_path)) == ['link']
+    assert os.listdir(str(cache_dir / atomic_file.LOCK_DIR_NAME)) == [os.path.basename(atomic_file.get_lock_path(str(link)))]
+    assert os.stat(str(cache_dir / atomic_file.LOCK_DIR_NAME)).st_mode & 0o777 == 0o700
+
+
+@patch.object(atomic_file, 'LOCK_NOTICE_SECONDS', 0)
+@patch.object(atomic_file, 'safe_print')
+def test_file_lock_timeout(safe_print: MagicMock, tmp_path):
+    target = str(tmp_path / 'file')
+    file_descriptor = os.open(atomic_file.get_lock_path(target), os.O_RDWR | os.O_CREAT, 0o600)
+    atomic_file.fcntl.flock(file_descriptor, atomic_file.fcntl.LOCK_EX) # held like another awsume process would
+    try:
+        with pytest.raises(TimeoutError):
+            with atomic_file.file_lock(target, timeout=0.1, waiting_message='Waiting'):
+                pass
+    finally:
+        os.close(file_descriptor)
+
+    safe_print.assert_called_once()
+    assert safe_print.call_args[0][0] == 'Waiting'
+    with atomic_file.file_lock(target, timeout=0.1):
+        pass
+
+
+def test_file_lock_timeout_other_thread(tmp_path):
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold_lock():
+        with atomic_file.file_lock(str(tmp_path / 'file')):
+            locked.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    locked.wait(5)
+    try:
+        with pytest.raises(TimeoutError):
+            with atomic_file.file_lock(str(tmp_path / 'file'), timeout=0.1):
+                pass
+    finally:
+        release.set()
+        thread.join()
@@ -1,14 +1,46 @@
-from datetime import datetime
-from unittest.mock import MagicMock, mock_open, patch
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import ANY, MagicMock, mock_open, patch
+import botocore.exceptions
 import dateutil
 import pytest
 from awsume.awsumepy.lib import aws, constants
 from awsume.awsumepy.lib.exceptions import RoleAuthenticationError, UserAuthenticationError
 
 
+@pytest.fixture(autouse=True)
+def clear_sts_client_pool():
+    aws.clear_sts_client_pool()
+    yield
+    aws.clear_sts_client_pool()
+
+
+@pytest.fixture(autouse=True)
+def config():
+    with patch('awsume.awsumepy.lib.cache.get_config') as get_config:
+        get_config.return_value = {}
+        yield get_config
+
+
+@pytest.fixture(autouse=True)
+def acquire():
+    with patch('awsume.awsumepy.lib.rate_limit.acquire') as acquire:
+        yield acquire
+
+
+@pytest.fixture(autouse=True)
+def cache_lock():
+    with patch('awsume.awsumepy.lib.cache.cache_lock') as cache_lock:
+        yield cache_lock
+
+
+@patch('awsume.awsumepy.lib.cache.write_aws_cache')
+@patch('awsume.awsumepy.lib.cache.valid_cache_session')
+@patch('awsume.awsumepy.lib.cache.read_aws_cache')
 @patch.object(aws, 'safe_print')
 @patch('boto3.session.Session')
-def test_assume_role(Session: MagicMock, safe_print: MagicMock):
+def test_assume_role(Session: MagicMock, safe_print: MagicMock, read_aws_cache: MagicMock, valid_cache_session: MagicMock, write_aws_cache: MagicMock):
     expiration = MagicMock()
     source_credentials = {
         'AccessKeyId': 'AKIA...',
@@ -19,6 +51,8 @@ def test_assume_role(Session: MagicMock, safe_print: MagicMock):
     session = MagicMock()
     session.client.return_value = client
     Session.return_value = session
+    read_aws_cache.return_value = {}
+    valid_cache_session.return_value = False
     client.assume_role.return_value = {
         'Credentials': {
             'AccessKeyId': 'AKIA...',
@@ -38,6 +72,7 @@ def test_assume_role(Session: MagicMock, safe_print: MagicMock):
     )
 
     Session.assert_called_with(
+        botocore_session=ANY,
         aws_access_key_id=source_credentials.get('AccessKeyId'),
         aws_secret_access_key=source_credentials.get('SecretAccessKey'),
         aws_session_token=source_credentials.get('SessionToken'),
@@ -54,9 +89,12 @@ def test_assume_role(Session: MagicMock, safe_print: MagicMock):
     expiration.astimezone.assert_called_with(dateutil.tz.tzlocal())
 
 
+@patch('awsume.awsumepy.lib.cache.write_aws_cache')
+@patch('awsume.awsumepy.lib.cache.valid_cache_session')
+@patch('awsume.awsumepy.lib.cache.read_aws_cache')
 @patch.object(aws, 'safe_print')
 @patch('boto3.session.Session')
-def test_assume_role_minimal_parameters(Session: MagicMock, safe_print: MagicMock):
+def test_assume_role_minimal_parameters(Session: MagicMock, safe_print: MagicMock, read_aws_cache: MagicMock, valid_cache_session: MagicMock, write_aws_cache: MagicMock):
     expiration = MagicMock()
     source_credentials = {
         'AccessKeyId': 'AKIA...',
@@ -67,6 +105,8 @@ def test_assume_role_minimal_parameters(Session: MagicMock, safe_print: MagicMoc
     session = MagicMock()
     session.client.return_value = client
     Session.return_value = session
+    read_aws_cache.return_value = {}
+    valid_cache_session.return_value = False
     client.assume_role.return_value = {
         'Credentials': {
             'AccessKeyId': 'AKIA...',
@@ -81,6 +121,7 @@ def test_assume_role_minimal_parameters(Session: MagicMock, safe_print: MagicMoc
     )
 
     Session.assert_called_with(
+        botocore_session=ANY,
         aws_access_key_id=source_credentials.get('AccessKeyId'),
         aws_secret_access_key=source_credentials.get('SecretAccessKey'),
         aws_session_token=source_credentials.get('SessionToken'),
@@ -94,9 +135,12 @@ def test_assume_role_minimal_parameters(Session: MagicMock, safe_print: MagicMoc
 
 
 
+@patch('awsume.awsumepy.lib.cache.write_aws_cache')
+@patch('awsume.awsumepy.lib.cache.valid_cache_session')
+@patch('awsume.awsumepy.lib.cache.read_aws_cache')
 @patch.object(aws, 'safe_print')
 @patch('boto3.session.Session')
-def test_assume_role_raise_exception(Session: MagicMock, safe_print: MagicMock):
+def test_assume_role_raise_exception(Session: MagicMock, safe_print: MagicMock, read_aws_cache: MagicMock, valid_cache_session: MagicMock, write_aws_cache: MagicMock):
     source_credentials = {
         'AccessKeyId': 'AKIA...',
         'SecretAccessKeyId': 'SECRET',
@@ -106,12 +150,67 @@ def test_assume_role_raise_exception(Session: MagicMock, safe_print: MagicMock):
     session = MagicMock()
     session.client.return_value = client
     Session.return_value = session
+    read_aws_cache.return_value = {}
+    valid_cache_session.return_value = False
     client.assume_role.side_effect = Exception('Some Error')
 
     with pytest.raises(RoleAuthenticationError):
         aws.assume_role(source_credentials, 'myrolearn', 'mysessionname')
 
 
+@patch('awsume.awsumepy.lib.cache.write_aws_cache')
+@patch('awsume.awsumepy.lib.cache.valid_cache_session')
+@patch('awsume.awsumepy.lib.cache.read_aws_cache')
+@patch.object(aws, 'safe_print')
+@patch('boto3.session.Session')
+def test_assume_role_valid_cache(Session: MagicMock, safe_print: MagicMock, read_aws_cache: MagicMock, valid_cache_session: MagicMock, write_aws_cache: MagicMock):
+    source_credentials = {
+        'AccessKeyId': 'AKIA...',
+        'SecretAccessKeyId': 'SECRET',
+        'SessionToken': 'LONG',
+    }
+    read_aws_cache.return_value = {
+        'AccessKeyId': 'ASIA...',
+        'SecretAccessKey': 'SECRET',
+        'SessionToken': 'LONG',
+        'Expiration': datetime.now(),
+    }
+    valid_cache_session.return_value = True
+
+    result = aws.assume_role(source_credentials, 'myrolearn', 'mysessionname', region='us-east-2')
+
+    Session.assert_not_called()
+    write_aws_cache.assert_not_called()
+    assert result == read_aws_cache.return_value
+    assert result['Region'] == 'us-east-2'
+
+
+@patch('awsume.awsumepy.lib.cache.write_aws_cache')
+@patch('awsume.awsumepy.lib.cache.valid_cache_session')
+@patch('awsume.awsumepy.lib.cache.read_aws_cache')
+@patch.object(aws, 'safe_print')
+@patch('boto3.session.Session')
+def test_assume_role_no_source_credentials_skips_cache(Session: MagicMock, safe_print: MagicMock, read_aws_cache: MagicMock, valid_cache_session: MagicMock, write_aws_cache: MagicMock):
+    client = MagicMock()
+    session = MagicMock()
+    session.client.return_value = client
+    Session.return_value = session
+    client.assume_role.return_value = {
+        'Credentials': {
+            'AccessKeyId': 'AKIA...',
+            'SecretAccessKeyId': 'SECRET',
+            'SessionToken': 'LONG',
+            'Expiration': MagicMock(),
+        },
+    }
+
+    aws.assume_role({}, 'myrolearn', 'mysessionname')
+
+    read_aws_cache.assert_not_called()
+    write_aws_cache.assert_not_called()
+    client.assume_role.assert_called()
+
+
 @patch('awsume.awsumepy.lib.cache.write_aws_cache')
 @patch('awsume.awsumepy.lib.cache.valid_cache_session')
 @patch('awsume.awsumepy.lib.cache.read_aws_cache')
@@ -148,6 +247,7 @@ def test_get_session_token(Session: MagicMock, safe_print: MagicMock, read_aws_c
     )
 
     Session.assert_called_with(
+        botocore_session=ANY,
         aws_access_key_id=source_credentials.get('AccessKeyId'),
         aws_secret_access_key=source_credentials.get('SecretAccessKey'),
         aws_session_token=source_credentials.get('SessionToken'),
@@ -202,6 +302,84 @@ def test_get_session_token_valid_cache(Session: MagicMock, safe_print: MagicMock
     assert result == read_aws_cache.return_value
 
 
+@patch.object(aws, 'can_prompt')
+@patch.object(aws.profile_lib, 'get_mfa_token')
+@patch('awsume.awsumepy.lib.cache.write_aws_cache')
+@patch('awsume.awsumepy.lib.cache.read_aws_cache')
+@patch('boto3.session.Session')
+def test_get_session_token_refresh_ahead(Session: MagicMock, read_aws_cache: MagicMock, write_aws_cache: MagicMock, get_mfa_token: MagicMock, can_prompt: MagicMock, config: MagicMock):
+    config.return_value = {'refresh-margin': {'session': 900}}
+    source_credentials = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET'}
+    cache_session = {
+        'AccessKeyId': 'ASIA...',
+        'SecretAccessKey': 'SECRET',
+        'SessionToken': 'LONG',
+        'Expiration': datetime.now() + timedelta(minutes=10),
+    }
+    read_aws_cache.return_value = cache_session
+    client = Session.return_value.client.return_value
+    client.get_session_token.return_value = {'Credentials': {'Expiration': datetime.now().astimezone()}}
+    get_mfa_token.return_value = '123123'
+    can_prompt.return_value = True
+
+    result = aws.get_session_token(source_credentials, mfa_serial='mymfaserial')
+
+    get_mfa_token.assert_called()
+    client.get_session_token.assert_called_with(SerialNumber='mymfaserial', TokenCode='123123')
+    write_aws_cache.assert_called()
+    assert result is not cache_session
+
+    client.get_session_token.reset_mock()
+    can_prompt.return_value = False
+    assert aws.get_session_token(source_credentials, mfa_serial='mymfaserial') == cache_session
+    client.get_session_token.assert_not_called()
+
+    client.get_session_token.side_effect = Exception('throttled')
+    assert aws.get_session_token(source_credentials, mfa_serial='mymfaserial', mfa_token='123123') == cache_session
+
+
+@patch('awsume.awsumepy.lib.cache.write_aws_cache')
+@patch('awsume.awsumepy.lib.cache.read_aws_cache')
+@patch('boto3.session.Session')
+def test_assume_role_refresh_ahead_failure_uses_cache(Session: MagicMock, read_aws_cache: MagicMock, write_aws_cache: MagicMock):
+    cache_session = {
+        'AccessKeyId': 'ASIA...',
+        'SecretAccessKey': 'SECRET',
+        'SessionToken': 'LONG',
+        'Expiration': datetime.now() + timedelta(minutes=2),
+    }
+    read_aws_cache.return_value = cache_session
+    Session.return_value.client.return_value.assume_role.side_effect = Exception('throttled')
+
+    result = aws.assume_role({'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET'}, 'myrolearn', 'mysessionname')
+
+    Session.return_value.client.return_value.assume_role.assert_called()
+    write_aws_cache.assert_not_called()
+    assert result == cache_session
+
+
+@patch.object(aws.profile_lib, 'get_mfa_token')
+@patch('awsume.awsumepy.lib.cache.write_aws_cache')
+@patch('awsume.awsumepy.lib.cache.valid_cache_session')
+@patch('awsume.awsumepy.lib.cache.read_aws_cache')
+@patch('boto3.session.Session')
+def test_get_session_token_cached_while_waiting_for_lock(Session: MagicMock, read_aws_cache: MagicMock, valid_cache_session: MagicMock, write_aws_cache: MagicMock, get_mfa_token: MagicMock, cache_lock: MagicMock):
+    source_credentials = {
+        'AccessKeyId': 'AKIA...',
+        'SecretAccessKeyId': 'SECRET',
+    }
+    read_aws_cache.return_value = {'Expiration': datetime.now()}
+    valid_cache_session.side_effect = [False, True]
+
+    result = aws.get_session_token(source_credentials, mfa_serial='mymfaserial')
+
+    cache_lock.assert_called_with('aws-credentials-AKIA...')
+    get_mfa_token.assert_not_called()
+    Session.assert_not_called()
+    write_aws_cache.assert_not_called()
+    assert result == read_aws_cache.return_value
+
+
 @patch('awsume.awsumepy.lib.cache.write_aws_cache')
 @patch('awsume.awsumepy.lib.cache.valid_cache_session')
 @patch('awsume.awsumepy.lib.cache.read_aws_cache')
@@ -238,6 +416,7 @@ def test_get_session_token_ignore_cache(Session: MagicMock, safe_print: MagicMoc
     )
 
     Session.assert_called_with(
+        botocore_session=ANY,
         aws_access_key_id=source_credentials.get('AccessKeyId'),
         aws_secret_access_key=source_credentials.get('SecretAccessKey'),
         aws_session_token=source_credentials.get('SessionToken'),
@@ -291,6 +470,7 @@ def test_get_account_id(Session: MagicMock):
     result = aws.get_account_id(source_credentials)
 
     Session.assert_called_with(
+        botocore_session=ANY,
         aws_access_key_id=source_credentials.get('AccessKeyId'),
         aws_secret_access_key=source_credentials.get('SecretAccessKey'),
         aws_session_token=source_credentials.get('SessionToken'),
@@ -315,9 +495,159 @@ def test_get_account_id_raise_exception(Session: MagicMock):
     result = aws.get_account_id(source_credentials)
 
     Session.assert_called_with(
+        botocore_session=ANY,
         aws_access_key_id=source_credentials.get('AccessKeyId'),
         aws_secret_access_key=source_credentials.get('SecretAccessKey'),
         aws_session_token=source_credentials.get('SessionToken'),
         region_name='us-east-1',
     )
     assert result == 'Unavailable'
+
+
+@patch('boto3.session.Session')
+def test_get_sts_client_pools_explicit_credentials(Session: MagicMock):
+    credentials = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET', 'SessionToken': 'LONG'}
+
+    first = aws.get_sts_client(credentials, 'us-east-1')
+    second = aws.get_sts_client(dict(credentials), 'us-east-1')
+    other_region = aws.get_sts_client(credentials, 'us-west-2')
+
+    assert first is second
+    assert Session.call_count == 2
+    assert Session.return_value.client.call_count == 2
+    assert other_region is Session.return_value.client.return_value
+
+
+@patch('boto3.session.Session')
+def test_get_sts_client_ambient_credentials_not_pooled(Session: MagicMock):
+    aws.get_sts_client({}, 'us-east-1')
+    aws.get_sts_client({}, 'us-east-1')
+
+    assert Session.call_count == 2
+    assert aws.sts_client_pool == {}
+
+
+def test_get_sts_client_without_region_not_pooled():
+    credentials = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET'}
+    with patch.dict('os.environ', {'AWS_DEFAULT_REGION': 'eu-west-1'}):
+        assert aws.get_sts_client(credentials).meta.region_name == 'eu-west-1'
+    with patch.dict('os.environ', {'AWS_DEFAULT_REGION': 'ap-southeast-2'}):
+        assert aws.get_sts_client(credentials).meta.region_name == 'ap-southeast-2'
+    assert aws.sts_client_pool == {}
+
+
+def test_get_sts_client_pooled_by_environment():
+    credentials = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET'}
+    with patch.dict('os.environ', {'AWS_USE_FIPS_ENDPOINT': 'false'}):
+        assert aws.get_sts_client(credentials, 'us-east-1').meta.endpoint_url == 'https://sts.us-east-1.amazonaws.com'
+    with patch.dict('os.environ', {'AWS_USE_FIPS_ENDPOINT': 'true'}):
+        assert aws.get_sts_client(credentials, 'us-east-1').meta.endpoint_url == 'https://sts-fips.us-east-1.amazonaws.com'
+
+
+@patch.object(aws, 'STS_CLIENT_POOL_SIZE', 2)
+@patch('boto3.session.Session')
+def test_get_sts_client_pool_evicts_least_recently_used(Session: MagicMock):
+    Session.return_value.client.side_effect = lambda service, **kwargs: MagicMock()
+    aws.get_sts_client({'AccessKeyId': 'A'}, 'us-east-1')
+    aws.get_sts_client({'AccessKeyId': 'B'}, 'us-east-1')
+    aws.get_sts_client({'AccessKeyId': 'A'}, 'us-east-1')
+    aws.get_sts_client({'AccessKeyId': 'C'}, 'us-east-1')
+
+    assert [key[1] for key in aws.sts_client_pool] == ['A', 'C']
+
+
+@patch('boto3.session.Session')
+def test_get_sts_client_endpoint_url(Session: MagicMock, config: MagicMock):
+    credentials = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET'}
+    aws.get_sts_client(credentials, 'us-east-1')
+    Session.return_value.client.assert_called_with('sts', endpoint_url=None, config=ANY)
+
+    config.return_value = {'sts-endpoint-url': 'http://localhost:8765'}
+    aws.get_sts_client(credentials, 'us-east-1')
+
+    Session.return_value.client.assert_called_with('sts', endpoint_url='http://localhost:8765', config=ANY)
+    assert Session.return_value.client.call_count == 2
+
+
+def test_get_sts_client_resolves_endpoint(config: MagicMock, tmp_path):
+    config_file = tmp_path / 'config'
+    config_file.write_text('[default]\nsts_regional_endpoints = legacy\n')
+    credentials = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET'}
+    with patch.dict('os.environ', {'AWS_CONFIG_FILE': str(tmp_path / 'missing')}, clear=True):
+        assert aws.get_sts_client(credentials, 'ap-southeast-2').meta.endpoint_url == 'https://sts.ap-southeast-2.amazonaws.com'
+        aws.clear_sts_client_pool()
+        os.environ['AWS_USE_FIPS_ENDPOINT'] = 'true'
+        assert aws.get_sts_client(credentials, 'us-east-1').meta.endpoint_url == 'https://sts-fips.us-east-1.amazonaws.com'
+    aws.clear_sts_client_pool()
+    with patch.dict('os.environ', {'AWS_CONFIG_FILE': str(config_file)}, clear=True):
+        assert aws.get_sts_client(credentials, 'ap-southeast-2').meta.endpoint_url == 'https://sts.amazonaws.com'
+        aws.clear_sts_client_pool()
+        config.return_value = {'sts-regional-endpoints': 'regional'}
+        assert aws.get_sts_client(credentials, 'ap-southeast-2').meta.endpoint_url == 'https://sts.ap-southeast-2.amazonaws.com'
+
+
+@patch.object(aws.sts_endpoints, 'report_failure')
+@patch.object(aws.sts_endpoints, 'get_sts_regions')
+@patch.object(aws, 'get_sts_client')
+def test_call_sts_fails_over(get_sts_client: MagicMock, get_sts_regions: MagicMock, report_failure: MagicMock):
+    get_sts_regions.return_value = ['ap-southeast-2', 'ap-southeast-1']
+    failing_client = MagicMock()
+    failing_client.get_caller_identity.side_effect = botocore.exceptions.EndpointConnectionError(endpoint_url='https://sts.ap-southeast-2.amazonaws.com')
+    working_client = MagicMock()
+    get_sts_client.side_effect = [failing_client, working_client]
+
+    response, sts_client = aws.call_sts({'AccessKeyId': 'AKIA...'}, 'ap-southeast-2', 'get_caller_identity')
+
+    assert response is working_client.get_caller_identity.return_value
+    assert sts_client is working_client
+    get_sts_client.assert_called_with({'AccessKeyId': 'AKIA...'}, 'ap-southeast-1')
+    report_failure.assert_called_with('ap-southeast-2')
+
+
+@patch.object(aws.sts_endpoints, 'report_failure')
+@patch.object(aws.sts_endpoints, 'get_sts_regions')
+@patch.object(aws, 'get_sts_client')
+def test_call_sts_does_not_fail_over_client_errors(get_sts_client: MagicMock, get_sts_regions: MagicMock, report_failure: MagicMock):
+    get_sts_regions.return_value = ['ap-southeast-2', 'ap-southeast-1']
+    error = botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied'}, 'ResponseMetadata': {'HTTPStatusCode': 403}}, 'AssumeRole')
+    get_sts_client.return_value.assume_role.side_effect = error
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        aws.call_sts({'AccessKeyId': 'AKIA...'}, 'ap-southeast-2', 'assume_role', RoleArn='myrole')
+
+    assert get_sts_client.call_count == 1
+    report_failure.assert_not_called()
+
+
+def test_get_botocore_session_shares_data_loader():
+    first = aws.get_botocore_session()
+    second = aws.get_botocore_session()
+
+    assert first is not second
+    assert first.get_component('data_loader') is second.get_component('data_loader')
+
+
+@patch.object(aws.profile_lib, 'get_mfa_token')
+@patch('awsume.awsumepy.lib.cache.write_aws_cache')
+@patch('awsume.awsumepy.lib.cache.read_aws_cache')
+@patch('boto3.session.Session')
+def test_get_session_token_prompts_outside_lock(Session: MagicMock, read_aws_cache: MagicMock, write_aws_cache: MagicMock, get_mfa_token: MagicMock, cache_lock: MagicMock):
+    locked = []
+
+    @contextmanager
+    def lock(cache_file_name):
+        locked.append(cache_file_name)
+        yield
+        locked.remove(cache_file_name)
+
+    cache_lock.side_effect = lock
+    read_aws_cache.return_value = {}
+    client = Session.return_value.client.return_value
+    client.get_session_token.return_value = {'Credentials': {'Expiration': datetime.now().astimezone()}}
+    get_mfa_token.side_effect = lambda: '123123' if not locked else None
+
+    aws.get_session_token({'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET'}, mfa_serial='mymfaserial')
+
+    get_mfa_token.assert_called_once()
+    client.get_session_token.assert_called_with(SerialNumber='mymfaserial', TokenCode='123123')
+    assert cache_lock.call_count == 2
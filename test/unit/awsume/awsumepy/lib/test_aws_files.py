@@ -1,4 +1,5 @@
 import os
+import time
 import json
 import pytest
 import argparse
@@ -10,6 +11,13 @@ from awsume.awsumepy.lib import constants
 from awsume.awsumepy.lib import aws_files
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory):
+    cache_dir = tmp_path_factory.mktemp('cache')
+    with patch.object(constants, 'AWSUME_CACHE_DIR', cache_dir):
+        yield cache_dir
+
+
 @patch.dict('os.environ', {'AWS_CONFIG_FILE': '', 'AWS_SHARED_CREDENTIALS_FILE': ''}, clear=True)
 def test_get_aws_files():
     args = argparse.Namespace(config_file=None, credentials_file=None)
@@ -58,9 +66,10 @@ def test_get_aws_files_environment():
     assert credentials_file == str(Path('my/credentials/file'))
 
 
-@patch('builtins.open')
+@patch.object(aws_files, 'file_lock')
+@patch.object(aws_files, 'atomic_write')
 @patch('configparser.ConfigParser')
-def test_add_section(ConfigParser: MagicMock, open: MagicMock):
+def test_add_section(ConfigParser: MagicMock, atomic_write: MagicMock, file_lock: MagicMock):
     parser = MagicMock()
     ConfigParser.return_value = parser
     parser.has_section.return_value = True
@@ -72,14 +81,15 @@ def test_add_section(ConfigParser: MagicMock, open: MagicMock):
     parser.add_section.assert_called_once_with('section-name')
     assert parser.set.call_count == 3
     parser.set.assert_any_call('section-name', 'manager', 'awsume')
-    parser.write.assert_called_once()
-    open.assert_called_once()
+    atomic_write.assert_called_once_with('file-name', parser.write)
+    file_lock.assert_called_once_with('file-name')
 
 
 @patch.object(aws_files, 'safe_print')
-@patch('builtins.open')
+@patch.object(aws_files, 'file_lock')
+@patch.object(aws_files, 'atomic_write')
 @patch('configparser.ConfigParser')
-def test_add_section_no_overwrite(ConfigParser: MagicMock, open: MagicMock, safe_print: MagicMock):
+def test_add_section_no_overwrite(ConfigParser: MagicMock, atomic_write: MagicMock, file_lock: MagicMock, safe_print: MagicMock):
     parser = MagicMock()
     ConfigParser.return_value = parser
     parser.has_section.return_value = True
@@ -90,13 +100,15 @@ def test_add_section_no_overwrite(ConfigParser: MagicMock, open: MagicMock, safe
     parser.remove_section.assert_not_called()
     parser.add_section.assert_not_called()
     parser.set.assert_not_called()
+    atomic_write.assert_not_called()
 
 
 
 @patch.object(aws_files, 'safe_print')
-@patch('builtins.open')
+@patch.object(aws_files, 'file_lock')
+@patch.object(aws_files, 'atomic_write')
 @patch('configparser.ConfigParser')
-def test_add_section_new_section(ConfigParser: MagicMock, open: MagicMock, safe_print: MagicMock):
+def test_add_section_new_section(ConfigParser: MagicMock, atomic_write: MagicMock, file_lock: MagicMock, safe_print: MagicMock):
     parser = MagicMock()
     ConfigParser.return_value = parser
     parser.has_section.return_value = False
@@ -108,13 +120,14 @@ def test_add_section_new_section(ConfigParser: MagicMock, open: MagicMock, safe_
     parser.add_section.assert_called_once_with('section-name')
     assert parser.set.call_count == 3
     parser.set.assert_any_call('section-name', 'manager', 'awsume')
-    parser.write.assert_called_once()
-    open.assert_called_once()
+    atomic_write.assert_called_once_with('file-name', parser.write)
+    file_lock.assert_called_once_with('file-name')
 
 
-@patch('builtins.open')
+@patch.object(aws_files, 'file_lock')
+@patch.object(aws_files, 'atomic_write')
 @patch('configparser.ConfigParser')
-def test_delete_section(ConfigParser: MagicMock, open: MagicMock):
+def test_delete_section(ConfigParser: MagicMock, atomic_write: MagicMock, file_lock: MagicMock):
     parser = MagicMock()
     ConfigParser.return_value = parser
     parser.has_section.return_value = True
@@ -123,13 +136,14 @@ def test_delete_section(ConfigParser: MagicMock, open: MagicMock):
 
     parser.read.assert_called_once_with('file-name')
     parser.remove_section.assert_called_once_with('section-name')
-    parser.write.assert_called_once()
-    open.assert_called_once()
+    atomic_write.assert_called_once_with('file-name', parser.write)
+    file_lock.assert_called_once_with('file-name')
 
 
-@patch('builtins.open')
+@patch.object(aws_files, 'file_lock')
+@patch.object(aws_files, 'atomic_write')
 @patch('configparser.ConfigParser')
-def test_delete_section_no_section(ConfigParser: MagicMock, open: MagicMock):
+def test_delete_section_no_section(ConfigParser: MagicMock, atomic_write: MagicMock, file_lock: MagicMock):
     parser = MagicMock()
     ConfigParser.return_value = parser
     parser.has_section.return_value = False
@@ -138,6 +152,7 @@ def test_delete_section_no_section(ConfigParser: MagicMock, open: MagicMock):
 
     parser.read.assert_called_once_with('file-name')
     parser.remove_section.assert_not_called()
+    atomic_write.assert_not_called()
 
 
 myfile = """
@@ -155,3 +170,103 @@ def test_read_aws_file(open: MagicMock):
             'mfa_serial': 'arn:aws:iam::123123123123:mfa/admin',
         },
     }
+
+
+
+def write_old_file(path, content: str):
+    path.write_text(content)
+    old_time = time.time() - 60
+    os.utime(str(path), (old_time, old_time))
+
+
+def test_read_aws_file_writes_and_uses_index(tmp_path):
+    credentials_file = tmp_path / 'credentials'
+    write_old_file(credentials_file, myfile)
+    with patch.object(constants, 'AWSUME_CACHE_DIR', tmp_path / 'cache'):
+        first = aws_files.read_aws_file(str(credentials_file))
+        assert os.path.isfile(aws_files.get_profile_index_path(str(credentials_file)))
+        with patch.object(aws_files.configparser, 'ConfigParser') as ConfigParser:
+            second = aws_files.read_aws_file(str(credentials_file))
+            ConfigParser.assert_not_called()
+    assert first == second
+    assert second['default']['region'] == 'us-east-1'
+
+
+def test_read_aws_file_stale_index(tmp_path):
+    credentials_file = tmp_path / 'credentials'
+    write_old_file(credentials_file, myfile)
+    with patch.object(constants, 'AWSUME_CACHE_DIR', tmp_path / 'cache'):
+        aws_files.read_aws_file(str(credentials_file))
+        write_old_file(credentials_file, myfile + '\n[other]\nregion = us-west-2\n')
+        result = aws_files.read_aws_file(str(credentials_file))
+    assert result['other'] == {'region': 'us-west-2'}
+
+
+def test_read_aws_file_recently_modified_not_indexed(tmp_path):
+    credentials_file = tmp_path / 'credentials'
+    credentials_file.write_text(myfile)
+    with patch.object(constants, 'AWSUME_CACHE_DIR', tmp_path / 'cache'):
+        aws_files.read_aws_file(str(credentials_file))
+        assert not os.path.isfile(aws_files.get_profile_index_path(str(credentials_file)))
+
+
+def test_read_aws_file_with_secrets_not_indexed(tmp_path):
+    credentials_file = tmp_path / 'credentials'
+    write_old_file(credentials_file, '[default]\naws_access_key_id = AKIA\naws_secret_access_key = SECRET\n')
+    with patch.object(constants, 'AWSUME_CACHE_DIR', tmp_path / 'cache'):
+        index_path = aws_files.get_profile_index_path(str(credentials_file))
+        os.makedirs(str(tmp_path / 'cache'))
+        with open(index_path, 'w') as f:
+            f.write('{"profiles": {"default": {"aws_secret_access_key": "OLD"}}}')
+        result = aws_files.read_aws_file(str(credentials_file))
+        assert not os.path.isfile(index_path)
+    assert result['default']['aws_secret_access_key'] == 'SECRET'
+
+
+def test_aws_file_transaction(tmp_path):
+    credentials_file = tmp_path / 'credentials'
+    credentials_file.write_text('[default]\naws_access_key_id = AKIA\n\n[old]\nmanager = awsume\n')
+    os.chmod(str(credentials_file), 0o640)
+
+    with aws_files.AwsFileTransaction(str(credentials_file)) as transaction:
+        transaction.add_section('new', {'region': 'us-east-1'})
+        transaction.add_section('default', {'region': 'us-east-1'})
+        transaction.delete_section('old')
+        transaction.delete_section('missing')
+
+    with patch.object(aws_files, 'cache_lib'):
+        result = aws_files.read_aws_file(str(credentials_file))
+    assert result == {
+        'default': {'aws_access_key_id': 'AKIA'},
+        'new': {'manager': 'awsume', 'region': 'us-east-1'},
+    }
+    assert os.stat(str(credentials_file)).st_mode & 0o777 == 0o640
+    assert os.listdir(str(tmp_path)) == ['credentials']
+
+
+@patch.object(aws_files, 'atomic_write')
+def test_aws_file_transaction_not_committed_on_error(atomic_write: MagicMock, tmp_path):
+    with pytest.raises(ValueError):
+        with aws_files.AwsFileTransaction(str(tmp_path / 'credentials')) as transaction:
+            transaction.add_section('new', {'region': 'us-east-1'})
+            raise ValueError()
+    atomic_write.assert_not_called()
+
+
+@patch.object(aws_files, 'datetime')
+def test_remove_expired_output_profiles(datetime_mock: MagicMock, tmp_path):
+    from datetime import datetime
+    datetime_mock.now.return_value = datetime(2020, 1, 1)
+    datetime_mock.strptime.side_effect = datetime.strptime
+    credentials_file = tmp_path / 'credentials'
+    credentials_file.write_text('\n'.join([
+        '[expired]', 'manager = awsume', 'expiration = 2019-01-01 00:00:00',
+        '[valid]', 'manager = awsume', 'expiration = 2021-01-01 00:00:00',
+        '[auto]', 'autoawsume = true', 'expiration = 2019-01-01 00:00:00',
+        '[unmanaged]', 'manager = someone', 'expiration = 2019-01-01 00:00:00',
+    ]))
+
+    aws_files.remove_expired_output_profiles(str(credentials_file))
+
+    with patch.object(aws_files, 'cache_lib'):
+        assert sorted(aws_files.read_aws_file(str(credentials_file))) == ['auto', 'unmanaged', 'valid']
@@ -2,11 +2,18 @@ import os
 import json
 import pytest
 from datetime import datetime, timedelta
-from unittest.mock import patch, MagicMock
+from unittest.mock import ANY, patch, MagicMock
 
 from awsume.awsumepy.lib import cache, constants
 
 
+@pytest.fixture(autouse=True)
+def config_snapshot():
+    with patch('awsume.awsumepy.lib.config_management.get_config_snapshot') as get_config_snapshot:
+        get_config_snapshot.return_value = {}
+        yield get_config_snapshot
+
+
 @patch('os.chmod')
 @patch('os.makedirs')
 @patch('os.path.exists')
@@ -99,13 +106,14 @@ def test_read_aws_cache_catch_exception(ensure_cache_dir: MagicMock, is_file: Ma
 
 
 
-@patch('builtins.open')
+@patch.object(cache, 'file_lock')
+@patch.object(cache, 'atomic_write')
 @patch('json.dump')
 @patch('os.chmod')
-@patch('os.path.isfile')
+@patch('os.path.exists')
 @patch.object(cache, 'ensure_cache_dir')
-def test_write_aws_cache(ensure_cache_dir: MagicMock, is_file: MagicMock, chmod: MagicMock, json_dump: MagicMock, open: MagicMock):
-    is_file.return_value = True
+def test_write_aws_cache(ensure_cache_dir: MagicMock, exists: MagicMock, chmod: MagicMock, json_dump: MagicMock, atomic_write: MagicMock, file_lock: MagicMock):
+    exists.return_value = True
     session = {
         'AccessKeyId': 'AKIA...',
         'SecretAccessKey': 'SECRET',
@@ -115,30 +123,108 @@ def test_write_aws_cache(ensure_cache_dir: MagicMock, is_file: MagicMock, chmod:
     cache.write_aws_cache('cache-file', session)
 
     ensure_cache_dir.assert_called()
-    open.assert_called()
+    file_lock.assert_called_with(str(constants.AWSUME_CACHE_DIR) + '/cache-file')
     chmod.assert_called_with(str(constants.AWSUME_CACHE_DIR) + '/cache-file', 0o600)
-    json_dump.assert_called()
+    atomic_write.assert_called_with(str(constants.AWSUME_CACHE_DIR) + '/cache-file', ANY, mode=0o600)
+    atomic_write.call_args[0][1](MagicMock())
     written_session = json_dump.call_args[0][0]
     assert type(written_session.get('Expiration')) is str
 
 
 
-@patch('builtins.open')
-@patch('json.dump')
+@patch.object(cache, 'file_lock')
+@patch.object(cache, 'atomic_write')
 @patch('os.chmod')
-@patch('os.path.isfile')
+@patch('os.path.exists')
 @patch.object(cache, 'ensure_cache_dir')
-def test_write_aws_cache_catch_exception(ensure_cache_dir: MagicMock, is_file: MagicMock, chmod: MagicMock, json_dump: MagicMock, open: MagicMock):
-    is_file.return_value = True
-    json_dump.side_effect = Exception('Some Exception')
+def test_write_aws_cache_catch_exception(ensure_cache_dir: MagicMock, exists: MagicMock, chmod: MagicMock, atomic_write: MagicMock, file_lock: MagicMock):
+    exists.return_value = True
+    atomic_write.side_effect = OSError('Some Exception')
     session = {
         'AccessKeyId': 'AKIA...',
         'SecretAccessKey': 'SECRET',
         'SessionToken': 'LONGSECRET',
         'Expiration': datetime.now(),
     }
-    cache.write_aws_cache('cache-file', session)
-    chmod.assert_called_with(str(constants.AWSUME_CACHE_DIR) + '/cache-file', 0o600)
+    result = cache.write_aws_cache('cache-file', session)
+    assert type(result['Expiration']) is datetime
+
+
+
+@patch.object(cache, 'ensure_cache_dir')
+def test_write_aws_cache_replaces_file(ensure_cache_dir: MagicMock, tmpdir):
+    cache_file = tmpdir.join('cache-file')
+    cache_file.write('{"partial": ')
+    os.chmod(str(cache_file), 0o644)
+    with patch.object(constants, 'AWSUME_CACHE_DIR', str(tmpdir)):
+        cache.write_aws_cache('cache-file', {
+            'AccessKeyId': 'AKIA...',
+            'SecretAccessKey': 'SECRET',
+            'SessionToken': 'LONGSECRET',
+            'Expiration': datetime.now() + timedelta(hours=1),
+        })
+        assert cache.valid_cache_session(cache.read_aws_cache('cache-file'))
+    assert os.stat(str(cache_file)).st_mode & 0o777 == 0o600
+    assert sorted(os.listdir(str(tmpdir))) == ['cache-file', 'locks']
+
+
+
+@patch.object(cache, 'read_aws_cache')
+def test_read_cached_session(read_aws_cache: MagicMock):
+    read_aws_cache.return_value = {
+        'AccessKeyId': 'AKIA...',
+        'SecretAccessKey': 'SECRET',
+        'SessionToken': 'LONGSECRET',
+        'Expiration': datetime.now() + timedelta(minutes=10),
+    }
+    cache_session, stale_session = cache.read_cached_session('cache-file', 'us-west-2')
+    assert cache_session['Region'] == 'us-west-2'
+    assert stale_session is cache_session
+
+    cache_session, stale_session = cache.read_cached_session('cache-file', refresh_margin=900)
+    assert cache_session is None
+    assert stale_session == read_aws_cache.return_value
+
+    read_aws_cache.return_value = {**read_aws_cache.return_value, 'Expiration': datetime.now() - timedelta(minutes=1)}
+    assert cache.read_cached_session('cache-file', refresh_margin=900) == (None, None)
+
+
+
+def test_get_refresh_margin(config_snapshot: MagicMock):
+    assert cache.get_refresh_margin('session') == 0
+    assert cache.get_refresh_margin('role') == cache.ROLE_CACHE_REFRESH_MARGIN
+    config_snapshot.return_value = {'refresh-margin': 600}
+    assert cache.get_refresh_margin('session') == 600
+    assert cache.get_refresh_margin('autoawsume') == 600
+    config_snapshot.return_value = {'refresh-margin': {'session': 900, 'role': 'bad'}}
+    assert cache.get_refresh_margin('session') == 900
+    assert cache.get_refresh_margin('role') == cache.ROLE_CACHE_REFRESH_MARGIN
+    assert cache.get_refresh_margin('autoawsume') == 60
+
+
+
+@patch.object(cache, 'file_lock')
+@patch.object(cache, 'ensure_cache_dir')
+def test_cache_lock(ensure_cache_dir: MagicMock, file_lock: MagicMock):
+    with cache.cache_lock('cache-file'):
+        pass
+    file_lock.assert_called_with(str(constants.AWSUME_CACHE_DIR) + '/cache-file', cache.CACHE_LOCK_TIMEOUT, cache.CACHE_LOCK_WAITING_MESSAGE)
+
+    file_lock.reset_mock()
+    with cache.cache_lock(None):
+        pass
+    file_lock.assert_not_called()
+
+
+@patch.object(cache, 'file_lock')
+@patch.object(cache, 'ensure_cache_dir')
+def test_cache_lock_timeout(ensure_cache_dir: MagicMock, file_lock: MagicMock):
+    file_lock.return_value.__enter__.side_effect = TimeoutError()
+    entered = False
+    with cache.cache_lock('cache-file'):
+        entered = True
+    assert entered
+    file_lock.return_value.__exit__.assert_not_called()
 
 
 
@@ -212,3 +298,77 @@ def test_valid_cache_session_datetime_str():
         'Expiration': '2065-10-24 12:24:36',
     })
     assert result is True
+
+
+
+def test_valid_cache_session_within_refresh_margin():
+    result = cache.valid_cache_session({
+        'AccessKeyId': 'AKIA...',
+        'SecretAccessKey': 'SECRET',
+        'SessionToken': 'LONGSECRET',
+        'Expiration': datetime.now() + timedelta(minutes=1),
+    }, refresh_margin=300)
+    assert result is False
+
+
+
+def test_get_role_cache_file_name():
+    source_credentials = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET'}
+    result = cache.get_role_cache_file_name(source_credentials, 'myrolearn', 'mysessionname')
+    assert result.startswith('aws-role-credentials-')
+    assert 'SECRET' not in result
+    assert result == cache.get_role_cache_file_name(source_credentials, 'myrolearn', 'mysessionname')
+    assert result != cache.get_role_cache_file_name(source_credentials, 'myrolearn', 'othersessionname')
+    assert result != cache.get_role_cache_file_name(source_credentials, 'myrolearn', 'mysessionname', role_duration=7200)
+
+
+def test_get_credential_process_cache_file_name():
+    result = cache.get_credential_process_cache_file_name('myprofile', ['/bin/creds', 'myprofile'])
+    assert result.startswith('aws-credential-process-')
+    assert result == cache.get_credential_process_cache_file_name('myprofile', ['/bin/creds', 'myprofile'])
+    assert result != cache.get_credential_process_cache_file_name('otherprofile', ['/bin/creds', 'myprofile'])
+    assert result != cache.get_credential_process_cache_file_name('myprofile', ['/bin/creds', 'otherprofile'])
+
+
+@patch.object(cache, 'read_aws_cache')
+def test_read_account_id_cache(read_aws_cache: MagicMock):
+    read_aws_cache.return_value = {'AKIA...': '123123123123'}
+
+    assert cache.read_account_id_cache() == {'AKIA...': '123123123123'}
+    read_aws_cache.assert_called_with(cache.ACCOUNT_ID_CACHE_FILE_NAME)
+
+
+@patch.object(cache, 'ensure_cache_dir')
+def test_write_account_id_cache(ensure_cache_dir: MagicMock, tmpdir):
+    with patch.object(constants, 'AWSUME_CACHE_DIR', str(tmpdir)):
+        cache.write_account_id_cache({'AKIA...': '123123123123'})
+        assert cache.read_account_id_cache() == {'AKIA...': '123123123123'}
+    assert os.stat(str(tmpdir.join(cache.ACCOUNT_ID_CACHE_FILE_NAME))).st_mode & 0o777 == 0o600
+
+
+@patch.object(cache, 'ensure_cache_dir')
+def test_write_account_id_cache_keeps_other_entries(ensure_cache_dir: MagicMock, tmpdir):
+    with patch.object(constants, 'AWSUME_CACHE_DIR', str(tmpdir)):
+        cache.write_account_id_cache({'AKIA1': '111111111111'})
+        cache.write_account_id_cache({'AKIA2': '222222222222'})
+        assert cache.read_account_id_cache() == {'AKIA1': '111111111111', 'AKIA2': '222222222222'}
+
+
+
+@patch.object(cache.cache_db, 'get_cache_database')
+def test_sqlite_cache_store(get_cache_database: MagicMock, config_snapshot: MagicMock, tmpdir):
+    config_snapshot.return_value = {'cache-store': 'sqlite'}
+    get_cache_database.return_value = cache.cache_db.CacheDatabase(str(tmpdir.join('cache.sqlite3')))
+    session = {
+        'AccessKeyId': 'AKIA...',
+        'SecretAccessKey': 'SECRET',
+        'SessionToken': 'LONGSECRET',
+        'Expiration': datetime.now() + timedelta(hours=1),
+    }
+
+    cache.write_aws_cache('cache-file', session)
+    cache.write_account_id_cache({'AKIA...': '123123123123'})
+
+    assert cache.read_cached_session('cache-file') == (session, session)
+    assert cache.read_account_id_cache() == {'AKIA...': '123123123123'}
+    assert not tmpdir.join('cache-file').exists()
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from unittest.mock import patch
+
+from awsume.awsumepy.lib import atomic_file
+from awsume.awsumepy.lib import cache_db
+from awsume.awsumepy.lib import constants
+
+
+def format_expiration(delta: timedelta) -> str:
+    return (datetime.now() + delta).strftime('%Y-%m-%d %H:%M:%S')
+
+
+@pytest.fixture(autouse=True)
+def lock_dir(tmp_path_factory):
+    cache_dir = tmp_path_factory.mktemp('cache')
+    with patch.object(constants, 'AWSUME_CACHE_DIR', cache_dir):
+        yield cache_dir / atomic_file.LOCK_DIR_NAME
+
+
+@pytest.fixture
+def database(tmp_path):
+    return cache_db.CacheDatabase(str(tmp_path / cache_db.CACHE_DATABASE_FILE_NAME))
+
+
+def test_read_write(database, tmp_path):
+    database.write(cache_db.CREDENTIALS, {'cache-file': {'AccessKeyId': 'AKIA...'}}, expiration=time.time() + 3600)
+    database.write(cache_db.ACCOUNT_ID, {'AKIA1': '111111111111'})
+    database.write(cache_db.ACCOUNT_ID, {'AKIA2': '222222222222'})
+
+    assert database.read(cache_db.CREDENTIALS, 'cache-file') == {'AccessKeyId': 'AKIA...'}
+    assert database.read(cache_db.CREDENTIALS, 'other-file') is None
+    assert database.read_all(cache_db.ACCOUNT_ID) == {'AKIA1': '111111111111', 'AKIA2': '222222222222'}
+    assert database.connect().execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert os.stat(database.path).st_mode & 0o777 == 0o600
+
+
+def test_write_evicts_expired(database):
+    database.write(cache_db.CREDENTIALS, {'expired': {}}, expiration=time.time() - 1)
+    database.write(cache_db.CREDENTIALS, {'valid': {}}, expiration=time.time() + 3600)
+
+    assert database.read(cache_db.CREDENTIALS, 'expired') is None
+    assert database.read(cache_db.CREDENTIALS, 'valid') == {}
+
+
+def test_migrate_files(database, tmp_path, lock_dir):
+    (tmp_path / 'aws-credentials-AKIA1').write_text(json.dumps({'AccessKeyId': 'A', 'Expiration': format_expiration(timedelta(hours=1))}))
+    with atomic_file.file_lock(str(tmp_path / 'aws-credentials-AKIA1')):
+        pass
+    (tmp_path / 'aws-credentials-AKIA1.lock').write_text('')
+    (tmp_path / 'aws-credentials-AKIA2').write_text(json.dumps({'AccessKeyId': 'B', 'Expiration': format_expiration(timedelta(hours=-1))}))
+    (tmp_path / 'aws-role-credentials-abc').write_text('{"partial": ')
+    (tmp_path / 'account-ids.json').write_text(json.dumps({'AKIA1': '111111111111'}))
+    (tmp_path / 'profile-index-abc.json').write_text('{}')
+
+    assert database.read(cache_db.CREDENTIALS, 'aws-credentials-AKIA1')['AccessKeyId'] == 'A'
+    assert database.read(cache_db.CREDENTIALS, 'aws-credentials-AKIA2') is None
+    assert database.read_all(cache_db.ACCOUNT_ID) == {'AKIA1': '111111111111'}
+    assert sorted(_ for _ in os.listdir(str(tmp_path)) if not _.startswith(cache_db.CACHE_DATABASE_FILE_NAME)) == ['profile-index-abc.json']
+    assert os.listdir(str(lock_dir)) == []
+
+    (tmp_path / 'aws-credentials-AKIA3').write_text('{}')
+    cache_db.CacheDatabase(database.path).connect()
+    assert (tmp_path / 'aws-credentials-AKIA3').exists()
+
+
+def test_connection_per_thread(database):
+    database.write(cache_db.ACCOUNT_ID, {'AKIA1': '111111111111'})
+    results = []
+    thread = threading.Thread(target=lambda: results.append(database.read_all(cache_db.ACCOUNT_ID)))
+    thread.start()
+    thread.join()
+    assert results == [{'AKIA1': '111111111111'}]
+
+
+def test_lock(database, lock_dir):
+    with database.lock('cache-file'):
+        with database.lock('cache-file'):
+            pass
+    assert len(os.listdir(str(lock_dir))) == 1
+
+
+def test_lock_per_key(database, lock_dir):
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold_lock():
+        with database.lock('first'):
+            locked.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    locked.wait(5)
+    try:
+        with database.lock('second', timeout=1):
+            assert not release.is_set()
+        with pytest.raises(TimeoutError):
+            with database.lock('first', timeout=0.1):
+                pass
+    finally:
+        release.set()
+        thread.join()
+    assert len(os.listdir(str(lock_dir))) == 2
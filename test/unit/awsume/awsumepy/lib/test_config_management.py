@@ -155,3 +155,26 @@ def test_write_config_catches_exception(exists: MagicMock, isfile: MagicMock, ma
     makedirs.assert_not_called()
     safe_print.assert_called()
     assert open.call_count == 2
+
+
+@patch('awsume.awsumepy.lib.constants.IS_USING_XDG_CONFIG_HOME', False)
+@patch('yaml.safe_dump')
+@patch('yaml.safe_load')
+@patch('builtins.open')
+@patch('os.makedirs')
+@patch('os.path.isfile')
+@patch('os.path.exists')
+def test_config_snapshot(exists: MagicMock, isfile: MagicMock, makedirs: MagicMock, open: MagicMock, yaml_load: MagicMock, yaml_dump: MagicMock):
+    exists.return_value = True
+    isfile.return_value = True
+    yaml_load.return_value = {'colors': False}
+
+    config = config_management.load_config()
+    assert config_management.get_config_snapshot() is config
+    assert yaml_load.call_count == 1
+
+    config_management.write_config({'colors': True})
+    yaml_load.return_value = {'colors': True}
+    assert config_management.get_config_snapshot() == {'colors': True}
+    assert yaml_load.call_count == 2
+    config_management.config_snapshot = None
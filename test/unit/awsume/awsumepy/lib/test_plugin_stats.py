@@ -0,0 +1,51 @@
+import json
+from unittest.mock import patch
+
+from awsume.awsumepy.lib import constants, plugin_stats
+
+
+def get_entries():
+    return [
+        {'phase': 'parse_args', 'seconds': 0.5},
+        {'phase': 'plugin:get_credentials', 'seconds': 0.3, 'plugin': 'slow-plugin'},
+        {'phase': 'plugin:collect_aws_profiles', 'seconds': 0.001, 'plugin': 'slow-plugin'},
+        {'phase': 'plugin:get_credentials', 'seconds': 0.9, 'plugin': plugin_stats.DEFAULT_PLUGINS_NAME},
+    ]
+
+
+def test_get_plugin_timings():
+    assert plugin_stats.get_plugin_timings(get_entries()) == {
+        'slow-plugin': {'get_credentials': [300.0], 'collect_aws_profiles': [1.0]},
+        plugin_stats.DEFAULT_PLUGINS_NAME: {'get_credentials': [900.0]},
+    }
+
+
+def test_get_plugin_budget():
+    assert plugin_stats.get_plugin_budget({}, 'plugin') is None
+    assert plugin_stats.get_plugin_budget({'plugin-budget': 200}, 'plugin') == 200
+    assert plugin_stats.get_plugin_budget({'plugin-budget': {'default': 100, 'plugin': 500}}, 'plugin') == 500
+    assert plugin_stats.get_plugin_budget({'plugin-budget': {'default': 100}}, 'other') == 100
+    assert plugin_stats.get_plugin_budget({'plugin-budget': 'fast'}, 'plugin') is None
+
+
+def test_find_slow_plugins():
+    assert plugin_stats.find_slow_plugins({'plugin-budget': 200}, get_entries()) == [
+        ('slow-plugin', 'get_credentials', 300.0, 200.0),
+    ]
+    assert plugin_stats.find_slow_plugins({'plugin-budget': 500}, get_entries()) == []
+
+
+def test_update_plugin_stats(tmp_path):
+    with patch.object(constants, 'AWSUME_DIR', tmp_path), patch.object(constants, 'AWSUME_CACHE_DIR', tmp_path / 'cache'), patch.object(plugin_stats, 'PLUGIN_STATS_SAMPLES', 2):
+        plugin_stats.update_plugin_stats(get_entries())
+        plugin_stats.update_plugin_stats(get_entries()[:2])
+        plugin_stats.update_plugin_stats([{'phase': 'plugin:get_credentials', 'seconds': 0.1, 'plugin': 'slow-plugin'}])
+        stats = plugin_stats.read_plugin_stats()
+
+    assert stats['slow-plugin'] == {'get_credentials': [300.0, 100.0], 'collect_aws_profiles': [1.0]}
+    assert stats[plugin_stats.DEFAULT_PLUGINS_NAME] == {'get_credentials': [900.0]}
+    assert json.loads((tmp_path / 'plugin-stats.json').read_text()) == stats
+
+
+def test_summarize_samples():
+    assert plugin_stats.summarize_samples([3.0, 1.0, 2.0]) == {'calls': 3, 'mean_ms': 2.0, 'p95_ms': 3.0, 'max_ms': 3.0}
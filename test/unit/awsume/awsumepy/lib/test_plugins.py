@@ -0,0 +1,124 @@
+import sys
+import types
+import argparse
+from importlib.metadata import EntryPoint
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from awsume.awsumepy import hookspec
+from awsume.awsumepy.hookimpl import hookimpl
+from awsume.awsumepy.lib import constants, plugins
+
+
+def make_plugin_module(name: str, calls: list) -> types.ModuleType:
+    module = types.ModuleType(name)
+
+    @hookimpl
+    def add_arguments(parser: argparse.ArgumentParser):
+        calls.append('add_arguments')
+        parser.add_argument('--lazy-flag', action='store_true', dest='lazy_flag')
+
+    @hookimpl
+    def post_get_credentials(arguments: argparse.Namespace):
+        calls.append(('post_get_credentials', arguments.lazy_flag))
+
+    module.add_arguments = add_arguments
+    module.post_get_credentials = post_get_credentials
+    return module
+
+
+@pytest.fixture
+def plugin_manager():
+    calls = []
+    sys.modules['awsume_test_eager_plugin'] = make_plugin_module('awsume_test_eager_plugin', calls)
+    sys.modules['awsume_test_lazy_plugin'] = make_plugin_module('awsume_test_lazy_plugin', calls)
+    pm = plugins.LazyPluginManager('awsume')
+    pm.add_hookspecs(hookspec)
+    pm.load_plugin_manifest([
+        {'name': 'eager', 'value': 'awsume_test_eager_plugin', 'hooks': [], 'flags': []},
+        {'name': 'lazy', 'value': 'awsume_test_lazy_plugin', 'hooks': ['post_get_credentials'], 'flags': ['--lazy-flag']},
+    ])
+    yield pm, calls
+    sys.modules.pop('awsume_test_eager_plugin')
+    sys.modules.pop('awsume_test_lazy_plugin')
+
+
+def test_lazy_plugin_manager_loads_on_hook(plugin_manager):
+    pm, calls = plugin_manager
+    assert pm.get_plugin('eager') is sys.modules['awsume_test_eager_plugin']
+    assert pm.get_plugin('lazy') is None
+
+    pm.hook.add_arguments(config={}, parser=argparse.ArgumentParser())
+    assert calls == ['add_arguments']
+    assert pm.get_plugin('lazy') is None
+
+    arguments = argparse.Namespace(lazy_flag=False)
+    pm.hook.post_get_credentials(config={}, arguments=arguments, profiles={}, credentials={})
+    assert pm.get_plugin('lazy') is sys.modules['awsume_test_lazy_plugin']
+    assert calls.count(('post_get_credentials', False)) == 2
+
+
+def test_lazy_plugin_manager_sets_argument_defaults(plugin_manager):
+    pm, calls = plugin_manager
+    pm.unregister(name='eager')
+    arguments = argparse.Namespace()
+
+    pm.hook.post_get_credentials(config={}, arguments=arguments, profiles={}, credentials={})
+
+    assert arguments.lazy_flag is False
+    assert calls == ['add_arguments', ('post_get_credentials', False)]
+
+
+def test_lazy_plugin_manager_loads_on_flag(plugin_manager):
+    pm, calls = plugin_manager
+    pm.load_plugins_for_arguments(['profile', '--other'])
+    assert 'lazy' in pm.lazy_plugins
+
+    pm.load_plugins_for_arguments(['profile', '--lazy-flag'])
+    assert pm.lazy_plugins == {}
+    assert pm.get_plugin('lazy') is not None
+
+
+def test_lazy_plugin_manager_loads_all_on_help(plugin_manager):
+    pm, calls = plugin_manager
+    pm.load_plugins_for_arguments(['-h'])
+    assert pm.get_plugin('lazy') is not None
+
+
+def test_scan_plugins():
+    entry_points = {
+        plugins.PLUGIN_GROUP: [
+            EntryPoint('lazy', 'lazy_plugin.module', plugins.PLUGIN_GROUP),
+            EntryPoint('eager', 'eager_plugin:plugin', plugins.PLUGIN_GROUP),
+        ],
+        plugins.LAZY_PLUGIN_GROUP: [
+            EntryPoint('get_credentials', 'lazy_plugin.module', plugins.LAZY_PLUGIN_GROUP),
+            EntryPoint('--lazy', 'lazy_plugin.module', plugins.LAZY_PLUGIN_GROUP),
+        ],
+    }
+    with patch.object(plugins, 'get_entry_points', side_effect=lambda group: entry_points[group]):
+        assert plugins.scan_plugins() == [
+            {'name': 'lazy', 'value': 'lazy_plugin.module', 'hooks': ['get_credentials'], 'flags': ['--lazy']},
+            {'name': 'eager', 'value': 'eager_plugin:plugin', 'hooks': [], 'flags': []},
+        ]
+
+
+@patch.object(plugins, 'get_path_signature')
+@patch.object(plugins, 'scan_plugins')
+def test_get_plugin_manifest(scan_plugins: MagicMock, get_path_signature: MagicMock, tmp_path):
+    scan_plugins.return_value = [{'name': 'plugin', 'value': 'module', 'hooks': [], 'flags': []}]
+    get_path_signature.return_value = ['python', ['/site-packages', 1]]
+    with patch.object(constants, 'AWSUME_CACHE_DIR', tmp_path):
+        assert plugins.get_plugin_manifest() == scan_plugins.return_value
+        assert plugins.get_plugin_manifest() == scan_plugins.return_value
+        assert scan_plugins.call_count == 1
+
+        get_path_signature.return_value = ['python', ['/site-packages', 2]]
+        plugins.get_plugin_manifest()
+        assert scan_plugins.call_count == 2
+
+
+def test_load_entry_point():
+    assert plugins.load_entry_point('awsume.awsumepy.lib.plugins:LazyPluginManager') is plugins.LazyPluginManager
+    assert plugins.load_entry_point('awsume.awsumepy.lib.plugins') is plugins
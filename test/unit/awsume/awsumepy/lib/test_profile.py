@@ -5,7 +5,7 @@ import pytest
 import dateutil
 from unittest.mock import patch, MagicMock
 
-from awsume.awsumepy.lib.exceptions import ProfileNotFoundError, InvalidProfileError, UserAuthenticationError, RoleAuthenticationError
+from awsume.awsumepy.lib.exceptions import ProfileNotFoundError, InvalidProfileError, UserAuthenticationError, RoleAuthenticationError, PromptRequiredError
 from awsume.awsumepy.lib import profile
 
 
@@ -380,6 +380,14 @@ def test_get_mfa_token_invalid_reprompt(safe_print: MagicMock, input: MagicMock)
     assert input.call_count == 3
 
 
+@patch.dict('os.environ', {'AWSUME_NO_PROMPT': 'true'})
+@patch('builtins.input')
+def test_get_mfa_token_prompts_disabled(input: MagicMock):
+    with pytest.raises(PromptRequiredError):
+        profile.get_mfa_token()
+    input.assert_not_called()
+
+
 def test_aggregate_profiles():
     result = [{
         'default': {
@@ -473,3 +481,43 @@ def test_get_account_id_call_aws(get_account_id: MagicMock):
         'aws_access_key_id': 'AKIA',
         'aws_secret_access_key': 'SECRET',
     }, True) == '123987123987'
+
+
+@patch('awsume.awsumepy.lib.cache.write_account_id_cache')
+@patch('awsume.awsumepy.lib.cache.read_account_id_cache')
+@patch('awsume.awsumepy.lib.aws.get_account_id')
+def test_resolve_account_ids(get_account_id: MagicMock, read_account_id_cache: MagicMock, write_account_id_cache: MagicMock):
+    read_account_id_cache.return_value = {'AKIACACHED': '111111111111'}
+    get_account_id.side_effect = lambda credentials: {'AKIANEW': '222222222222'}.get(credentials['AccessKeyId'], 'Unavailable')
+    profiles = {
+        'cached': {'aws_access_key_id': 'AKIACACHED', 'aws_secret_access_key': 'SECRET'},
+        'new': {'aws_access_key_id': 'AKIANEW', 'aws_secret_access_key': 'SECRET'},
+        'new-duplicate': {'aws_access_key_id': 'AKIANEW', 'aws_secret_access_key': 'SECRET'},
+        'broken': {'aws_access_key_id': 'AKIABROKEN', 'aws_secret_access_key': 'SECRET'},
+        'role': {'role_arn': 'arn:aws:iam::333333333333:role/Role'},
+        'auto-refresh-new': {'aws_access_key_id': 'AKIAAUTO', 'aws_secret_access_key': 'SECRET'},
+    }
+
+    result = profile.resolve_account_ids(profiles, 4)
+
+    assert result == {
+        'cached': '111111111111',
+        'new': '222222222222',
+        'new-duplicate': '222222222222',
+        'broken': 'Unavailable',
+    }
+    assert get_account_id.call_count == 2
+    write_account_id_cache.assert_called_once_with({'AKIACACHED': '111111111111', 'AKIANEW': '222222222222'})
+
+
+@patch('awsume.awsumepy.lib.cache.write_account_id_cache')
+@patch('awsume.awsumepy.lib.cache.read_account_id_cache')
+@patch('awsume.awsumepy.lib.aws.get_account_id')
+def test_resolve_account_ids_all_cached(get_account_id: MagicMock, read_account_id_cache: MagicMock, write_account_id_cache: MagicMock):
+    read_account_id_cache.return_value = {'AKIACACHED': '111111111111'}
+
+    result = profile.resolve_account_ids({'cached': {'aws_access_key_id': 'AKIACACHED', 'aws_secret_access_key': 'SECRET'}})
+
+    assert result == {'cached': '111111111111'}
+    get_account_id.assert_not_called()
+    write_account_id_cache.assert_not_called()
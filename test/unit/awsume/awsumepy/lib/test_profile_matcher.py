@@ -0,0 +1,125 @@
+import random
+import string
+from difflib import SequenceMatcher
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from awsume.awsumepy.lib import constants, profile_matcher
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path):
+    profile_matcher.profile_matcher = None
+    with patch.object(constants, 'AWSUME_CACHE_DIR', tmp_path):
+        yield tmp_path
+    profile_matcher.profile_matcher = None
+
+
+def scan_prefix(profile_names: list, profile_name: str) -> str:
+    prefix_words = [_ for _ in profile_names if _.startswith(profile_name)]
+    return prefix_words[0] if len(prefix_words) == 1 else None
+
+
+def scan_contains(profile_names: list, profile_name: str) -> str:
+    matches = {_: SequenceMatcher(None, profile_name, _).find_longest_match(0, len(profile_name), 0, len(_)).size for _ in profile_names}
+    result = [k for k in matches if matches[k] == max(matches.values())]
+    return result[0] if len(result) == 1 else None
+
+
+def distance(str1: str, str2: str) -> int:
+    previous = list(range(len(str2) + 1))
+    for i, char1 in enumerate(str1, 1):
+        current = [i]
+        for j, char2 in enumerate(str2, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char1 != char2)))
+        previous = current
+    return previous[-1]
+
+
+def scan_levenshtein(profile_names: list, profile_name: str) -> str:
+    matches = {_: distance(profile_name, _) for _ in profile_names}
+    result = [k for k in matches if matches[k] == min(matches.values())]
+    return result[0] if len(result) == 1 else None
+
+
+def make_profile_names(count: int) -> list:
+    rand = random.Random(10)
+    teams = [''.join(rand.choices(string.ascii_lowercase, k=rand.randint(3, 7))) for _ in range(20)]
+    return list({
+        '{}-{}-{}'.format(rand.choice(teams), rand.choice(['dev', 'prod', 'qa']), rand.choice(['admin', 'ro', 'deploy']))
+        for _ in range(count)
+    })
+
+
+def make_queries(profile_names: list) -> list:
+    rand = random.Random(20)
+    queries = ['', 'a', 'zz', 'prod', 'dev-admin', 'qa-ro', '-', '!!!']
+    for name in rand.sample(profile_names, 30):
+        start = rand.randint(0, len(name) - 1)
+        queries.append(name[start:start + rand.randint(1, 8)])
+        queries.append(name[:rand.randint(1, len(name))])
+        typo = list(name)
+        typo[rand.randrange(len(typo))] = rand.choice(string.ascii_lowercase)
+        queries.append(''.join(typo))
+    return queries
+
+
+def test_match_prefix_same_as_scan():
+    profile_names = make_profile_names(200)
+    index = profile_matcher.ProfileMatcher(profile_names)
+    for query in make_queries(profile_names):
+        assert index.match_prefix(query) == scan_prefix(profile_names, query), query
+
+
+def test_match_contains_same_as_scan():
+    profile_names = make_profile_names(200)
+    index = profile_matcher.ProfileMatcher(profile_names)
+    for query in make_queries(profile_names):
+        assert index.match_contains(query) == scan_contains(profile_names, query), query
+
+
+def test_match_contains_long_names():
+    profile_names = ['a' * 250 + 'bcd', 'x' * 210, 'abc-dev']
+    index = profile_matcher.ProfileMatcher(profile_names)
+    for query in ['abcd', 'aaaa', 'xxx', 'dev', 'bcd', 'q']:
+        assert index.match_contains(query) == scan_contains(profile_names, query), query
+
+
+def test_match_levenshtein_same_as_scan():
+    profile_names = make_profile_names(200)
+    index = profile_matcher.ProfileMatcher(profile_names)
+    with patch.object(profile_matcher, 'Levenshtein', MagicMock(distance=distance)):
+        for query in make_queries(profile_names):
+            assert index.match_levenshtein(query) == scan_levenshtein(profile_names, query), query
+
+
+@patch.object(profile_matcher, 'Levenshtein', None)
+def test_match_levenshtein_not_installed():
+    assert profile_matcher.ProfileMatcher(['dev', 'prod']).match_levenshtein('dve') is None
+
+
+def test_no_profiles():
+    index = profile_matcher.ProfileMatcher([])
+    assert index.match_prefix('dev') is None
+    assert index.match_contains('dev') is None
+
+
+def test_ngrams_persisted(cache_dir):
+    profile_names = ['dev-admin', 'prod-admin']
+    profile_matcher.ProfileMatcher(profile_names).match_contains('dev-adm')
+    assert (cache_dir / 'profile-matcher.json').exists()
+
+    with patch.object(profile_matcher, 'build_ngrams') as build_ngrams:
+        assert profile_matcher.ProfileMatcher(list(reversed(profile_names))).match_contains('dev-adm') == 'dev-admin'
+    build_ngrams.assert_not_called()
+
+    with patch.object(profile_matcher, 'build_ngrams', wraps=profile_matcher.build_ngrams) as build_ngrams:
+        assert profile_matcher.ProfileMatcher(profile_names + ['qa-admin']).match_contains('qa-adm') == 'qa-admin'
+    build_ngrams.assert_called_once()
+
+
+def test_get_profile_matcher_reused():
+    index = profile_matcher.get_profile_matcher(['dev', 'prod'])
+    assert profile_matcher.get_profile_matcher(['prod', 'dev']) is index
+    assert profile_matcher.get_profile_matcher(['prod', 'dev', 'qa']) is not index
@@ -0,0 +1,193 @@
+import json
+import time
+import pytest
+import botocore.exceptions
+from unittest.mock import patch, MagicMock
+
+from awsume.awsumepy.lib import constants, rate_limit
+from awsume.awsumepy.lib.exceptions import RateLimitError
+
+
+@pytest.fixture(autouse=True)
+def config():
+    with patch('awsume.awsumepy.lib.cache.get_config') as get_config:
+        get_config.return_value = {}
+        yield get_config
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir):
+    with patch.object(constants, 'AWSUME_CACHE_DIR', str(tmpdir)):
+        yield tmpdir
+
+
+@pytest.fixture(autouse=True)
+def sleep():
+    with patch('time.sleep') as sleep:
+        yield sleep
+
+
+def get_throttling_error() -> Exception:
+    return botocore.exceptions.ClientError({
+        'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'},
+        'ResponseMetadata': {'HTTPStatusCode': 400},
+    }, 'AssumeRole')
+
+
+def test_is_throttling():
+    assert rate_limit.is_throttling(get_throttling_error())
+    assert rate_limit.is_throttling(botocore.exceptions.ClientError({'Error': {'Code': 'Other'}, 'ResponseMetadata': {'HTTPStatusCode': 429}}, 'AssumeRole'))
+    assert not rate_limit.is_throttling(botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied'}}, 'AssumeRole'))
+    assert not rate_limit.is_throttling(ValueError())
+
+
+def test_call_retries_throttling(sleep: MagicMock):
+    function = MagicMock(side_effect=[get_throttling_error(), get_throttling_error(), 'response'])
+    counters = rate_limit.get_counters()
+    now = [1000.0]
+    sleep.side_effect = lambda seconds: now.__setitem__(0, now[0] + seconds)
+
+    with patch('time.time', side_effect=lambda: now[0]):
+        assert rate_limit.call(function) == 'response'
+
+    assert function.call_count == 3
+    assert rate_limit.get_counters()['throttles'] - counters['throttles'] == 2
+    assert rate_limit.get_counters()['retries'] - counters['retries'] == 2
+    assert rate_limit.read_state()['backoff_until'] > 0
+    assert sleep.called
+
+
+def test_call_gives_up_after_max_attempts(config: MagicMock, sleep: MagicMock):
+    config.return_value = {'sts-max-attempts': 2}
+    function = MagicMock(side_effect=get_throttling_error())
+    now = [1000.0]
+    sleep.side_effect = lambda seconds: now.__setitem__(0, now[0] + seconds)
+
+    with patch('time.time', side_effect=lambda: now[0]):
+        with pytest.raises(botocore.exceptions.ClientError):
+            rate_limit.call(function)
+
+    assert function.call_count == 2
+
+
+def test_call_retries_transient_errors(sleep: MagicMock):
+    server_error = botocore.exceptions.ClientError({'Error': {'Code': 'InternalFailure'}, 'ResponseMetadata': {'HTTPStatusCode': 500}}, 'AssumeRole')
+    timeout = botocore.exceptions.ReadTimeoutError(endpoint_url='https://sts.amazonaws.com')
+    function = MagicMock(side_effect=[server_error, timeout, 'response'])
+
+    assert rate_limit.call(function) == 'response'
+
+    assert function.call_count == 3
+    assert sleep.call_count == 2
+    assert 'backoff_until' not in rate_limit.read_state() # other awsume processes aren't held up
+
+
+def test_call_without_transient_retries():
+    function = MagicMock(side_effect=botocore.exceptions.EndpointConnectionError(endpoint_url='https://sts.amazonaws.com'))
+
+    with pytest.raises(botocore.exceptions.EndpointConnectionError):
+        rate_limit.call(function, retry_transient=False)
+
+    assert function.call_count == 1
+
+
+def test_call_does_not_retry_other_errors():
+    function = MagicMock(side_effect=ValueError())
+
+    with pytest.raises(ValueError):
+        rate_limit.call(function)
+
+    assert function.call_count == 1
+
+
+def test_backoff_grows():
+    with patch('random.uniform', side_effect=lambda low, high: high):
+        assert rate_limit.backoff(1) == 2 * rate_limit.BACKOFF_BASE
+        assert rate_limit.backoff(2) == 4 * rate_limit.BACKOFF_BASE
+        assert rate_limit.backoff(20) == rate_limit.BACKOFF_CAP
+
+
+def test_acquire_waits_for_backoff(sleep: MagicMock):
+    now = [1000.0]
+    sleep.side_effect = lambda seconds: now.__setitem__(0, now[0] + seconds)
+    with patch('time.time', side_effect=lambda: now[0]):
+        rate_limit.write_state({'backoff_until': now[0] + 3})
+        rate_limit.acquire()
+
+    assert sleep.call_count == 1
+    assert 3 <= sleep.call_args[0][0] <= 3 + rate_limit.BACKOFF_BASE
+
+
+def test_acquire_without_limit(sleep: MagicMock, cache_dir):
+    rate_limit.acquire()
+
+    sleep.assert_not_called()
+    assert not cache_dir.join(rate_limit.RATE_LIMIT_FILE_NAME).exists()
+
+
+def test_take_token(config: MagicMock):
+    with patch('time.time', return_value=1000.0):
+        assert [rate_limit.take_token(2, 2, 2000) for _ in range(4)] == [0, 0, 0.5, 1.0]
+    with patch('time.time', return_value=1000.5):
+        assert rate_limit.take_token(2, 2, 2000) == 1.0 # the slots at 1000.5 and 1001 are taken
+
+
+def test_take_token_past_deadline(config: MagicMock):
+    with patch('time.time', return_value=1000.0):
+        rate_limit.take_token(1, 1, 1001)
+        rate_limit.take_token(1, 1, 1001)
+        with pytest.raises(RateLimitError):
+            rate_limit.take_token(1, 1, 1001)
+        state = rate_limit.read_state()
+        assert state['tokens'] == -1 # the failed call didn't reserve a slot
+        assert rate_limit.take_token(1, 1, 2000) == 2
+
+
+def test_take_token_after_backoff(config: MagicMock):
+    config.return_value = {'sts-rate-limit': 2, 'sts-rate-burst': 2}
+    with patch('time.time', return_value=1000.0), patch('random.uniform', return_value=3):
+        rate_limit.backoff(1)
+        assert [rate_limit.take_token(2, 2, 2000) for _ in range(2)] == [3.5, 4.0]
+
+
+def test_acquire_gives_up_after_max_wait(config: MagicMock, sleep: MagicMock):
+    config.return_value = {'sts-rate-limit': 1, 'sts-rate-burst': 1}
+    with patch('time.time', return_value=1000.0):
+        for _ in range(rate_limit.MAX_WAIT + 1):
+            rate_limit.acquire()
+        with pytest.raises(RateLimitError):
+            rate_limit.acquire()
+
+    assert sleep.call_count == rate_limit.MAX_WAIT
+
+
+def test_acquire_waits_again_after_backoff(config: MagicMock, sleep: MagicMock):
+    config.return_value = {'sts-rate-limit': 1, 'sts-rate-burst': 1}
+    now = [1000.0]
+
+    def throttled_while_sleeping(seconds):
+        if sleep.call_count == 1:
+            with patch('random.uniform', return_value=5):
+                rate_limit.backoff(1)
+        now[0] += seconds
+    sleep.side_effect = throttled_while_sleeping
+
+    with patch('time.time', side_effect=lambda: now[0]):
+        rate_limit.acquire()
+        rate_limit.acquire()
+
+    assert [call[0][0] for call in sleep.call_args_list] == [1, 6] # the new slot is after the backoff and the slots reserved before it
+
+
+def test_acquire_waits_for_tokens(config: MagicMock, sleep: MagicMock):
+    config.return_value = {'sts-rate-limit': 1, 'sts-rate-burst': 1}
+    now = [1000.0]
+    sleep.side_effect = lambda seconds: now.__setitem__(0, now[0] + seconds)
+
+    with patch('time.time', side_effect=lambda: now[0]):
+        rate_limit.acquire()
+        rate_limit.acquire()
+
+    assert sleep.call_count == 1
+    assert 1 <= sleep.call_args[0][0] <= 1 + rate_limit.BACKOFF_BASE
+    assert json.loads(open(rate_limit.get_state_path()).read())['tokens'] < 1
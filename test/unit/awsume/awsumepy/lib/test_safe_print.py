@@ -1,9 +1,19 @@
 import colorama
 import os
+import threading
+import pytest
 from io import StringIO
 from unittest.mock import patch, MagicMock
 
-from awsume.awsumepy.lib.safe_print import safe_print
+from awsume.awsumepy.lib import config_management
+from awsume.awsumepy.lib.safe_print import safe_print, buffered_output
+
+
+@pytest.fixture(autouse=True)
+def clear_config_snapshot():
+    config_management.config_snapshot = None
+    yield
+    config_management.config_snapshot = None
 
 
 @patch('yaml.safe_load')
@@ -44,3 +54,51 @@ def test_safe_print_end(open: MagicMock, stderr: MagicMock):
 def test_safe_print_ignore_color_on_windows(open: MagicMock, stderr: MagicMock):
     safe_print('Text', color=colorama.Fore.RED)
     assert colorama.Fore.RED not in stderr.getvalue()
+
+
+@patch('yaml.safe_load')
+@patch('sys.stderr', new_callable=StringIO)
+def test_safe_print_reads_config_once(stderr: MagicMock, yaml_load: MagicMock):
+    yaml_load.return_value = {'colors': False}
+    with patch.object(config_management, 'open', create=True):
+        safe_print('Text', color=colorama.Fore.RED)
+        safe_print('Text', color=colorama.Fore.RED)
+    yaml_load.assert_called_once()
+    assert colorama.Fore.RED not in stderr.getvalue()
+
+
+@patch('sys.stderr', new_callable=StringIO)
+def test_safe_print_uses_loaded_config(stderr: MagicMock):
+    config_management.config_snapshot = {'colors': False}
+    with patch.object(os, 'name', 'darwin'):
+        safe_print('Text', color=colorama.Fore.RED)
+    assert colorama.Fore.RED not in stderr.getvalue()
+    config_management.config_snapshot = {'colors': True}
+    with patch.object(os, 'name', 'darwin'):
+        safe_print('Text', color=colorama.Fore.RED)
+    assert colorama.Fore.RED in stderr.getvalue()
+
+
+@patch('sys.stderr')
+def test_buffered_output(stderr: MagicMock):
+    config_management.config_snapshot = {'colors': False}
+    with buffered_output():
+        safe_print('one')
+        with buffered_output():
+            safe_print('two', end='')
+        stderr.write.assert_not_called()
+    stderr.write.assert_called_once_with('one' + colorama.Style.RESET_ALL + '\n' + 'two' + colorama.Style.RESET_ALL)
+    stderr.flush.assert_called_once()
+
+
+@patch('builtins.print')
+@patch('sys.stderr')
+def test_buffered_output_per_thread(stderr: MagicMock, print_mock: MagicMock):
+    config_management.config_snapshot = {'colors': False}
+    with buffered_output():
+        thread = threading.Thread(target=lambda: safe_print('other thread'))
+        thread.start()
+        thread.join()
+        print_mock.assert_called_once()
+        safe_print('this thread')
+    stderr.write.assert_called_once_with('this thread' + colorama.Style.RESET_ALL + '\n')
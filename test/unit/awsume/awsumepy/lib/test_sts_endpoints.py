@@ -0,0 +1,119 @@
+import time
+import pytest
+from unittest.mock import patch, MagicMock
+
+from awsume.awsumepy.lib import constants, sts_endpoints
+
+
+@pytest.fixture(autouse=True)
+def config():
+    with patch('awsume.awsumepy.lib.cache.get_config') as get_config:
+        get_config.return_value = {}
+        yield get_config
+
+
+@pytest.fixture(autouse=True)
+def environment():
+    with patch.dict('os.environ', clear=True) as environ:
+        yield environ
+
+
+@pytest.fixture
+def cache_dir(tmpdir):
+    with patch.object(constants, 'AWSUME_CACHE_DIR', str(tmpdir)):
+        yield tmpdir
+
+
+def test_get_sts_regional_endpoints(config: MagicMock, environment: dict, tmp_path):
+    environment['AWS_CONFIG_FILE'] = str(tmp_path / 'config')
+    assert sts_endpoints.get_sts_regional_endpoints() == 'regional'
+
+    (tmp_path / 'config').write_text('[default]\nsts_regional_endpoints = legacy\n')
+    assert sts_endpoints.get_sts_regional_endpoints() == 'legacy'
+
+    environment['AWS_STS_REGIONAL_ENDPOINTS'] = 'regional'
+    assert sts_endpoints.get_sts_regional_endpoints() == 'regional'
+
+    config.return_value = {'sts-regional-endpoints': 'legacy'}
+    assert sts_endpoints.get_sts_regional_endpoints() == 'legacy'
+
+
+def test_get_sts_regional_endpoints_missing_profile(environment: dict, tmp_path):
+    environment['AWS_CONFIG_FILE'] = str(tmp_path / 'config')
+    environment['AWS_PROFILE'] = 'missing'
+    assert sts_endpoints.get_sts_regional_endpoints() == 'regional'
+
+
+def test_get_endpoint_url(config: MagicMock):
+    assert sts_endpoints.get_endpoint_url() is None
+
+    config.return_value = {'sts-endpoint-url': 'http://127.0.0.1:8765'}
+    assert sts_endpoints.get_endpoint_url() == 'http://127.0.0.1:8765'
+
+
+def test_get_probe_host():
+    assert sts_endpoints.get_probe_host('ap-southeast-2') == 'sts.ap-southeast-2.amazonaws.com'
+    assert sts_endpoints.get_probe_host('cn-north-1') == 'sts.cn-north-1.amazonaws.com.cn'
+    assert sts_endpoints.get_probe_host('us-iso-east-1') is None
+    assert sts_endpoints.get_probe_host(None) is None
+
+
+@patch.object(sts_endpoints, 'measure_latency')
+def test_get_sts_regions_default(measure_latency: MagicMock, config: MagicMock):
+    config.return_value = {'sts-regions': ['us-west-2']}
+
+    assert sts_endpoints.get_sts_regions('ap-southeast-2') == ['ap-southeast-2']
+    measure_latency.assert_not_called()
+
+
+@patch.object(sts_endpoints, 'measure_latency')
+def test_get_sts_regions_fastest(measure_latency: MagicMock, config: MagicMock, cache_dir):
+    config.return_value = {'sts-endpoint-selection': 'fastest', 'sts-regions': ['us-east-1', 'ap-southeast-1', 'eu-west-1']}
+    measure_latency.side_effect = lambda region: {'ap-southeast-2': 80.0, 'ap-southeast-1': 20.0, 'us-east-1': 200.0}.get(region)
+
+    assert sts_endpoints.get_sts_regions('ap-southeast-2') == ['ap-southeast-1', 'ap-southeast-2', 'us-east-1', 'eu-west-1']
+    assert measure_latency.call_count == 4
+    assert sts_endpoints.get_sts_regions('ap-southeast-2') == ['ap-southeast-1', 'ap-southeast-2', 'us-east-1', 'eu-west-1']
+    assert measure_latency.call_count == 4
+
+
+@patch.object(sts_endpoints, 'measure_latency')
+def test_get_sts_regions_remeasures_stale(measure_latency: MagicMock, config: MagicMock, cache_dir):
+    config.return_value = {'sts-endpoint-selection': 'fastest'}
+    measure_latency.return_value = 10.0
+    sts_endpoints.get_sts_regions('us-east-1')
+
+    with patch('time.time', return_value=time.time() + sts_endpoints.MEASUREMENT_TTL + 1):
+        sts_endpoints.get_sts_regions('us-east-1')
+
+    assert measure_latency.call_count == 2
+
+
+@patch.object(sts_endpoints, 'measure_latency')
+def test_report_failure(measure_latency: MagicMock, config: MagicMock, cache_dir):
+    config.return_value = {'sts-endpoint-selection': 'fastest', 'sts-regions': ['us-west-2']}
+    measure_latency.side_effect = lambda region: {'us-east-1': 10.0, 'us-west-2': 50.0}.get(region)
+    assert sts_endpoints.get_sts_regions('us-east-1') == ['us-east-1', 'us-west-2']
+
+    sts_endpoints.report_failure('us-east-1')
+
+    assert sts_endpoints.get_sts_regions('us-east-1') == ['us-west-2', 'us-east-1']
+    with patch('time.time', return_value=time.time() + sts_endpoints.FAILURE_PENALTY + 1):
+        assert sts_endpoints.get_sts_regions('us-east-1')[0] == 'us-east-1'
+
+
+@patch.object(sts_endpoints, 'measure_latency')
+def test_get_sts_regions_not_with_endpoint_url(measure_latency: MagicMock, config: MagicMock):
+    config.return_value = {'sts-endpoint-selection': 'fastest', 'sts-endpoint-url': 'http://127.0.0.1:8765'}
+
+    assert sts_endpoints.get_sts_regions('us-east-1') == ['us-east-1']
+    measure_latency.assert_not_called()
+
+
+@patch('socket.create_connection')
+def test_measure_latency(create_connection: MagicMock):
+    assert sts_endpoints.measure_latency('us-east-1') >= 0
+    create_connection.assert_called_with(('sts.us-east-1.amazonaws.com', 443), timeout=sts_endpoints.PROBE_TIMEOUT)
+
+    create_connection.side_effect = OSError('unreachable')
+    assert sts_endpoints.measure_latency('us-east-1') is None
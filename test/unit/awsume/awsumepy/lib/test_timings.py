@@ -0,0 +1,79 @@
+import json
+from unittest.mock import MagicMock
+
+import pluggy
+
+from awsume.awsumepy.lib import timings as timings_lib
+from awsume.awsumepy.lib.timings import Timings
+
+
+def test_timed():
+    timings = Timings()
+    with timings.timed('startup-phase', startup=True):
+        pass
+    with timings.timed('phase', detail='file'):
+        pass
+
+    timings.reset()
+    with timings.timed('next-phase'):
+        pass
+
+    assert [entry['phase'] for entry in timings.entries()] == ['startup-phase', 'next-phase']
+
+
+def test_timed_records_on_error():
+    timings = Timings()
+    try:
+        with timings.timed('phase'):
+            raise ValueError()
+    except ValueError:
+        pass
+    assert [entry['phase'] for entry in timings.entries()] == ['phase']
+
+
+def test_to_json_and_format_table():
+    timings = Timings()
+    timings.record('phase', 0.25, detail='file')
+    timings.record('plugin:hook', 0.5, plugin='my-plugin')
+
+    assert json.loads(timings.to_json()) == {'phases': [
+        {'phase': 'phase', 'seconds': 0.25, 'detail': 'file'},
+        {'phase': 'plugin:hook', 'seconds': 0.5, 'plugin': 'my-plugin'},
+    ]}
+    table = timings.format_table()
+    assert 'phase (file)' in table
+    assert 'my-plugin' in table
+    assert '500.0' in table
+
+
+def test_instrument_plugin_manager():
+    hookspec = pluggy.HookspecMarker('timingtest')
+    hookimpl = pluggy.HookimplMarker('timingtest')
+
+    class Spec:
+        @hookspec
+        def my_hook(self, value):
+            pass
+
+    class Plugin:
+        @hookimpl
+        def my_hook(self, value):
+            return value + 1
+
+    class Wrapper:
+        @hookimpl(hookwrapper=True)
+        def my_hook(self, value):
+            yield
+
+    plugin_manager = pluggy.PluginManager('timingtest')
+    plugin_manager.add_hookspecs(Spec)
+    plugin_manager.register(Plugin(), name='my-plugin')
+    plugin_manager.register(Wrapper(), name='my-wrapper')
+    timings_lib.timings.reset()
+
+    timings_lib.instrument_plugin_manager(plugin_manager)
+
+    assert plugin_manager.hook.my_hook(value=1) == [2]
+    phases = [(entry['phase'], entry.get('plugin')) for entry in timings_lib.timings.phases]
+    assert phases == [('plugin:my_hook', 'my-plugin'), ('hook:my_hook', None)]
+    timings_lib.timings.reset()
@@ -11,6 +11,13 @@ from awsume.awsumepy.lib import exceptions
 from unittest.mock import patch, MagicMock, mock_open
 from awsume.awsumepy import hookspec
 from awsume.awsumepy.lib import aws
+from awsume.awsumepy.lib import constants
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir):
+    with patch.object(constants, 'AWSUME_CACHE_DIR', str(tmpdir)):
+        yield tmpdir
 
 
 @patch.object(app, 'load_config')
@@ -27,9 +34,10 @@ def test_app_init(init: MagicMock, get_plugin_manager: MagicMock, load_config: M
     assert obj.plugin_manager == get_plugin_manager.return_value
 
 
-@patch('pluggy.PluginManager')
+@patch.object(app, 'get_plugin_manifest')
+@patch.object(app, 'LazyPluginManager')
 @patch.object(app.Awsume, '__init__')
-def test_get_plugin_manager(__init__: MagicMock, PluginManager: MagicMock):
+def test_get_plugin_manager(__init__: MagicMock, PluginManager: MagicMock, get_plugin_manifest: MagicMock):
     __init__.return_value = None
     pm = MagicMock()
     PluginManager.return_value = pm
@@ -40,7 +48,7 @@ def test_get_plugin_manager(__init__: MagicMock, PluginManager: MagicMock):
     PluginManager.assert_called_with('awsume')
     pm.add_hookspecs.assert_called_once_with(hookspec)
     pm.register.assert_called_once()
-    pm.load_setuptools_entrypoints.assert_called_once_with('awsume')
+    pm.load_plugin_manifest.assert_called_once_with(get_plugin_manifest.return_value)
     assert response == pm
 
 
@@ -63,6 +71,47 @@ def test_parse_args(__init__: MagicMock, ArgumentParser: MagicMock):
     assert result == parser.parse_args.return_value
 
 
+@patch('argparse.ArgumentParser')
+@patch.object(app.Awsume, '__init__')
+def test_parse_args_reuses_parser(__init__: MagicMock, ArgumentParser: MagicMock):
+    __init__.return_value = None
+    parser = MagicMock()
+    parser.parse_args.return_value = argparse.Namespace(refresh_autocomplete=False, list_plugins=False)
+    ArgumentParser.return_value = parser
+    obj = app.Awsume()
+    obj.config = {}
+    obj.plugin_manager = MagicMock()
+    obj.plugin_manager.list_name_plugin.return_value = [('plugin', MagicMock())]
+
+    obj.parse_args([])
+    obj.parse_args(['profile'])
+
+    ArgumentParser.assert_called_once()
+    obj.plugin_manager.hook.add_arguments.assert_called_once()
+    assert obj.plugin_manager.load_plugins_for_arguments.call_count == 2
+    assert parser.parse_args.call_count == 2
+
+
+@patch('argparse.ArgumentParser')
+@patch.object(app.Awsume, '__init__')
+def test_parse_args_rebuilds_parser_for_new_plugins(__init__: MagicMock, ArgumentParser: MagicMock):
+    __init__.return_value = None
+    parser = MagicMock()
+    parser.parse_args.return_value = argparse.Namespace(refresh_autocomplete=False, list_plugins=False)
+    ArgumentParser.return_value = parser
+    obj = app.Awsume()
+    obj.config = {}
+    obj.plugin_manager = MagicMock()
+    obj.plugin_manager.list_name_plugin.return_value = [('plugin', MagicMock())]
+
+    obj.parse_args([])
+    obj.plugin_manager.list_name_plugin.return_value = [('plugin', MagicMock()), ('lazy-plugin', MagicMock())]
+    obj.parse_args(['--lazy-flag'])
+
+    assert ArgumentParser.call_count == 2
+    assert obj.plugin_manager.hook.add_arguments.call_count == 2
+
+
 @patch('json.dump')
 @patch.object(app, 'open')
 @patch('argparse.ArgumentParser')
@@ -308,3 +357,91 @@ def test_run_auto_refresh(__init__: MagicMock, isatty: MagicMock):
     obj.export_data.assert_called_with(obj.parse_args.return_value, obj.get_profiles.return_value, obj.get_credentials.return_value, 'Auto', [
         'autoawsume-default', 'us-east-1', 'default',
     ])
+
+
+@patch.object(app.default_plugins, 'resolve_role_chains')
+@patch.object(app.Awsume, '__init__')
+def test_run_many(__init__: MagicMock, resolve_role_chains: MagicMock):
+    __init__.return_value = None
+    obj = app.Awsume()
+    obj.config = {}
+    obj.plugin_manager = MagicMock()
+    obj.parse_args = MagicMock()
+    obj.get_profiles = MagicMock()
+    obj.export_data = MagicMock()
+    obj.parse_args.return_value = argparse.Namespace(role_arn=None, json=None, with_saml=False, with_web_identity=False, auto_refresh=False, output_profile=None, target_profile_name='default')
+    obj.get_profiles.return_value = {'dev': {}, 'prod': {}}
+    error = exceptions.RoleAuthenticationError('denied')
+    resolve_role_chains.return_value = {'dev': {'AccessKeyId': 'AKIA...'}, 'prod': error}
+
+    result = obj.run_many(['dev', 'prod'], [], max_workers=4)
+
+    obj.parse_args.assert_called_once_with([])
+    obj.get_profiles.assert_called_once()
+    assert sorted(resolve_role_chains.call_args[0][3]) == ['dev', 'prod']
+    assert resolve_role_chains.call_args[0][4] == 4
+    assert result['dev'] == obj.export_data.return_value
+    assert result['prod'] is error
+    assert obj.export_data.call_args[0][0].target_profile_name == 'dev'
+
+
+@patch.object(app, 'get_profile_name')
+@patch.object(app.default_plugins, 'get_credentials_handler')
+@patch.object(app.Awsume, '__init__')
+def test_run_many_partial_results(__init__: MagicMock, get_credentials_handler: MagicMock, get_profile_name: MagicMock):
+    __init__.return_value = None
+    obj = app.Awsume()
+    obj.config = {}
+    obj.plugin_manager = MagicMock()
+    obj.parse_args = MagicMock()
+    obj.get_profiles = MagicMock()
+    obj.export_data = MagicMock(side_effect=lambda arguments, *_: {'profile': arguments.target_profile_name})
+    obj.parse_args.return_value = argparse.Namespace(role_arn=None, json=None, with_saml=False, with_web_identity=False, auto_refresh=False, output_profile=None, target_profile_name='default', role_duration=None, region=None, source_profile=None)
+    obj.get_profiles.return_value = {
+        'good': {'aws_access_key_id': 'AKIA...', 'aws_secret_access_key': 'SECRET'},
+        'loop-a': {'role_arn': 'arn:aws:iam::111111111111:role/a', 'source_profile': 'loop-b'},
+        'loop-b': {'role_arn': 'arn:aws:iam::222222222222:role/b', 'source_profile': 'loop-a'},
+    }
+    def profile_name(config, profiles, profile_name, log):
+        if profile_name not in profiles:
+            raise exceptions.ProfileNotFoundError(profile_name=profile_name)
+        return profile_name
+    get_profile_name.side_effect = profile_name
+    get_credentials_handler.return_value = {'AccessKeyId': 'AKIA...'}
+
+    result = obj.run_many(['good', 'loop-a', 'missing'], [], max_workers=2)
+
+    assert result['good'] == {'profile': 'good'}
+    assert isinstance(result['loop-a'], exceptions.InvalidProfileError)
+    assert isinstance(result['missing'], exceptions.ProfileNotFoundError)
+
+
+@patch.object(app.Awsume, '__init__')
+def test_run_many_rejects_output_profile(__init__: MagicMock):
+    __init__.return_value = None
+    obj = app.Awsume()
+    obj.config = {}
+    obj.parse_args = MagicMock()
+    obj.parse_args.return_value = argparse.Namespace(role_arn=None, json=None, with_saml=False, with_web_identity=False, auto_refresh=False, output_profile='out')
+
+    with pytest.raises(exceptions.ValidationException):
+        obj.run_many(['dev'], [])
+
+
+@patch('awsume.awsumepy.lib.plugin_stats.update_plugin_stats')
+@patch.object(app, 'safe_print')
+@patch.object(app.Awsume, '__init__')
+def test_report_timings_warns_about_slow_plugins(__init__: MagicMock, safe_print: MagicMock, update_plugin_stats: MagicMock):
+    __init__.return_value = None
+    obj = app.Awsume()
+    obj.config = {'plugin-budget': 100, 'plugin-stats': True}
+    obj.is_interactive = True
+    app.timings.reset()
+    app.timings.record('plugin:get_credentials', 0.25, plugin='slow-plugin')
+
+    obj.report_timings([])
+
+    safe_print.assert_called_once()
+    assert 'slow-plugin took 250ms in get_credentials (budget 100ms)' in safe_print.call_args[0][0]
+    update_plugin_stats.assert_called_once_with(app.timings.phases)
+    app.timings.reset()
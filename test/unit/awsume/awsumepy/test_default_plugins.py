@@ -25,6 +25,7 @@ def generate_namespace_with_defaults(
         principal_arn=None,
         profile_name=None,
         who=None,
+        force_refresh=None,
         **kwargs
 ) -> argparse.Namespace:
     arns = [] if session_policy_arns is None else session_policy_arns
@@ -44,6 +45,7 @@ def generate_namespace_with_defaults(
         principal_arn=principal_arn,
         profile_name=profile_name,
         who=who,
+        force_refresh=force_refresh,
         **kwargs
     )
 
@@ -437,6 +439,7 @@ def test_assume_role_from_cli(aws_lib: MagicMock, profile_lib: MagicMock):
         external_id=arguments.external_id,
         role_duration=0,
         tags=None,
+        ignore_cache=arguments.force_refresh,
     )
 
 
@@ -475,7 +478,8 @@ def test_assume_role_from_cli_source_profile(aws_lib: MagicMock, profile_lib: Ma
         region=profile_lib.get_region.return_value,
         external_id=arguments.external_id,
         role_duration=0,
-        tags=None
+        tags=None,
+        ignore_cache=arguments.force_refresh
     )
 
 
@@ -517,6 +521,7 @@ def test_assume_role_from_cli_source_profile_role_duration_mfa(aws_lib: MagicMoc
         mfa_serial='mymfaserial',
         mfa_token='123123',
         tags=None,
+        ignore_cache=arguments.force_refresh,
     )
 
 
@@ -555,6 +560,7 @@ def test_assume_role_from_cli_source_profile_role_duration_no_mfa(aws_lib: Magic
         external_id=arguments.external_id,
         role_duration='43200',
         tags=None,
+        ignore_cache=arguments.force_refresh,
     )
 
 
@@ -601,6 +607,7 @@ def test_assume_role_from_cli_source_profile_no_role_duration_mfa(aws_lib: Magic
         external_id=arguments.external_id,
         role_duration=0,
         tags=None,
+        ignore_cache=arguments.force_refresh,
     )
 
 
@@ -639,6 +646,7 @@ def test_assume_role_from_cli_source_profile_no_role_duration_no_mfa(aws_lib: Ma
         external_id=arguments.external_id,
         role_duration=0,
         tags=None,
+        ignore_cache=arguments.force_refresh,
     )
 
 
@@ -713,6 +721,7 @@ def test_get_credentials(aws_lib: MagicMock, create_autoawsume_profile: MagicMoc
         external_id='myexternalid',
         role_duration=0,
         tags=None,
+        ignore_cache=arguments.force_refresh,
     )
     assert result == aws_lib.assume_role.return_value
 
@@ -766,7 +775,8 @@ def test_get_credentials_auto_refresh(aws_lib: MagicMock, create_autoawsume_prof
         region=None,
         external_id='myexternalid',
         role_duration=0,
-        tags=None
+        tags=None,
+        ignore_cache=arguments.force_refresh
     )
     assert result == aws_lib.assume_role.return_value
 
@@ -813,6 +823,7 @@ def test_get_credentials_role_duration(aws_lib: MagicMock, create_autoawsume_pro
         mfa_serial='mymfaserial',
         mfa_token='123123',
         tags=None,
+        ignore_cache=arguments.force_refresh,
     )
     assert result == aws_lib.assume_role.return_value
 
@@ -927,6 +938,7 @@ def test_get_credentials_no_mfa_role(aws_lib: MagicMock, create_autoawsume_profi
         external_id='myexternalid',
         role_duration=0,
         tags=None,
+        ignore_cache=arguments.force_refresh,
     )
     assert result == aws_lib.assume_role.return_value
 
@@ -1035,6 +1047,7 @@ def test_post_add_arguments_session_tags(aws_lib: MagicMock):
             }
         ],
         region=arguments.region,
+        ignore_cache=arguments.force_refresh,
     )
 
 @patch.object(Path, 'is_file')
@@ -1079,3 +1092,210 @@ def test_get_credentials_process_target_and_arguments_expands_user():
     expected = [str(expanded_process_file), "arg1", "arg2"]
     actual = default_plugins.get_credentials_process_target_and_arguments(target_profile)
     assert actual == expected
+
+
+@patch('awsume.awsumepy.lib.cache.get_config')
+@patch.object(default_plugins, 'run_credential_process')
+@patch.object(default_plugins, 'get_credentials_process_target_and_arguments')
+@patch.object(default_plugins.cache_lib, 'cache_lock')
+@patch.object(default_plugins.cache_lib, 'write_aws_cache')
+@patch.object(default_plugins.cache_lib, 'read_cached_session')
+def test_get_credentials_from_credential_process_cache_hit(read_cached_session: MagicMock, write_aws_cache: MagicMock, cache_lock: MagicMock, get_credentials_process_target_and_arguments: MagicMock, run_credential_process: MagicMock, get_config: MagicMock):
+    get_config.return_value = {}
+    get_credentials_process_target_and_arguments.return_value = ['/bin/creds', 'profile']
+    cache_session = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET', 'SessionToken': 'LONGSECRET', 'Region': 'us-east-1'}
+    read_cached_session.return_value = cache_session, cache_session
+    arguments = generate_namespace_with_defaults(region='us-east-1')
+
+    result = default_plugins.get_credentials_from_credential_process({}, arguments, {}, {}, 'profile')
+
+    assert result == cache_session
+    assert read_cached_session.call_args[0][2] == 300
+    run_credential_process.assert_not_called()
+    write_aws_cache.assert_not_called()
+
+
+@patch('awsume.awsumepy.lib.cache.get_config')
+@patch.object(default_plugins, 'run_credential_process')
+@patch.object(default_plugins, 'get_credentials_process_target_and_arguments')
+@patch.object(default_plugins.cache_lib, 'cache_lock')
+@patch.object(default_plugins.cache_lib, 'write_aws_cache')
+@patch.object(default_plugins.cache_lib, 'read_cached_session')
+def test_get_credentials_from_credential_process_cache_miss(read_cached_session: MagicMock, write_aws_cache: MagicMock, cache_lock: MagicMock, get_credentials_process_target_and_arguments: MagicMock, run_credential_process: MagicMock, get_config: MagicMock):
+    get_config.return_value = {}
+    get_credentials_process_target_and_arguments.return_value = ['/bin/creds', 'profile']
+    read_cached_session.return_value = None, None
+    session = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET', 'SessionToken': 'LONGSECRET', 'Expiration': 'tomorrow'}
+    run_credential_process.return_value = session
+    arguments = generate_namespace_with_defaults(region='us-east-1')
+
+    result = default_plugins.get_credentials_from_credential_process({}, arguments, {}, {}, 'profile')
+
+    assert result == write_aws_cache.return_value
+    cache_file_name = read_cached_session.call_args[0][0]
+    assert cache_file_name.startswith('aws-credential-process-')
+    cache_lock.assert_called_with(cache_file_name)
+    write_aws_cache.assert_called_with(cache_file_name, session)
+
+
+@patch('awsume.awsumepy.lib.cache.get_config')
+@patch.object(default_plugins, 'run_credential_process')
+@patch.object(default_plugins, 'get_credentials_process_target_and_arguments')
+@patch.object(default_plugins.cache_lib, 'cache_lock')
+@patch.object(default_plugins.cache_lib, 'write_aws_cache')
+@patch.object(default_plugins.cache_lib, 'read_cached_session')
+def test_get_credentials_from_credential_process_without_expiration(read_cached_session: MagicMock, write_aws_cache: MagicMock, cache_lock: MagicMock, get_credentials_process_target_and_arguments: MagicMock, run_credential_process: MagicMock, get_config: MagicMock):
+    get_config.return_value = {}
+    get_credentials_process_target_and_arguments.return_value = ['/bin/creds']
+    read_cached_session.return_value = None, None
+    session = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET'}
+    run_credential_process.return_value = session
+    arguments = generate_namespace_with_defaults(region='us-east-1')
+
+    result = default_plugins.get_credentials_from_credential_process({}, arguments, {}, {}, 'profile')
+
+    assert result == session
+    write_aws_cache.assert_not_called()
+
+
+@patch('awsume.awsumepy.lib.cache.get_config')
+@patch.object(default_plugins, 'run_credential_process')
+@patch.object(default_plugins, 'get_credentials_process_target_and_arguments')
+@patch.object(default_plugins.cache_lib, 'cache_lock')
+@patch.object(default_plugins.cache_lib, 'write_aws_cache')
+@patch.object(default_plugins.cache_lib, 'read_cached_session')
+def test_get_credentials_from_credential_process_force_refresh(read_cached_session: MagicMock, write_aws_cache: MagicMock, cache_lock: MagicMock, get_credentials_process_target_and_arguments: MagicMock, run_credential_process: MagicMock, get_config: MagicMock):
+    get_config.return_value = {}
+    get_credentials_process_target_and_arguments.return_value = ['/bin/creds']
+    run_credential_process.return_value = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET', 'SessionToken': 'LONGSECRET', 'Expiration': 'tomorrow'}
+    arguments = generate_namespace_with_defaults(region='us-east-1', force_refresh=True)
+
+    result = default_plugins.get_credentials_from_credential_process({}, arguments, {}, {}, 'profile')
+
+    assert result == write_aws_cache.return_value
+    read_cached_session.assert_not_called()
+    run_credential_process.assert_called_once()
+
+
+@patch('awsume.awsumepy.lib.cache.get_config')
+@patch.object(default_plugins, 'run_credential_process')
+@patch.object(default_plugins, 'get_credentials_process_target_and_arguments')
+@patch.object(default_plugins.cache_lib, 'cache_lock')
+@patch.object(default_plugins.cache_lib, 'write_aws_cache')
+@patch.object(default_plugins.cache_lib, 'read_cached_session')
+def test_get_credentials_from_credential_process_falls_back_to_stale(read_cached_session: MagicMock, write_aws_cache: MagicMock, cache_lock: MagicMock, get_credentials_process_target_and_arguments: MagicMock, run_credential_process: MagicMock, get_config: MagicMock):
+    get_config.return_value = {}
+    get_credentials_process_target_and_arguments.return_value = ['/bin/creds']
+    stale_session = {'AccessKeyId': 'AKIA...', 'SecretAccessKey': 'SECRET', 'SessionToken': 'LONGSECRET'}
+    read_cached_session.return_value = None, stale_session
+    run_credential_process.side_effect = exceptions.NoCredentialsError('credential_process error')
+    arguments = generate_namespace_with_defaults(region='us-east-1')
+
+    result = default_plugins.get_credentials_from_credential_process({}, arguments, {}, {}, 'profile')
+
+    assert result == stale_session
+    write_aws_cache.assert_not_called()
+
+    read_cached_session.return_value = None, None
+    with pytest.raises(exceptions.NoCredentialsError):
+        default_plugins.get_credentials_from_credential_process({}, arguments, {}, {}, 'profile')
+
+
+def test_plan_role_chains():
+    profiles = {
+        'bastion': {'aws_access_key_id': 'AKIA...', 'aws_secret_access_key': 'SECRET'},
+        'org-admin': {'role_arn': 'arn:aws:iam::123123123123:role/admin', 'source_profile': 'bastion'},
+        'workload-a': {'role_arn': 'arn:aws:iam::111111111111:role/admin', 'source_profile': 'org-admin'},
+        'workload-b': {'role_arn': 'arn:aws:iam::222222222222:role/admin', 'source_profile': 'org-admin'},
+    }
+    arguments = generate_namespace_with_defaults(role_duration=None, role_arn=None)
+
+    tree = default_plugins.plan_role_chains({}, arguments, profiles, ['workload-a', 'workload-b', 'org-admin'])
+
+    assert list(tree) == [('bastion', None)]
+    org_admin = tree[('bastion', None)]['children'][('org-admin', None)]
+    assert org_admin['targets'] == ['org-admin']
+    assert sorted(org_admin['children']) == [('workload-a', None), ('workload-b', None)]
+    assert org_admin['children'][('workload-a', None)]['arguments'].target_profile_name == 'workload-a'
+
+
+def test_plan_role_chains_regions():
+    profiles = {
+        'user': {'aws_access_key_id': 'AKIA...', 'aws_secret_access_key': 'SECRET', 'region': 'us-east-1'},
+        'bastion': {'role_arn': 'arn:aws:iam::123123123123:role/bastion', 'source_profile': 'user', 'region': 'eu-west-1'},
+        'app': {'role_arn': 'arn:aws:iam::111111111111:role/app', 'source_profile': 'bastion', 'region': 'ap-southeast-2'},
+    }
+    arguments = generate_namespace_with_defaults(role_duration=None, role_arn=None)
+
+    for target_profile_names in [['bastion', 'app'], ['app', 'bastion']]:
+        tree = default_plugins.plan_role_chains({}, arguments, profiles, target_profile_names)
+
+        assert sorted(tree) == [('user', 'ap-southeast-2'), ('user', 'eu-west-1')]
+        bastion = tree[('user', 'eu-west-1')]['children'][('bastion', 'eu-west-1')]
+        assert bastion['targets'] == ['bastion']
+        assert bastion['arguments'].target_profile_name == 'bastion'
+        app_bastion = tree[('user', 'ap-southeast-2')]['children'][('bastion', 'ap-southeast-2')]
+        assert app_bastion['targets'] == []
+        assert app_bastion['children'][('app', 'ap-southeast-2')]['targets'] == ['app']
+
+
+@patch.object(default_plugins, 'get_credentials_handler')
+def test_resolve_role_chains(get_credentials_handler: MagicMock):
+    profiles = {
+        'bastion': {'aws_access_key_id': 'AKIA...', 'aws_secret_access_key': 'SECRET'},
+        'org-admin': {'role_arn': 'arn:aws:iam::123123123123:role/admin', 'source_profile': 'bastion'},
+        'workload-a': {'role_arn': 'arn:aws:iam::111111111111:role/admin', 'source_profile': 'org-admin'},
+        'workload-b': {'role_arn': 'arn:aws:iam::222222222222:role/admin', 'source_profile': 'org-admin'},
+    }
+    arguments = generate_namespace_with_defaults(role_duration=None, role_arn=None)
+    def handler(config, arguments, profiles, profile_name, credentials):
+        if profile_name == 'workload-b':
+            raise exceptions.RoleAuthenticationError('denied')
+        return {'AccessKeyId': profile_name, 'Source': credentials}
+    get_credentials_handler.side_effect = handler
+
+    result = default_plugins.resolve_role_chains({}, arguments, profiles, ['workload-a', 'workload-b'], max_workers=2)
+
+    called_profiles = [_[1]['profile_name'] for _ in get_credentials_handler.call_args_list]
+    assert sorted(called_profiles) == ['bastion', 'org-admin', 'workload-a', 'workload-b']
+    assert result['workload-a']['AccessKeyId'] == 'workload-a'
+    assert result['workload-a']['Source']['AccessKeyId'] == 'org-admin'
+    assert isinstance(result['workload-b'], exceptions.RoleAuthenticationError)
+
+
+@patch.object(default_plugins, 'get_credentials_handler')
+def test_resolve_role_chains_invalid_profiles(get_credentials_handler: MagicMock):
+    profiles = {
+        'good': {'aws_access_key_id': 'AKIA...', 'aws_secret_access_key': 'SECRET'},
+        'loop-a': {'role_arn': 'arn:aws:iam::111111111111:role/a', 'source_profile': 'loop-b'},
+        'loop-b': {'role_arn': 'arn:aws:iam::222222222222:role/b', 'source_profile': 'loop-a'},
+        'orphan': {'role_arn': 'arn:aws:iam::333333333333:role/c', 'source_profile': 'missing', 'mfa_serial': 'mymfaserial'},
+    }
+    arguments = generate_namespace_with_defaults(role_duration=None, role_arn=None)
+    get_credentials_handler.side_effect = lambda config, arguments, profiles, profile_name, credentials: {'AccessKeyId': profile_name}
+
+    result = default_plugins.resolve_role_chains({}, arguments, profiles, ['good', 'loop-a', 'orphan'], max_workers=2)
+
+    assert result['good'] == {'AccessKeyId': 'good'}
+    assert isinstance(result['loop-a'], exceptions.InvalidProfileError)
+    assert isinstance(result['orphan'], exceptions.InvalidProfileError)
+    with pytest.raises(exceptions.InvalidProfileError):
+        default_plugins.plan_role_chains({}, arguments, profiles, ['good', 'loop-a'])
+
+
+@patch.object(default_plugins, 'get_credentials_handler')
+def test_resolve_role_chains_target_region(get_credentials_handler: MagicMock):
+    profiles = {
+        'user': {'aws_access_key_id': 'AKIA...', 'aws_secret_access_key': 'SECRET'},
+        'bastion': {'role_arn': 'arn:aws:iam::123123123123:role/bastion', 'source_profile': 'user', 'region': 'eu-west-1'},
+        'app': {'role_arn': 'arn:aws:iam::111111111111:role/app', 'source_profile': 'bastion', 'region': 'ap-southeast-2'},
+    }
+    arguments = generate_namespace_with_defaults(role_duration=None, role_arn=None)
+    def handler(config, arguments, profiles, profile_name, credentials):
+        return {'AccessKeyId': profile_name, 'Region': default_plugins.profile_lib.get_region(profiles, arguments, config)}
+    get_credentials_handler.side_effect = handler
+
+    result = default_plugins.resolve_role_chains({}, arguments, profiles, ['app', 'bastion'], max_workers=2)
+
+    assert result['bastion'] == {'AccessKeyId': 'bastion', 'Region': 'eu-west-1'}
+    assert result['app'] == {'AccessKeyId': 'app', 'Region': 'ap-southeast-2'}
@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+import subprocess
+from pathlib import Path
+
+import awsume
+
+STARTUP_BUDGET = float(os.environ.get('AWSUME_STARTUP_BUDGET', '1.5'))
+DEFERRED_MODULES = ['boto3', 'botocore', 'psutil', 'dateutil', 'xmltodict']
+STARTUP_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+sys.argv = ['awsumepy'] + sys.argv[1:]
+from awsume.awsumepy.main import main
+main()
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}), file=sys.stderr)
+"""
+
+
+def run_awsumepy(tmp_path: Path, *arguments: str) -> dict:
+    environment = {**os.environ, 'HOME': str(tmp_path)}
+    for variable in ['XDG_CONFIG_HOME', 'XDG_DATA_HOME', 'XDG_CACHE_HOME', 'XDG_STATE_HOME']:
+        environment.pop(variable, None)
+    environment['PYTHONPATH'] = str(Path(awsume.__file__).parent.parent)
+    result = subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT, *arguments],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=environment,
+        cwd=str(tmp_path),
+    )
+    assert result.returncode == 0, result.stderr.decode('utf-8')
+    return json.loads(result.stderr.decode('utf-8').strip().splitlines()[-1])
+
+
+def test_version_does_not_import_deferred_modules(tmp_path: Path):
+    run_awsumepy(tmp_path, '--version') # first run creates the config files
+    result = run_awsumepy(tmp_path, '--version')
+    imported = [module for module in DEFERRED_MODULES if module in result['modules']]
+    assert imported == []
+
+
+def test_version_startup_budget(tmp_path: Path):
+    run_awsumepy(tmp_path, '--version')
+    result = run_awsumepy(tmp_path, '--version')
+    assert result['elapsed'] < STARTUP_BUDGET
@@ -0,0 +1,190 @@
+import os
+import sys
+import stat
+import threading
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from awsume.daemon import main as daemon_main
+from awsume.daemon import client as daemon_client
+from awsume.awsumepy.lib.exceptions import PromptRequiredError
+
+
+def get_daemon(app: MagicMock) -> daemon_main.AwsumeDaemon:
+    daemon = daemon_main.AwsumeDaemon.__new__(daemon_main.AwsumeDaemon)
+    daemon.app = app
+    daemon.request_lock = threading.Lock()
+    daemon.renewals = {}
+    daemon.stop_renewing = threading.Event()
+    return daemon
+
+
+@patch.object(daemon_main, 'load_config')
+def test_run_request(load_config: MagicMock):
+    load_config.return_value = {}
+    app = MagicMock()
+    app.run.side_effect = lambda arguments: print('Awsume AKIA...')
+    daemon = get_daemon(app)
+
+    result = daemon.run_request({'arguments': ['myprofile'], 'environment': {'AWS_PROFILE': 'other'}})
+
+    app.run.assert_called_with(['myprofile'])
+    assert result == {'stdout': 'Awsume AKIA...\n', 'stderr': '', 'status': 0}
+    assert app.config['is_interactive'] is True
+
+
+@patch.object(daemon_main, 'load_config')
+def test_run_request_exit_status(load_config: MagicMock):
+    load_config.return_value = {}
+    app = MagicMock()
+    app.run.side_effect = SystemExit(1)
+    daemon = get_daemon(app)
+
+    result = daemon.run_request({'arguments': ['myprofile'], 'environment': {}})
+
+    assert result['status'] == 1
+
+
+@patch.object(daemon_main, 'load_config')
+def test_run_request_restores_environment(load_config: MagicMock):
+    load_config.return_value = {}
+    app = MagicMock()
+    seen = {}
+    app.run.side_effect = lambda arguments: seen.update(dict(daemon_main.os.environ))
+    daemon = get_daemon(app)
+    original_environment = dict(daemon_main.os.environ)
+
+    daemon.run_request({'arguments': [], 'environment': {'AWS_PROFILE': 'myprofile'}})
+
+    assert seen == {'AWS_PROFILE': 'myprofile', 'AWSUME_NO_PROMPT': 'true'}
+    assert dict(daemon_main.os.environ) == original_environment
+
+
+@patch.object(daemon_main, 'load_config')
+def test_run_request_prompt_falls_back(load_config: MagicMock):
+    load_config.return_value = {}
+    app = MagicMock()
+    app.run.side_effect = PromptRequiredError()
+    daemon = get_daemon(app)
+
+    result = daemon.run_request({'arguments': ['mfa-profile'], 'environment': {}})
+
+    assert result == {'fallback': True}
+
+
+@patch.object(daemon_main, 'load_config')
+def test_run_request_error_does_not_fall_back(load_config: MagicMock):
+    load_config.return_value = {}
+    app = MagicMock()
+    app.run.side_effect = lambda arguments: input()
+    daemon = get_daemon(app)
+
+    result = daemon.run_request({'arguments': ['myprofile'], 'environment': {}})
+
+    assert 'fallback' not in result
+    assert result['status'] == 1
+    assert 'Awsume error' in result['stderr']
+
+
+@patch.object(daemon_main, 'Awsume')
+def test_socket_is_private(Awsume: MagicMock, tmp_path):
+    socket_path = str(tmp_path / 'awsumed.sock')
+    original_umask = os.umask(0o022)
+    try:
+        daemon = daemon_main.AwsumeDaemon(socket_path)
+        daemon.server_close()
+        assert os.umask(0o022) == 0o022
+    finally:
+        os.umask(original_umask)
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) & 0o077 == 0
+
+
+@patch.object(daemon_client, 'fallback')
+@patch.object(daemon_client, 'send_request')
+def test_client_fallback_when_daemon_not_running(send_request: MagicMock, fallback: MagicMock):
+    send_request.side_effect = FileNotFoundError()
+    fallback.side_effect = SystemExit(0)
+    with patch.object(sys, 'argv', ['awsumed-client', 'myprofile']):
+        try:
+            daemon_client.main()
+        except SystemExit:
+            pass
+    fallback.assert_called_with(['myprofile'])
+
+
+def test_redact_arguments():
+    arguments = ['myprofile', '--mfa-token', '123456', '--json={"SessionToken": "LONG"}', '-r', '--region', 'us-east-1']
+
+    assert daemon_main.redact_arguments(arguments) == ['myprofile', '--mfa-token', '***', '--json=***', '-r', '--region', '***']
+    assert daemon_main.redact_arguments(['--json', '{"SessionToken": "LONG"}']) == ['--json', '***']
+
+
+@patch.object(daemon_main, 'load_config')
+def test_run_request_logs_no_secrets(load_config: MagicMock):
+    daemon = get_daemon(MagicMock())
+
+    with patch.object(daemon_main.logger, 'info') as info:
+        daemon.run_request({'arguments': ['myprofile', '--mfa-token', '123456'], 'environment': {}})
+
+    assert '123456' not in str(info.call_args_list)
+    assert 'myprofile' in str(info.call_args_list)
+
+
+@patch.object(daemon_main, 'load_config')
+def test_run_request_logs_to_stderr(load_config: MagicMock):
+    app = MagicMock()
+    app.run.side_effect = lambda arguments: daemon_main.awsume_logger.warning('Something to say')
+    daemon = get_daemon(app)
+
+    result = daemon.run_request({'arguments': ['myprofile'], 'environment': {}})
+
+    assert 'Something to say' in result['stderr']
+    assert daemon_main.LOG_HANDLER.stream is sys.__stderr__
+
+
+def get_session(expiration: datetime) -> MagicMock:
+    session = MagicMock()
+    session.awsume_credentials = {'AccessKeyId': 'ASIA...', 'Expiration': expiration}
+    return session
+
+
+@patch.object(daemon_main.cache_lib, 'get_refresh_margin')
+@patch.object(daemon_main, 'load_config')
+def test_renew_due(load_config: MagicMock, get_refresh_margin: MagicMock):
+    load_config.return_value = {}
+    get_refresh_margin.return_value = 300
+    now = datetime.now()
+    app = MagicMock()
+    app.run.return_value = get_session(now + timedelta(minutes=10))
+    daemon = get_daemon(app)
+    daemon.run_request({'arguments': ['myprofile', '-r'], 'environment': {'AWS_REGION': 'us-east-1'}})
+    daemon.run_request({'arguments': ['other', '--mfa-token', '123456'], 'environment': {}})
+    assert len(daemon.renewals) == 1
+
+    daemon.renew_due(now.timestamp())
+    assert app.run.call_count == 2 # not due yet
+
+    app.run.return_value = get_session(now + timedelta(hours=1))
+    daemon.renew_due((now + timedelta(minutes=6)).timestamp())
+    app.run.assert_called_with(['myprofile'])
+    assert list(daemon.renewals.values())[0]['expiration'] == (now + timedelta(hours=1)).timestamp()
+
+    app.run.return_value = get_session(now + timedelta(hours=1)) # the credentials weren't renewed, e.g. they need MFA
+    daemon.renew_due((now + timedelta(minutes=56)).timestamp())
+    assert daemon.renewals == {}
+
+
+@patch.object(daemon_main.cache_lib, 'get_refresh_margin')
+@patch.object(daemon_main, 'load_config')
+def test_renew_due_forgets_unused(load_config: MagicMock, get_refresh_margin: MagicMock):
+    load_config.return_value = {}
+    get_refresh_margin.return_value = 300
+    app = MagicMock()
+    app.run.return_value = get_session(datetime.now())
+    daemon = get_daemon(app)
+    daemon.run_request({'arguments': ['myprofile'], 'environment': {}})
+
+    daemon.renew_due(daemon_main.time.time() + daemon_main.RENEWAL_TTL + 1)
+
+    assert app.run.call_count == 1
+    assert daemon.renewals == {}
@@ -0,0 +1,124 @@
+import threading
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import boto3
+import pytest
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from awsume.awsumepy.lib import aws, constants
+from awsume.fake_sts import main as fake_sts
+
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(*argv):
+        server = fake_sts.FakeStsServer(('127.0.0.1', 0), fake_sts.get_parser().parse_args(['--seed', '0', *argv]))
+        threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        servers.append(server)
+        return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def get_sts_client(endpoint_url: str, credentials: dict = None):
+    credentials = credentials or {'AccessKeyId': 'AKIAFAKE', 'SecretAccessKey': 'SECRET'}
+    return boto3.session.Session(
+        aws_access_key_id=credentials['AccessKeyId'],
+        aws_secret_access_key=credentials['SecretAccessKey'],
+        aws_session_token=credentials.get('SessionToken'),
+        region_name='us-east-1',
+    ).client('sts', endpoint_url=endpoint_url, config=Config(retries={'total_max_attempts': 1}))
+
+
+def test_assume_role(start_server):
+    server, endpoint_url = start_server()
+    client = get_sts_client(endpoint_url)
+
+    response = client.assume_role(RoleArn='arn:aws:iam::123456789012:role/admin', RoleSessionName='mysession', DurationSeconds=900)
+    identity = get_sts_client(endpoint_url, response['Credentials']).get_caller_identity()
+
+    assert response['Credentials']['AccessKeyId'].startswith('ASIA')
+    assert response['AssumedRoleUser']['Arn'] == 'arn:aws:sts::123456789012:assumed-role/admin/mysession'
+    assert 800 < (response['Credentials']['Expiration'] - datetime.now(timezone.utc)).total_seconds() <= 900
+    assert identity['Arn'] == response['AssumedRoleUser']['Arn']
+    assert server.get_stats()['requests'] == {'AssumeRole': 1, 'GetCallerIdentity': 1}
+
+
+def test_get_session_token(start_server):
+    _, endpoint_url = start_server()
+
+    response = get_sts_client(endpoint_url).get_session_token(SerialNumber='arn:aws:iam::123456789012:mfa/me', TokenCode='123456')
+
+    assert response['Credentials']['SessionToken']
+
+
+def test_rate_limit(start_server):
+    server, endpoint_url = start_server('--rate-limit', '0.001', '--burst', '2')
+    client = get_sts_client(endpoint_url)
+
+    client.get_caller_identity()
+    client.get_caller_identity()
+    with pytest.raises(ClientError) as error:
+        client.get_caller_identity()
+
+    assert error.value.response['Error']['Code'] == 'Throttling'
+    assert server.get_stats()['throttled'] == 1
+
+
+def test_failure_rate(start_server):
+    server, endpoint_url = start_server('--failure-rate', '1')
+
+    with pytest.raises(ClientError) as error:
+        get_sts_client(endpoint_url).get_caller_identity()
+
+    assert error.value.response['Error']['Code'] == 'InternalFailure'
+    assert server.get_stats()['failed'] == 1
+
+
+def test_deny_role(start_server):
+    _, endpoint_url = start_server('--deny-role', '*:role/forbidden-*')
+    client = get_sts_client(endpoint_url)
+
+    client.assume_role(RoleArn='arn:aws:iam::123456789012:role/allowed', RoleSessionName='mysession')
+    with pytest.raises(ClientError) as error:
+        client.assume_role(RoleArn='arn:aws:iam::123456789012:role/forbidden-admin', RoleSessionName='mysession')
+
+    assert error.value.response['Error']['Code'] == 'AccessDenied'
+
+
+def test_invalid_action(start_server):
+    server, _ = start_server()
+
+    status, body = server.respond({'Action': 'DecodeAuthorizationMessage'})
+
+    assert status == 400
+    assert '<Code>InvalidAction</Code>' in body
+
+
+def test_token_bucket():
+    bucket = fake_sts.TokenBucket(rate=0.001, burst=2)
+
+    assert [bucket.take() for _ in range(3)] == [True, True, False]
+
+
+@pytest.mark.parametrize('failure', ['--throttle-rate', '--failure-rate'])
+def test_awsume_retries_once_per_attempt(failure, start_server, tmp_path):
+    server, endpoint_url = start_server(failure, '1')
+    aws.clear_sts_client_pool()
+    config = {'sts-endpoint-url': endpoint_url, 'sts-max-attempts': 3}
+    with patch('awsume.awsumepy.lib.cache.get_config', return_value=config), \
+            patch.object(constants, 'AWSUME_CACHE_DIR', str(tmp_path)), \
+            patch('awsume.awsumepy.lib.rate_limit.acquire'), \
+            patch('time.sleep'):
+        with pytest.raises(ClientError):
+            aws.call_sts({'AccessKeyId': 'AKIAFAKE', 'SecretAccessKey': 'SECRET'}, 'us-east-1', 'get_caller_identity')
+    aws.clear_sts_client_pool()
+
+    assert server.get_stats()['requests'] == {'GetCallerIdentity': 3} # botocore doesn't retry on top of awsume
@@ -0,0 +1,49 @@
+import os
+import time
+from unittest.mock import patch, MagicMock
+
+import awsume_autocomplete.awsume_autocomplete as awsume_autocomplete
+
+
+def write_old_file(path, content: str):
+    path.write_text(content)
+    old_time = time.time() - 60
+    os.utime(str(path), (old_time, old_time))
+
+
+def setup_files(tmp_path):
+    write_old_file(tmp_path / 'credentials', '[default]\n[dev-user]\n')
+    write_old_file(tmp_path / 'config', '[profile dev-admin]\n[profile prod-admin]\n')
+    return str(tmp_path / 'config'), str(tmp_path / 'credentials')
+
+
+def test_uniquely_concat_lists():
+    assert awsume_autocomplete.uniquely_concat_lists(['a', 'b'], ['b', 'c', 'c']) == ['a', 'b', 'c']
+
+
+@patch.object(awsume_autocomplete, 'get_cache_dir')
+@patch.object(awsume_autocomplete, 'get_aws_files')
+def test_get_completions(get_aws_files: MagicMock, get_cache_dir: MagicMock, tmp_path):
+    get_aws_files.return_value = setup_files(tmp_path)
+    get_cache_dir.return_value = tmp_path / 'cache'
+
+    assert awsume_autocomplete.get_completions('dev') == ['dev-admin', 'dev-user']
+    assert awsume_autocomplete.get_completions() == ['default', 'dev-admin', 'dev-user', 'prod-admin']
+    assert awsume_autocomplete.get_completions('nope') == []
+
+
+@patch.object(awsume_autocomplete, 'get_cache_dir')
+@patch.object(awsume_autocomplete, 'get_aws_files')
+def test_get_completions_uses_index(get_aws_files: MagicMock, get_cache_dir: MagicMock, tmp_path):
+    get_aws_files.return_value = setup_files(tmp_path)
+    get_cache_dir.return_value = tmp_path / 'cache'
+    awsume_autocomplete.get_completions('dev')
+    assert (tmp_path / 'cache' / 'autocomplete-index.json').is_file()
+
+    with patch.object(awsume_autocomplete, 'build_profile_names') as build_profile_names:
+        result = awsume_autocomplete.get_completions('prod')
+        build_profile_names.assert_not_called()
+    assert result == ['prod-admin']
+
+    write_old_file(tmp_path / 'config', '[profile dev-admin]\n[profile prod-admin]\n[profile prod-user]\n')
+    assert awsume_autocomplete.get_completions('prod') == ['prod-admin', 'prod-user']